@@ -0,0 +1,32 @@
+# -*- coding: iso-8859-1 -*-
+
+"""
+krop: A tool to crop PDF files.
+
+Besides the graphical interface, krop can be used from Python:
+
+    import krop
+    with open('paper.pdf', 'rb') as f:
+        cropped = krop.crop(f, grid='2x1', trim=True)
+
+See krop.headless.crop for the available options.
+
+Copyright (C) 2010-2025 Armin Straub, http://arminstraub.com
+"""
+
+"""
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 3 of the License, or
+(at your option) any later version.
+"""
+
+__all__ = ['crop']
+
+def __getattr__(name):
+    # imported on first use only: loading krop.headless selects and imports
+    # a PDF library, which the graphical interface does later on its own
+    if name == 'crop':
+        from krop.headless import crop
+        return crop
+    raise AttributeError("module 'krop' has no attribute '{0}'".format(name))
@@ -12,8 +12,45 @@ To additionally trim each of these pages:
 
 Automatically crop the margins every single page individually:
     krop --go --selections=individual --grid=1@all --trim file.pdf
+To keep the crops from jumping between pages, use the largest box on 5 consecutive pages of the same parity:
+    krop --go --selections=individual --grid=1@all --trim --trim-smooth=max:5:evenodd file.pdf
+To leave running headers, footers and page numbers outside of these crops:
+    krop --go --selections=individual --grid=1@all --trim --trim-furniture file.pdf
 Omit the --go to further edit the selections in the graphical interface before cropping.
 
+To find one crop for each group of pages with a similar layout (like two-column pages, one-column pages and landscape tables):
+    krop --go --grid=1@layout --trim --trim-use=all file.pdf
+
+To let krop find out whether pages hold 2, 2x2 or more pages each (like scanned handouts):
+    krop --go --grid=auto --trim file.pdf
+
+To split the pages of a multi-column paper into its columns of text (in reading order, with titles and wide figures in between):
+    krop --go --grid=columns file.pdf
+
+To crop out every figure and table caption (each on a page of its own):
+    krop --go --select-matches="^(Figure|Table) [0-9]+" file.pdf
+
+To use different selections for the front matter (pages 1-10) and the rest of a book:
+    krop --go --grid="1@1-10;2x1@11-" --trim file.pdf
+
+To leave out blank pages (like the empty backs of scanned pages), or only the blank parts of split pages:
+    krop --go --grid=2x1 --remove-blank=pages file.pdf
+    krop --go --grid=2x1 --remove-blank=subpages file.pdf
+
+To save the selections (after trimming) as a crop plan and apply them to other files with the same layout:
+    krop --go --grid=2x2 --trim --save-plan=plan.json file.pdf
+    krop --plan=plan.json other.pdf
+
+To use krop in a pipeline, reading from standard input and writing to standard output:
+    curl -s https://example.com/file.pdf | krop --go --grid=2 - -o - > cropped.pdf
+
+To crop many files (or all PDF files in a directory) with the same choices, using several processes:
+    krop --grid=2x1 --jobs=4 --summary=summary.json -o cropped/ *.pdf scans/
+When running this again, only new or changed files need to be cropped:
+    krop --grid=2x1 --jobs=4 --build-cache -o cropped/ *.pdf scans/
+To keep krop running as a service which accepts crop jobs on a Unix socket:
+    krop --serve=/tmp/krop.sock --jobs=4
+
 Copyright (C) 2010-2025 Armin Straub, http://arminstraub.com
 """
 
@@ -29,6 +66,135 @@ import sys
 from krop.version import __version__
 
 
+def readHeadlessSettings(options):
+    """Uses the choices previously made in the graphical interface as
+    defaults for KropOptions, without starting the graphical interface."""
+    try:
+        from krop.qt import QCoreApplication, QSettings
+    except RuntimeError:
+        # Qt is not needed for cropping without the graphical interface
+        options.optimize = True
+        return
+    QCoreApplication.setOrganizationName("arminstraub.com")
+    QCoreApplication.setOrganizationDomain("arminstraub.com")
+    QCoreApplication.setApplicationName("krop")
+    settings = QSettings()
+    options.optimize = settings.value("PDF/Optimize", "gs") == "gs"
+    options.alwaysInclude = settings.value("PDF/IncludePagesWithoutSelections", "") == "true"
+    options.trimUseAllPages = settings.value("Trim/UseAllPages", "") == "true"
+    options.trimPadding = settings.value("Trim/Padding", "2")
+    options.trimAllowedChanges = float(settings.value("Trim/AllowedChanges", "0"))
+    options.trimSensitivity = float(settings.value("Trim/Sensitivity", "5"))
+
+def kropOptions(args):
+    """Returns KropOptions according to the command line."""
+    from shutil import which
+    from krop.options import KropOptions
+    options = KropOptions()
+    readHeadlessSettings(options)
+    options.grid = args.grid
+    options.selections = args.selections
+    options.exceptions = args.exceptions
+    options.initialPage = args.initialpage
+    options.whichPages = args.whichpages
+    options.rotate = args.rotate
+    options.removeBlank = args.remove_blank
+    if args.optimize is not None:
+        options.optimize = args.optimize == "gs"
+    if not which('gs'):
+        options.optimize = False
+    options.trim = args.trim
+    if args.trim_use is not None:
+        options.trimUseAllPages = args.trim_use == "all"
+    if args.trim_padding is not None:
+        options.trimPadding = args.trim_padding
+    options.trimWorkers = args.jobs
+    options.trimSmoothing = args.trim_smooth
+    if args.trim_despeckle is not None:
+        options.trimSpeckSize = args.trim_despeckle
+    options.trimFurniture = args.trim_furniture
+    options.selectMatches = args.select_matches
+    if args.plan:
+        from krop.cropplan import CropPlan, CropPlanError
+        try:
+            options.plan = CropPlan.load(args.plan)
+        except (IOError, CropPlanError) as err:
+            warn("Could not load crop plan", "{0}".format(err))
+            sys.exit(1)
+    options.savePlan = args.save_plan
+    options.buildCache = args.build_cache
+    options.force = args.force
+    return options
+
+def warn(title, text):
+    sys.stderr.write('WARNING: ' + title + '\n' + text + '\n')
+
+def kropHeadless(args, fileName):
+    """Implements --go for jobs which need no pixels (that is, no trimming):
+    the selections only depend on the geometry of the pages, so we neither
+    render nor start the graphical interface.
+
+    This is also used for reading from standard input or writing to
+    standard output (specified as "-"), which is done in memory."""
+    from os.path import splitext
+    from krop.headless import HeadlessDocument, kropFile
+    from krop.pdfcropper import PdfEncryptedError
+
+    options = kropOptions(args)
+    output = args.output
+    if output is None:
+        output = "-" if fileName == "-" else "%s-cropped.pdf" % splitext(fileName)[0]
+    if output == "-":
+        output = sys.stdout.buffer
+    document = None
+    try:
+        if fileName == "-":
+            document = HeadlessDocument(data=sys.stdin.buffer.read())
+        if options.buildCache and isinstance(output, str) and document is None:
+            from krop.buildcache import kropFileCached
+            if kropFileCached(fileName, output, options):
+                sys.stderr.write('{0} is up to date\n'.format(output))
+        else:
+            kropFile(fileName, output, options, document)
+    except PdfEncryptedError:
+        warn("PDF is encrypted", "This PDF needs to be decrypted before cropping. "
+                "You could try to do that using qpdf:"
+                "\nqpdf --password='hello' --decrypt encrypted.pdf decrypted.pdf")
+        return 1
+    except IOError as err:
+        warn("Could not write cropped PDF", "An error occured while reading "
+                "the PDF or writing the cropped PDF. Please check the files "
+                "and their permissions."
+                "\n\nThe official error is:\n\n{0}".format(err))
+        return 1
+    except Exception as err:
+        warn("Something got in our way", "The following unexpected error has occured:"
+                "\n\n{0}".format(err))
+        return 1
+    finally:
+        if document is not None:
+            document.close()
+    if output is sys.stdout.buffer:
+        output.flush()
+    return 0
+
+def kropBatchMode(args):
+    """Crops all files given on the command line in worker processes."""
+    from krop.batch import SUFFIX, collectFiles, outputFileName, kropBatch
+    if args.save_plan:
+        warn("Cannot save crop plan in batch mode", "Please use --save-plan "
+                "with a single file; the plan can then be used for all files with --plan.")
+        return 1
+    suffix = SUFFIX if args.suffix is None else args.suffix
+    files = collectFiles(args.file, args.file_list, suffix)
+    if not files:
+        warn("No PDF files found", "There is nothing to crop.")
+        return 1
+    jobs = [ (i, outputFileName(i, r, args.output, suffix)) for i, r in files ]
+    failed = kropBatch(jobs, kropOptions(args), args.jobs, args.summary)
+    return 1 if failed else 0
+
+
 def main():
     from argparse import ArgumentParser, RawTextHelpFormatter
     parser = ArgumentParser(prog='krop', description=__doc__,
@@ -36,13 +202,15 @@ def main():
 
     parser.add_argument('-v', '--version', action='version', version='%(prog)s ' + __version__)
 
-    parser.add_argument('file', nargs='?', help='PDF file to open')
-    parser.add_argument('-o', '--output', help='where to save the cropped PDF')
+    parser.add_argument('file', nargs='*', help='PDF file to open ("-" for standard input, requires --go; if several files or directories are specified, these are cropped in batch mode)')
+    parser.add_argument('-o', '--output', help='where to save the cropped PDF ("-" for standard output, requires --go; in batch mode: directory for the cropped PDFs; default: next to each file)')
     parser.add_argument('--whichpages', help='which pages (e.g. "1-5" or "1,3-") to include in cropped PDF (default: all)')
+    parser.add_argument('--remove-blank', choices=['pages', 'subpages'], help='leave out blank pages, or, with subpages, also the blank parts of pages (like the empty half of a page split by a grid)')
     parser.add_argument('--rotate', type=int, choices=[0,90,180,270], help='how much to rotate the cropped pdf clockwise (default: 0)')
     parser.add_argument('--optimize', choices=['gs', 'no'], help='whether to optimize the final PDF using ghostscript (default: previous choice)')
 
-    parser.add_argument('--grid', help='if set to 2x3, for instance, creates a 2x3 grid of selections on initial page; if only one number is specified, the number of columns/rows is determined according to whether the page is landscape or portrait')
+    parser.add_argument('--grid', help='if set to 2x3, for instance, creates a 2x3 grid of selections on initial page; if only one number is specified, the number of columns/rows is determined according to whether the page is landscape or portrait; to restrict a grid to a range of pages (regardless of --selections), append them as in 2x1@11-20 or 2x1@11-:odd; several grids can be separated by a semicolon, as in 1@1-10;2x1@11-; with @all, as in 1@all, a grid is created on every page individually (and trimmed on each page with --trim); with auto, as in auto or auto@all, a grid is proposed by looking for gutters that divide a few sample pages evenly (like the pages of a handout); with @layout, as in 2@layout, such a grid is shared by all pages with the same layout (page size, rotation, content and columns), so that --trim finds one crop for each group of similar pages; with columns, as in columns or columns@2-, a selection is created for each column of text found in the text layer of every page (in reading order)')
+    parser.add_argument('--select-matches', metavar='PATTERN', help='creates a selection around each block of text matching PATTERN (a regular expression, ignoring case, like "^Figure [0-9]+"), which applies only to the page it is on; padding is added as for trimming (see --trim-padding)')
 
     parser.add_argument('--initialpage', help='which page to open initially (default: 1)')
     parser.add_argument('--selections', type=str, choices=['all', 'evenodd', 'individual'], help='to which pages should selections apply')
@@ -51,8 +219,23 @@ def main():
     parser.add_argument('--trim', action='store_true', help='if specified, will auto trim initial selections')
     parser.add_argument('--trim-use', type=str, choices=['initial', 'all'], help='whether to inspect only the initial page or all pages (slow!) when auto trimming (default: previous value)')
     parser.add_argument('--trim-padding', help='how much padding to include when auto trimming (default: previous value)')
+    parser.add_argument('--trim-despeckle', type=int, metavar='SIZE', help='ignore specks smaller than SIZE pixels (at 96 dpi) when auto trimming, which helps with noisy scans (default: 0, that is, none)')
+    parser.add_argument('--trim-furniture', action='store_true', help='when trimming grids on every page (see --grid), leave out running headers, footers and page numbers which repeat on many pages')
+    parser.add_argument('--trim-smooth', metavar='SMOOTHING', help='smooth the margins of grids trimmed on every page (see --grid) over neighbouring pages: 5 takes the median over windows of 5 pages, max:5 the largest box, and a trailing :evenodd, as in max:5:evenodd, treats even and odd pages separately')
 
-    parser.add_argument('--go', action='store_true', help='output PDF without opening the krop GUI (using the choices supplied on the command line); if used in a script without X server access, you can run krop using xvfb-run')
+    parser.add_argument('--save-plan', metavar='PLAN', help='save the crop values of all pages as a crop plan (as JSON if PLAN ends with .json, otherwise in a compact binary format)')
+    parser.add_argument('--plan', help='crop according to a crop plan saved with --save-plan, without rendering or trimming (implies --go)')
+
+    parser.add_argument('--build-cache', action='store_true', help='skip files whose output is up to date: a record next to each output stores digests of input and options as well as the versions used (implies --go for a single file)')
+    parser.add_argument('--force', action='store_true', help='with --build-cache, crop files even if their output is up to date')
+
+    parser.add_argument('--go', action='store_true', help='output PDF without opening the krop GUI (using the choices supplied on the command line); unless --trim is used, no X server is needed; otherwise, if used in a script without X server access, you can run krop using xvfb-run')
+
+    parser.add_argument('--file-list', help='file listing PDF files (one per line, "-" for standard input) to crop in batch mode')
+    parser.add_argument('--jobs', type=int, help='number of worker processes in batch mode, for trimming pages individually or for finding blank pages (default: number of CPUs)')
+    parser.add_argument('--suffix', help='in batch mode, what to append to the names of the cropped PDFs (default: -cropped); outputs which would overwrite an input are refused')
+    parser.add_argument('--summary', help='in batch mode, where to write a JSON summary with timings and output sizes for each file')
+    parser.add_argument('--serve', metavar='SOCKET', help='run as a service which accepts crop jobs on the Unix socket SOCKET (see krop.service); other options serve as defaults for the jobs')
 
     parser.add_argument('--use-qt5', action='store_true', help='use PyQt5 instead of PyQt6 (default: use PyQt6 if available)')
     parser.add_argument('--use-pymupdf', action='store_true', help='use PyMuPDF for rendering and cropping (default)')
@@ -63,6 +246,33 @@ def main():
 
     args = parser.parse_args()
 
+    if args.serve:
+        from krop.service import KropService
+        KropService(kropOptions(args), args.jobs).serve(args.serve)
+        sys.exit(0)
+
+    # batch mode never uses the graphical interface
+    from os.path import isdir
+    if len(args.file) > 1 or args.file_list or any(isdir(f) for f in args.file):
+        sys.exit(kropBatchMode(args))
+    fileName = args.file[0] if args.file else None
+
+    # without trimming (or with a crop plan), --go needs no pixels and hence
+    # no graphical interface; standard input and output are only supported
+    # without it; neither is it needed for trimming pages individually
+    if args.plan or args.build_cache:
+        args.go = True
+    streaming = "-" in (fileName, args.output)
+    if streaming and not args.go:
+        warn("Standard input or output requires --go", "The graphical "
+                "interface cannot read from standard input or write to standard output.")
+        sys.exit(1)
+    perPage = args.grid is not None and any(s in args.grid.replace(' ', '')
+            for s in ('@all', '@layout', 'columns'))
+    if args.go and (not args.trim or streaming or perPage or args.select_matches
+            or args.plan or args.build_cache) and fileName is not None:
+        sys.exit(kropHeadless(args, fileName))
+
     from krop.qt import QApplication
     app = QApplication(sys.argv)
     app.setApplicationName("krop")
@@ -74,8 +284,7 @@ def main():
     from krop.mainwindow import MainWindow
     window=MainWindow()
 
-    if args.file is not None:
-        fileName = args.file
+    if fileName is not None:
         window.openFile(fileName)
 
     if args.output is not None:
@@ -103,10 +312,26 @@ def main():
         window.ui.checkTrimUseAllPages.setChecked(args.trim_use == "all")
     if args.trim_padding is not None:
         window.ui.editPadding.setText(args.trim_padding)
+    if args.save_plan is not None:
+        window.planFileName = args.save_plan
+    window.removeBlank = args.remove_blank
+    if args.trim_despeckle is not None:
+        window.trimSpeckSize = args.trim_despeckle
+    window.trimFurniture = args.trim_furniture
+    if args.trim_smooth is not None:
+        from krop.pagetrim import parseSmoothing
+        try:
+            window.trimSmoothing = parseSmoothing(args.trim_smooth)
+        except ValueError:
+            warn("Bad value for smoothing", "Smoothing is specified by the "
+                    "number of pages, optionally preceded by 'median' or 'max' "
+                    "and followed by 'evenodd', as in 'max:5:evenodd'.")
 
     # args.grid is specified as 2x3 for 2 cols, 3 rows
     if args.grid:
         window.createSelectionGrid(args.grid)
+    if args.select_matches:
+        window.selectMatches(args.select_matches)
 
     if args.trim:
         window.slotTrimMarginsAll()
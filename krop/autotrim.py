@@ -15,6 +15,8 @@ the Free Software Foundation; either version 3 of the License, or
 
 from krop.qt import *
 
+from krop.raster import GrayRaster, despeckle, inkEdges
+
 
 def autoTrimMargins(img, r, minr, sensitivity, allowedchanges):
     """Given a QImage img and a QRect r, automatically trims the margins of
@@ -63,3 +65,25 @@ def autoTrimMargins(img, r, minr, sensitivity, allowedchanges):
 
     return r
 
+
+def imageRaster(img):
+    """Returns a GrayRaster of the QImage img."""
+    img = img.convertToFormat(QImage.Format.Format_Grayscale8)
+    ptr = img.constBits()
+    ptr.setsize(img.sizeInBytes())
+    return GrayRaster(img.width(), img.height(), img.bytesPerLine(), bytes(ptr))
+
+
+def imageEdges(img):
+    """Returns the edges of the content of the QImage img (see
+    raster.inkEdges)."""
+    return inkEdges(imageRaster(img))
+
+
+def despeckleImage(img, size):
+    """Returns a black and white copy of the QImage img without specks
+    smaller than size (see raster.despeckle)."""
+    raster = despeckle(imageRaster(img), size)
+    samples = raster.samples
+    return QImage(samples, raster.width, raster.height, raster.stride,
+            QImage.Format.Format_Grayscale8).copy()
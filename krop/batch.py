@@ -0,0 +1,220 @@
+# -*- coding: iso-8859-1 -*-
+
+"""
+Cropping many PDF files at once using a pool of worker processes.
+
+Each worker imports the PDF libraries once and then crops one file after
+another without the graphical interface (see krop.headless). Errors are
+isolated per file. With a build cache, files whose output is up to date
+are skipped (see krop.buildcache).
+
+Copyright (C) 2010-2025 Armin Straub, http://arminstraub.com
+"""
+
+"""
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 3 of the License, or
+(at your option) any later version.
+"""
+
+import json
+import os
+import sys
+import time
+
+
+# appended to the names of the cropped files unless specified otherwise
+SUFFIX = '-cropped'
+
+def isPdfFileName(fileName):
+    return fileName.lower().endswith('.pdf')
+
+def isCroppedFileName(fileName, suffix=SUFFIX):
+    return bool(suffix) and fileName.lower().endswith(suffix.lower() + '.pdf')
+
+def collectFiles(paths, fileListName=None, suffix=SUFFIX):
+    """Returns a list of (inputFileName, relativeName) for the given files,
+    the PDF files found (recursively) in the given directories and the files
+    listed in fileListName (one per line; "-" means standard input).
+    relativeName is used to name the output when writing to a directory.
+    Files in directories whose names end in suffix (and .pdf) are the output
+    of previous runs and skipped."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, names in os.walk(path):
+                dirs.sort()
+                for name in sorted(names):
+                    if isPdfFileName(name) and not isCroppedFileName(name, suffix):
+                        fileName = os.path.join(root, name)
+                        files.append((fileName, os.path.relpath(fileName, path)))
+        else:
+            files.append((path, os.path.basename(path)))
+    if fileListName:
+        f = sys.stdin if fileListName == '-' else open(fileListName)
+        try:
+            for line in f:
+                fileName = line.strip()
+                if fileName:
+                    files.append((fileName, os.path.basename(fileName)))
+        finally:
+            if f is not sys.stdin:
+                f.close()
+    return files
+
+def outputFileName(inputFileName, relativeName, outputDir=None, suffix=SUFFIX):
+    """Returns the name of the output for an input: suffix is appended to
+    the name, and the output is written next to the input or, if outputDir
+    is given, to outputDir (keeping relativeName)."""
+    if outputDir is None:
+        return os.path.splitext(inputFileName)[0] + suffix + '.pdf'
+    return os.path.join(outputDir, os.path.splitext(relativeName)[0] + suffix + '.pdf')
+
+def checkOutputs(jobs):
+    """Returns a dict mapping the index of each job in jobs (pairs of
+    inputFileName and outputFileName) which must not be run to the reason:
+    an output must neither overwrite an input nor be shared by several
+    jobs."""
+    def key(fileName):
+        return os.path.normcase(os.path.realpath(fileName))
+    inputs = { key(i) for i, o in jobs }
+    errors = {}
+    outputs = {}
+    for k, (i, o) in enumerate(jobs):
+        if key(o) in inputs or (os.path.exists(o) and os.path.exists(i)
+                and os.path.samefile(i, o)):
+            errors[k] = 'the output {0} would overwrite an input'.format(o)
+        outputs.setdefault(key(o), []).append(k)
+    for ks in outputs.values():
+        if len(ks) > 1:
+            for k in ks:
+                errors.setdefault(k, 'the output {0} is also the output of '
+                    '{1}'.format(jobs[k][1], ', '.join(jobs[j][0] for j in ks if j != k)))
+    return errors
+
+
+def initWorker(argv):
+    # the PDF libraries are chosen according to the command line (see
+    # krop.pdfcropper), so workers need to see the same arguments
+    sys.argv = argv
+    import krop.headless
+
+def kropWorker(inputFileName, outputFileName, options):
+    """Crops a single file and returns a dict describing the result; this
+    never raises, so that one bad file does not affect the others."""
+    from krop.headless import kropFile
+    from krop.buildcache import kropFileCached
+    result = { 'input': inputFileName, 'output': outputFileName,
+            'status': 'ok', 'error': None, 'seconds': 0.0,
+            'inputSize': None, 'outputSize': None, 'upToDate': False }
+    start = time.perf_counter()
+    try:
+        result['inputSize'] = os.path.getsize(inputFileName)
+        outputDir = os.path.dirname(outputFileName)
+        if outputDir:
+            os.makedirs(outputDir, exist_ok=True)
+        if options.buildCache:
+            result['upToDate'] = kropFileCached(inputFileName, outputFileName, options)
+        else:
+            kropFile(inputFileName, outputFileName, options)
+        result['outputSize'] = os.path.getsize(outputFileName)
+    except Exception as err:
+        result['status'] = 'failed'
+        result['error'] = '{0}: {1}'.format(type(err).__name__, err)
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+def failedResult(inputFileName, outputFileName, error):
+    return { 'input': inputFileName, 'output': outputFileName,
+            'status': 'failed', 'error': error, 'seconds': 0.0,
+            'inputSize': None, 'outputSize': None, 'upToDate': False }
+
+def runJobs(jobs, keys, options, workers, report):
+    """Crops jobs[k] for k in keys on a pool of worker processes, calling
+    report(k, result) for each finished job. No more jobs are submitted
+    than there are workers, so that if a worker dies (for instance, crashes
+    in a PDF library), which breaks the pool, only the jobs in flight are
+    affected. Returns the tuple (unfinished, unstarted) of the keys of the
+    jobs in flight and of those not started when that happened."""
+    from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+    from concurrent.futures.process import BrokenProcessPool
+    workers = workers or os.cpu_count() or 1
+    queue = list(reversed(keys))
+    running = {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=initWorker,
+            initargs=(sys.argv,)) as executor:
+        while queue or running:
+            while queue and len(running) < workers:
+                k = queue.pop()
+                running[executor.submit(kropWorker, jobs[k][0], jobs[k][1], options)] = k
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            unfinished = []
+            for future in done:
+                k = running.pop(future)
+                try:
+                    report(k, future.result())
+                except BrokenProcessPool:
+                    unfinished.append(k)
+                except Exception as err:
+                    report(k, failedResult(jobs[k][0], jobs[k][1],
+                        '{0}: {1}'.format(type(err).__name__, err)))
+            if unfinished:
+                return unfinished + list(running.values()), queue[::-1]
+    return [], []
+
+def kropBatch(jobs, options, workers=None, summaryFileName=None):
+    """Crops all (inputFileName, outputFileName) pairs in jobs according to
+    KropOptions using a pool of worker processes (one per CPU if workers is
+    None). Jobs whose output would overwrite an input or another output are
+    refused (see checkOutputs). Progress is reported on stderr and, if
+    requested, a JSON summary is written to summaryFileName. Returns the
+    number of failed files."""
+    start = time.perf_counter()
+    results = [ None for job in jobs ]
+    done = 0
+
+    def report(k, result):
+        nonlocal done
+        results[k] = result
+        done += 1
+        if result['status'] == 'ok':
+            status = 'up to date' if result['upToDate'] else 'ok'
+        else:
+            status = 'FAILED ({0})'.format(result['error'])
+        sys.stderr.write('[{0}/{1}] {2}: {3} ({4:.2f} s)\n'.format(done,
+            len(jobs), result['input'], status, result['seconds']))
+
+    errors = checkOutputs(jobs)
+    for k, error in sorted(errors.items()):
+        report(k, failedResult(jobs[k][0], jobs[k][1], error))
+    pending = [ k for k in range(len(jobs)) if k not in errors ]
+    if workers == 1:
+        # no need for extra processes
+        for k in pending:
+            report(k, kropWorker(jobs[k][0], jobs[k][1], options))
+        pending = []
+    while pending:
+        unfinished, pending = runJobs(jobs, pending, options, workers, report)
+        # a worker died; to find out which file crashed it, each of the
+        # jobs in flight is run on its own before the others continue on a
+        # fresh pool
+        for k in unfinished:
+            if runJobs(jobs, [k], options, 1, report)[0]:
+                report(k, failedResult(jobs[k][0], jobs[k][1],
+                    'the worker process died while cropping this file'))
+
+    failed = sum(1 for r in results if r['status'] != 'ok')
+    if summaryFileName:
+        summary = { 'files': results, 'ok': len(results) - failed,
+                'failed': failed, 'seconds': time.perf_counter() - start }
+        if options.buildCache:
+            hits = [ r for r in results if r['upToDate'] ]
+            summary['cache'] = { 'hits': len(hits),
+                    'misses': len(results) - len(hits),
+                    'hitSeconds': sum(r['seconds'] for r in hits),
+                    'force': options.force }
+        with open(summaryFileName, 'w') as f:
+            json.dump(summary, f, indent=2)
+    return failed
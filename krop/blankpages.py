@@ -0,0 +1,162 @@
+# -*- coding: iso-8859-1 -*-
+
+"""
+Detecting blank pages (like the empty versos of scanned books), so that they
+can be left out when cropping.
+
+A page, or the part of it given by crop values, is blank if hardly any of
+its pixels are dark when rendered at a low resolution (which also blurs away
+the noise of scans). Pages of digital PDFs whose content streams are empty
+are recognized without rendering. The ink coverages are computed in worker
+processes (see pagetrim.mapPages) and cached, so that cropping again (with
+the same or other selections) only looks at what has not been seen yet.
+
+Copyright (C) 2010-2025 Armin Straub, http://arminstraub.com
+"""
+
+"""
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 3 of the License, or
+(at your option) any later version.
+"""
+
+import hashlib
+import os
+from collections import OrderedDict
+
+from krop.pagegeometry import cropValuesForRotation
+from krop.pagetrim import mapPages, workerDocument, workerRender
+
+
+# resolution used for rendering pages when looking for blank ones
+DPI = 36
+# pixels darker than this count as ink (at low resolution, small print is
+# rendered in light gray)
+THRESHOLD = 192
+# a page (or part of it) is blank if at most this fraction of it is ink
+MAX_COVERAGE = 0.0005
+
+# the crop values of a whole page
+WHOLE_PAGE = (0.0, 0.0, 0.0, 0.0)
+
+
+def inkCoverage(raster, rect=None, threshold=THRESHOLD):
+    """Returns the fraction of pixels darker than threshold within rect =
+    (x0, y0, x1, y1) of a GrayRaster (by default, the whole raster)."""
+    x0, y0, x1, y1 = raster.rect() if rect is None else rect
+    if x1 <= x0 or y1 <= y0:
+        return 0.0
+    # deleting the light pixels leaves the ink, at C speed
+    light = bytes(range(threshold, 256))
+    ink = sum(len(raster.row(y, x0, x1).translate(None, light))
+            for y in range(y0, y1))
+    return ink / ((x1-x0) * (y1-y0))
+
+def hasEmptyContents(page):
+    """Checks whether a PyMuPDF page draws nothing at all, which is decided
+    without rendering it."""
+    if page.first_annot is not None:
+        return False
+    doc = page.parent
+    return not any(doc.xref_stream(xref).strip() for xref in page.get_contents())
+
+def coverageWorker(items, dpi, threshold):
+    """Returns a list of (page index, coverages) for items (page index, list
+    of crop values) where coverages are the ink coverages of the parts of
+    the page given by the crop values (with respect to the unrotated page,
+    as passed to the cropper)."""
+    doc = workerDocument()
+    results = []
+    for idx, cropValues in items:
+        page = doc[idx]
+        if hasEmptyContents(page):
+            results.append((idx, [0.0]*len(cropValues)))
+            continue
+        raster = workerRender(idx, dpi)
+        width, height = raster.width, raster.height
+        # the page is rendered as displayed
+        r = (360 - page.rotation) % 360
+        coverages = []
+        for cv in cropValues:
+            cv = cropValuesForRotation(cv, r)
+            rect = (int(round(cv[0]*width)), int(round(cv[1]*height)),
+                    int(round((1-cv[2])*width)), int(round((1-cv[3])*height)))
+            coverages.append(inkCoverage(raster, rect, threshold))
+        results.append((idx, coverages))
+    return results
+
+
+class CoverageCache:
+    """Ink coverages of pages (or parts of them) of documents, least recently
+    used first. Documents are identified by their file name and stamp (or
+    the digest of their data), so that changed files are not mixed up."""
+
+    def __init__(self, maxEntries=200000):
+        self.maxEntries = maxEntries
+        self._coverages = OrderedDict()
+
+    def get(self, key):
+        coverage = self._coverages.get(key)
+        if coverage is not None:
+            self._coverages.move_to_end(key)
+        return coverage
+
+    def set(self, key, coverage):
+        self._coverages[key] = coverage
+        while len(self._coverages) > self.maxEntries:
+            self._coverages.popitem(last=False)
+
+    def clear(self):
+        self._coverages.clear()
+
+_cache = CoverageCache()
+
+def documentKey(fileName=None, data=None):
+    from krop.pdfcropper import fileStamp
+    if data is None:
+        return (os.path.abspath(fileName), fileStamp(fileName))
+    return hashlib.sha256(data).digest()
+
+
+def removeBlank(pages, mode='pages', fileName=None, data=None, workers=None,
+        dpi=DPI, threshold=THRESHOLD, maxCoverage=MAX_COVERAGE, document=None):
+    """Given pages as a list of (page index, crop values) to be cropped,
+    returns them without the blank pages (mode 'pages') or without the
+    blank parts of pages (mode 'subpages'); pages without crop values are
+    included as a whole, and are checked as such. The crop values are the
+    ones passed to the cropper. The PDF is given by its file name or data
+    (and, if already loaded, as HeadlessDocument document; see
+    pagetrim.mapPages)."""
+    if mode not in ('pages', 'subpages'):
+        raise ValueError(mode)
+    def parts(cropValues):
+        if mode == 'pages' or not cropValues:
+            return [ WHOLE_PAGE ]
+        return [ tuple(cv) for cv in cropValues ]
+    key = documentKey(fileName, data)
+    coverages = {}
+    missing = OrderedDict()
+    for idx, cropValues in pages:
+        for cv in parts(cropValues):
+            coverage = _cache.get((key, dpi, threshold, idx, cv))
+            if coverage is None:
+                missing.setdefault(idx, OrderedDict())[cv] = None
+            coverages[idx, cv] = coverage
+    items = [ (idx, list(cvs)) for idx, cvs in missing.items() ]
+    for idx, computed in mapPages(coverageWorker, items, (dpi, threshold),
+            fileName, data, workers, document=document):
+        for cv, coverage in zip(missing[idx], computed):
+            _cache.set((key, dpi, threshold, idx, cv), coverage)
+            coverages[idx, cv] = coverage
+    kept = []
+    for idx, cropValues in pages:
+        if mode == 'pages' or not cropValues:
+            if coverages[idx, WHOLE_PAGE] > maxCoverage:
+                kept.append((idx, cropValues))
+            continue
+        cropValues = [ cv for cv in cropValues
+                if coverages[idx, tuple(cv)] > maxCoverage ]
+        if cropValues:
+            kept.append((idx, cropValues))
+    return kept
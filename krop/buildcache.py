@@ -0,0 +1,154 @@
+# -*- coding: iso-8859-1 -*-
+
+"""
+Skipping files which are already cropped (with the same choices).
+
+Next to each output, a small JSON record is kept which describes how the
+output was produced: a digest of the input, a digest of the effective
+options (or crop plan), and the versions of krop and of the libraries used.
+If none of these has changed and the output is still the one written back
+then, cropping the file again would yield the same result, so it is skipped.
+
+Copyright (C) 2010-2025 Armin Straub, http://arminstraub.com
+"""
+
+"""
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 3 of the License, or
+(at your option) any later version.
+"""
+
+import hashlib
+import json
+import os
+import sys
+
+from krop.version import __version__
+
+
+# the record for output.pdf is kept in output.pdf.kropcache
+CACHE_SUFFIX = '.kropcache'
+
+# options which have no influence on the output
+IGNORED_OPTIONS = ('savePlan', 'buildCache', 'force', 'trimWorkers')
+
+
+def cacheFileName(outputFileName):
+    return outputFileName + CACHE_SUFFIX
+
+def fileDigest(fileName):
+    """Returns the SHA-256 digest of the contents of a file."""
+    h = hashlib.sha256()
+    with open(fileName, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def optionsDigest(options):
+    """Returns a digest of the KropOptions which affect the output."""
+    from krop.cropplan import CropPlan
+    d = {}
+    for name, value in sorted(vars(options).items()):
+        if name in IGNORED_OPTIONS:
+            continue
+        if name == 'plan' and value is not None:
+            if isinstance(value, str):
+                value = CropPlan.load(value)
+            value = hashlib.sha256(value.toBytes()).hexdigest()
+        d[name] = value
+    return hashlib.sha256(json.dumps(d, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+_ghostscriptVersion = None
+
+def ghostscriptVersion():
+    global _ghostscriptVersion
+    if _ghostscriptVersion is None:
+        import subprocess
+        try:
+            _ghostscriptVersion = subprocess.run(['gs', '--version'],
+                    stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                    check=True).stdout.decode('ascii', 'replace').strip()
+        except (OSError, subprocess.CalledProcessError):
+            _ghostscriptVersion = ''
+    return _ghostscriptVersion
+
+def libraryVersions(options):
+    """Returns the versions of krop and the libraries involved in cropping
+    with the given KropOptions."""
+    from krop.pdfcropper import lib_crop
+    # (see pdfcropper.importPyMuPdf)
+    modules = { 'PyMuPDF': ('pymupdf', 'fitz'), 'pikepdf': ('pikepdf',),
+            'pypdf': ('pypdf',), 'PyPDF2': ('PyPDF2',) }
+    versions = { 'krop': __version__ }
+    libs = [lib_crop]
+    # grids looking at the contents of pages (see options.parseGridScopes)
+    grids = [ part.partition('@')[0].strip() for part in (options.grid or '').split(';') ]
+    if ((options.plan is None and (options.trim or 'auto' in grids or 'columns' in grids))
+            or options.removeBlank or options.selectMatches):
+        # pages are rendered (or their text is read) using PyMuPDF
+        libs.append('PyMuPDF')
+    for lib in libs:
+        module = next(( sys.modules[name] for name in modules[lib]
+            if name in sys.modules ), None)
+        versions[lib] = getattr(module, '__version__', None)
+    if options.optimize:
+        versions['Ghostscript'] = ghostscriptVersion()
+    return versions
+
+def outputStamp(outputFileName):
+    from krop.pdfcropper import fileStamp
+    stamp = fileStamp(outputFileName)
+    return None if stamp is None else list(stamp)
+
+
+def buildRecord(inputFileName, options):
+    """Describes how the output for inputFileName would be produced."""
+    return { 'input': fileDigest(inputFileName),
+            'options': optionsDigest(options),
+            'versions': libraryVersions(options) }
+
+def readRecord(outputFileName):
+    try:
+        with open(cacheFileName(outputFileName)) as f:
+            record = json.load(f)
+    except (IOError, ValueError):
+        return None
+    return record if isinstance(record, dict) else None
+
+def isUpToDate(outputFileName, record):
+    """Checks that the output exists, is unchanged since it was written and
+    was produced as described by record."""
+    old = readRecord(outputFileName)
+    if old is None or old.get('output') is None:
+        return False
+    if old['output'] != outputStamp(outputFileName):
+        return False
+    return all(old.get(key) == value for key, value in record.items())
+
+def writeRecord(outputFileName, record):
+    record = dict(record)
+    record['output'] = outputStamp(outputFileName)
+    with open(cacheFileName(outputFileName), 'w') as f:
+        json.dump(record, f, indent=2)
+
+def removeRecord(outputFileName):
+    try:
+        os.remove(cacheFileName(outputFileName))
+    except FileNotFoundError:
+        pass
+
+
+def kropFileCached(inputFileName, outputFileName, options):
+    """Crops a file just like kropFile unless the output is up to date (and
+    options.force is not set). Returns True if cropping was skipped."""
+    from krop.headless import kropFile
+    record = buildRecord(inputFileName, options)
+    if not options.force and not options.savePlan and isUpToDate(outputFileName, record):
+        return True
+    # an interrupted run must not leave a valid record behind
+    removeRecord(outputFileName)
+    kropFile(inputFileName, outputFileName, options)
+    writeRecord(outputFileName, record)
+    return False
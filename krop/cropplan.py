@@ -0,0 +1,279 @@
+# -*- coding: iso-8859-1 -*-
+
+"""
+Crop plans: the result of selecting (and trimming) regions, saved for reuse.
+
+A plan stores, for every page, the crop values exactly as they are passed to
+PdfCropper (see AbstractViewerItem.cropValues), together with the selection
+mode, the exceptions and the rotation. Replaying a plan on the same document
+(or one with the same layout) therefore needs neither rendering nor trimming.
+
+Since most pages usually share their crop values, each distinct list of crop
+values is stored once and pages refer to it in runs. The scopes of selections
+which apply to page ranges are kept as well (the crop values of each page
+already take them into account; the scopes tell which pages a plan refers
+to, see CropPlan.checkDocument). A plan can be replayed on a document with
+a different number of pages, such as the next issue of a journal: further
+pages are cropped like the last ones of the plan. Plans are saved as JSON
+or, more compactly, in a binary format; the binary format is used unless the
+file name ends with .json.
+
+Copyright (C) 2010-2025 Armin Straub, http://arminstraub.com
+"""
+
+"""
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 3 of the License, or
+(at your option) any later version.
+"""
+
+import json
+import struct
+import sys
+from array import array
+
+from krop.selectionmodel import SelectionMode, parseScope, scopeToStr
+
+
+class CropPlanError(Exception):
+    pass
+
+
+class CropPlan:
+    """Crop values for each page of a document."""
+
+    version = 2
+    # the binary format starts with MAGIC and the header (little endian):
+    # version, selection mode, rotation, initial page, number of pages,
+    # number of exceptions, number of distinct crop lists, number of runs;
+    # since version 2, the runs are followed by the number of scopes and
+    # the scopes (first and last page, parity)
+    MAGIC = b'KROPPLAN'
+    HEADER = struct.Struct('<HBHIIIII')
+    SCOPE = struct.Struct('<IIB')
+    PARITIES = [None, 'odd', 'even']
+
+    def __init__(self, numPages=0):
+        self.numPages = numPages
+        self.selectionMode = SelectionMode.all
+        self.selectionExceptions = []
+        self.initialPageIndex = 0
+        self.rotation = 0
+        self.selectionScopes = [] # scopes of selections with page ranges
+        self.crops = [] # distinct lists of crop values
+        self.pageCrops = array('I', [0]*numPages) # index into crops for each page
+        self._cropIndex = {}
+
+    def setCropValues(self, idx, cropValues):
+        key = tuple(tuple(float(x) for x in cv) for cv in cropValues)
+        k = self._cropIndex.get(key)
+        if k is None:
+            k = self._cropIndex[key] = len(self.crops)
+            self.crops.append(key)
+        self.pageCrops[idx] = k
+
+    def cropValues(self, idx):
+        """Returns the crop values of page idx. Pages after the end of the
+        plan (of a document with more pages) are cropped like the last page
+        of the plan with the same parity which is not an exception."""
+        if idx >= self.numPages:
+            idx = self.lastPage(idx % 2)
+        return list(self.crops[self.pageCrops[idx]])
+
+    def lastPage(self, parity):
+        """Returns the last page of the plan with the given parity (of its
+        index) which is not an exception, falling back to any last page."""
+        exceptions = set(self.selectionExceptions)
+        pages = range(self.numPages-1, -1, -1)
+        for idx in pages:
+            if idx % 2 == parity and idx not in exceptions:
+                return idx
+        for idx in pages:
+            if idx not in exceptions:
+                return idx
+        return self.numPages - 1
+
+    def runs(self):
+        """Returns the crop indices of the pages as list of [index, count]."""
+        runs = []
+        for k in self.pageCrops:
+            if runs and runs[-1][0] == k:
+                runs[-1][1] += 1
+            else:
+                runs.append([k, 1])
+        return runs
+
+    def setRuns(self, runs):
+        self.pageCrops = array('I')
+        for k, count in runs:
+            if not 0 <= k < len(self.crops):
+                raise CropPlanError("bad crop index {0}".format(k))
+            self.pageCrops.extend([k]*count)
+        if len(self.pageCrops) != self.numPages:
+            raise CropPlanError("plan does not cover {0} pages".format(self.numPages))
+        self._cropIndex = { key: k for k, key in enumerate(self.crops) }
+
+    def checkDocument(self, numPages, strict=False):
+        """Raises CropPlanError unless the plan fits a document with numPages
+        pages. Unless strict is set, the number of pages may differ (see
+        cropValues) as long as the pages referred to explicitly, by the
+        exceptions and by the page ranges of scopes, exist; a page range
+        reaching the end of the plan (like "5-") may be open. With
+        individual selections, the number of pages has to match."""
+        if numPages == self.numPages:
+            return
+        if strict or self.numPages == 0 or self.selectionMode == SelectionMode.individual:
+            raise CropPlanError("The crop plan is for a document with {0} "
+                    "pages, not {1}.".format(self.numPages, numPages))
+        pages = list(self.selectionExceptions)
+        for first, last, parity in self.selectionScopes:
+            pages.append(first)
+            if last < self.numPages - 1:
+                pages.append(last)
+        missing = [ idx for idx in pages if idx >= numPages ]
+        if missing:
+            raise CropPlanError("The crop plan refers to page {0}, but the "
+                    "document has only {1} pages.".format(max(missing)+1, numPages))
+
+    def toJson(self):
+        return { 'format': 'krop-plan', 'version': self.version,
+                'numPages': self.numPages,
+                'selections': SelectionMode.names[self.selectionMode],
+                'exceptions': list(self.selectionExceptions),
+                'initialPage': self.initialPageIndex,
+                'rotation': self.rotation,
+                'scopes': [ scopeToStr(scope) for scope in self.selectionScopes ],
+                'crops': [ [ list(cv) for cv in crop ] for crop in self.crops ],
+                'pages': self.runs() }
+
+    @staticmethod
+    def fromJson(d):
+        try:
+            if d.get('format') != 'krop-plan' or d.get('version') not in (1, 2):
+                raise CropPlanError("not a supported crop plan")
+            plan = CropPlan(int(d['numPages']))
+            plan.selectionScopes = [ parseScope(scope, plan.numPages)
+                    for scope in d.get('scopes', []) ]
+            plan.selectionMode = SelectionMode.fromName(d['selections'])
+            plan.selectionExceptions = [ int(i) for i in d['exceptions'] ]
+            plan.initialPageIndex = int(d['initialPage'])
+            plan.rotation = int(d['rotation'])
+            plan.crops = [ tuple(tuple(float(x) for x in cv) for cv in crop)
+                    for crop in d['crops'] ]
+            plan.setRuns(d['pages'])
+        except (KeyError, TypeError, ValueError) as err:
+            raise CropPlanError("bad crop plan: {0}".format(err))
+        return plan
+
+    def toBytes(self):
+        runs = self.runs()
+        parts = [ self.MAGIC, self.HEADER.pack(self.version,
+            self.selectionMode, self.rotation, self.initialPageIndex,
+            self.numPages, len(self.selectionExceptions), len(self.crops),
+            len(runs)) ]
+        parts.append(_pack('I', self.selectionExceptions))
+        for crop in self.crops:
+            parts.append(struct.pack('<H', len(crop)))
+            parts.append(_pack('d', [ x for cv in crop for x in cv ]))
+        parts.append(_pack('I', [ x for run in runs for x in run ]))
+        parts.append(struct.pack('<I', len(self.selectionScopes)))
+        for first, last, parity in self.selectionScopes:
+            parts.append(self.SCOPE.pack(first, last, self.PARITIES.index(parity)))
+        return b''.join(parts)
+
+    @staticmethod
+    def fromBytes(data):
+        if not data.startswith(CropPlan.MAGIC):
+            raise CropPlanError("not a crop plan")
+        try:
+            pos = len(CropPlan.MAGIC)
+            (version, mode, rotation, initialPage, numPages, numExceptions,
+                    numCrops, numRuns) = CropPlan.HEADER.unpack_from(data, pos)
+            if version not in (1, 2):
+                raise CropPlanError("unsupported version {0} of crop plan".format(version))
+            if mode >= len(SelectionMode.names):
+                raise CropPlanError("bad selection mode {0} in crop plan".format(mode))
+            pos += CropPlan.HEADER.size
+            plan = CropPlan(numPages)
+            plan.selectionMode = mode
+            plan.rotation = rotation
+            plan.initialPageIndex = initialPage
+            plan.selectionExceptions, pos = _unpack('I', data, pos, numExceptions)
+            plan.selectionExceptions = list(plan.selectionExceptions)
+            for k in range(numCrops):
+                count, = struct.unpack_from('<H', data, pos)
+                values, pos = _unpack('d', data, pos+2, 4*count)
+                plan.crops.append(tuple(tuple(values[4*i:4*i+4]) for i in range(count)))
+            runs, pos = _unpack('I', data, pos, 2*numRuns)
+            if version >= 2:
+                numScopes, = struct.unpack_from('<I', data, pos)
+                pos += 4
+                for k in range(numScopes):
+                    first, last, parity = CropPlan.SCOPE.unpack_from(data, pos)
+                    pos += CropPlan.SCOPE.size
+                    if parity >= len(CropPlan.PARITIES):
+                        raise CropPlanError("bad scope in crop plan")
+                    plan.selectionScopes.append((first, last, CropPlan.PARITIES[parity]))
+        except struct.error as err:
+            raise CropPlanError("bad crop plan: {0}".format(err))
+        plan.setRuns(zip(runs[0::2], runs[1::2]))
+        return plan
+
+    def save(self, fileName):
+        if fileName.lower().endswith('.json'):
+            with open(fileName, 'w') as f:
+                json.dump(self.toJson(), f)
+        else:
+            with open(fileName, 'wb') as f:
+                f.write(self.toBytes())
+
+    @staticmethod
+    def load(fileName):
+        """Loads a plan saved in either format. Raises CropPlanError for
+        files which are no valid plans."""
+        with open(fileName, 'rb') as f:
+            data = f.read()
+        if data.startswith(CropPlan.MAGIC):
+            return CropPlan.fromBytes(data)
+        try:
+            d = json.loads(data.decode('utf-8'))
+        except ValueError:
+            raise CropPlanError("not a crop plan")
+        if not isinstance(d, dict):
+            raise CropPlanError("not a crop plan")
+        return CropPlan.fromJson(d)
+
+
+def _pack(typecode, values):
+    a = array(typecode, values)
+    if sys.byteorder == 'big':
+        a.byteswap()
+    return a.tobytes()
+
+def _unpack(typecode, data, pos, count):
+    a = array(typecode)
+    end = pos + count*a.itemsize
+    if end > len(data):
+        raise CropPlanError("crop plan is truncated")
+    a.frombytes(data[pos:end])
+    if sys.byteorder == 'big':
+        a.byteswap()
+    return a, end
+
+
+def cropPlan(numPages, cropValues, selectionMode=SelectionMode.all,
+        selectionExceptions=(), initialPageIndex=0, rotation=0,
+        selectionScopes=()):
+    """Returns a CropPlan where cropValues(idx) provides the crop values of
+    each page. The scopes of the selections are recorded in the plan (those
+    which are None are skipped)."""
+    plan = CropPlan(numPages)
+    plan.selectionScopes = [ scope for scope in selectionScopes if scope is not None ]
+    plan.selectionMode = selectionMode
+    plan.selectionExceptions = sorted(set(i for i in selectionExceptions if 0 <= i < numPages))
+    plan.initialPageIndex = initialPageIndex
+    plan.rotation = rotation
+    for idx in range(numPages):
+        plan.setCropValues(idx, cropValues(idx))
+    return plan
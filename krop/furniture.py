@@ -0,0 +1,128 @@
+# -*- coding: iso-8859-1 -*-
+
+"""
+Detecting running headers and footers (page furniture) on page rasters.
+
+Near the top and the bottom of each page, the rows containing ink form
+bands (like a running head, a page number or a publisher's line). Each band
+gets a cheap signature: its position and size together with a hash of its
+ink. Narrow pieces of ink standing apart, like page numbers, are left out
+of the hash, so that bands differing only in their digits match. Bands whose
+signature repeats on many pages are considered furniture and are excluded
+when trimming.
+
+Copyright (C) 2010-2025 Armin Straub, http://arminstraub.com
+"""
+
+"""
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 3 of the License, or
+(at your option) any later version.
+"""
+
+import re
+import zlib
+from collections import Counter
+
+
+# bands are looked for within this fraction of the page height
+ZONE = 0.12
+# at most this many bands are considered at the top and at the bottom
+MAX_BANDS = 2
+# a signature needs to be found on this many pages to count as furniture
+MIN_REPEATS = 3
+
+
+def bandSignature(raster, y0, y1, position, threshold=160):
+    """Returns the signature of the band of rows y0 to y1 (exclusive) whose
+    position is given as ('top' or 'bottom', distance from that edge)."""
+    width = raster.width
+    inkTable = bytes(1 if v < threshold else 0 for v in range(256))
+    # the columns containing ink
+    columns = 0
+    for y in range(y0, y1):
+        columns |= int.from_bytes(raster.row(y).translate(inkTable), 'big')
+    profile = columns.to_bytes(width, 'big')
+    # pieces of ink separated by gaps of at least 1.5% of the page width;
+    # pieces narrower than 5% of the page width (like page numbers) are
+    # left out
+    gap = max(1, int(0.015*width))
+    pieces = re.compile(b'\x01(?:\x00{0,%d}\x01)*' % (gap-1))
+    kept = [ m.span() for m in pieces.finditer(profile)
+            if m.end() - m.start() >= 0.05*width ]
+    h = 0
+    for y in range(y0, y1):
+        row = raster.row(y).translate(inkTable)
+        for x0, x1 in kept:
+            h = zlib.crc32(row[x0:x1], h)
+    # positions are rounded a little, to allow for slight shifts (like a
+    # page number "1" being a pixel shorter than other digits)
+    edge, distance = position
+    return (edge, (2*distance + y1 - y0) // 8, (y1 - y0) // 4,
+            tuple((x0 // 4, x1 // 4) for x0, x1 in kept), h)
+
+def candidateBands(raster, threshold=160):
+    """Returns the lists of candidate bands at the top (starting at the top)
+    and at the bottom (starting at the bottom) of a page; each band is given
+    as (y0, y1, cut, signature) where y1 is exclusive and cut is the row in
+    the middle of the blank rows separating the band from the rest of the
+    page (faint pixels around the ink are thereby cut off as well)."""
+    height = raster.height
+    zone = max(1, int(ZONE*height))
+    ink = re.compile(b'[' + re.escape(bytes(range(threshold))) + b']')
+
+    def bands(rows):
+        # rows are scanned from the edge of the page; returns (first, last,
+        # first row of ink after it) as positions in rows
+        found = []
+        start = end = None
+        for k, y in enumerate(rows):
+            if ink.search(raster.row(y)):
+                if start is None:
+                    if found and found[-1][2] is None:
+                        found[-1][2] = k
+                        if len(found) == MAX_BANDS:
+                            break
+                    start = k
+                end = k
+            elif start is not None:
+                found.append([start, end, None])
+                start = None
+        # a band still open at the end of the zone is not complete, so it
+        # is no candidate
+        return [ (rows[first], rows[last], rows[(last + 1 + (after or len(rows))) // 2])
+                for first, last, after in found[:MAX_BANDS] ]
+
+    top = [ (y0, y1+1, cut, bandSignature(raster, y0, y1+1, ('top', y0), threshold))
+            for y0, y1, cut in bands(range(zone)) ]
+    bottom = [ (y1, y0+1, cut+1, bandSignature(raster, y1, y0+1, ('bottom', height-1-y0), threshold))
+            for y0, y1, cut in bands(range(height-1, height-zone-1, -1)) ]
+    return top, bottom
+
+
+class FurnitureDetector:
+    """Collects the signatures of candidate bands on all pages and decides
+    which of them are furniture."""
+
+    def __init__(self, minRepeats=MIN_REPEATS):
+        self.minRepeats = minRepeats
+        self._counts = Counter()
+
+    def add(self, signatures):
+        # a signature is counted once per page
+        self._counts.update(set(signatures))
+
+    def isFurniture(self, signature):
+        return self._counts[signature] >= self.minRepeats
+
+    def excluded(self, signatures):
+        """Returns how many of the given bands (ordered from the edge of the
+        page) are furniture: furniture can only be excluded up to the first
+        band which is not."""
+        n = 0
+        for signature in signatures:
+            if not self.isFurniture(signature):
+                break
+            n += 1
+        return n
@@ -0,0 +1,553 @@
+# -*- coding: iso-8859-1 -*-
+
+"""
+Cropping PDF files without the graphical interface.
+
+This is used by krop --go whenever no pixels are needed: selections are
+computed from the page geometry alone, so that neither Qt nor rendering is
+involved. For trimming (as used in batch mode), pages are rendered using
+PyMuPDF.
+
+The function crop (also available as krop.crop) provides this as a Python
+API which can read from and write to memory.
+
+Copyright (C) 2010-2025 Armin Straub, http://arminstraub.com
+"""
+
+"""
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 3 of the License, or
+(at your option) any later version.
+"""
+
+import io
+import os
+import re
+import sys
+import time
+from collections import OrderedDict
+
+from krop.blankpages import removeBlank as removeBlankPages
+from krop.cropplan import CropPlan, cropPlan
+from krop.options import (KropOptions, str2pages, parseGrid, parseScopedGrid,
+        parseGridScopes, parsePadding, gridCropValues)
+from krop.layouts import findLayouts, autoGrid, samplePages
+from krop.textlayer import pageColumns, textIndex
+from krop.pagegeometry import cropValuesForRotation
+from krop.pagetrim import PageCrops, pageGridCropValues, pageGridCount, trimPages, parseSmoothing
+from krop.pdfcropper import PdfFile, PdfCropper, writeCroppedPdf, fileStamp, lib_crop, importPyMuPdf
+from krop.raster import renderGray, trimRaster, intersectRects, despeckle
+from krop.selectionmodel import SelectionMode, SelectionIndex, selectionVisibleOnPage, scopeContains
+
+
+class HeadlessDocument:
+    """A PDF file loaded for cropping together with its page geometry.
+
+    The document is either read from a file or given by its data (bytes,
+    bytearray or memoryview) in memory. For trimming, pages are rendered
+    using PyMuPDF (which does not need to be the library used for cropping).
+    If maxRenders is positive, that many renders are kept for later use."""
+
+    # resolution used for rendering pages when trimming
+    dpi = 96
+
+    def __init__(self, fileName=None, maxRenders=0, data=None):
+        self.fileName = fileName
+        self.data = data
+        self.pdf = PdfFile()
+        if data is None:
+            self.stamp = fileStamp(fileName)
+            self.pdf.loadFromFile(fileName)
+        else:
+            self.stamp = None
+            self.pdf.loadFromData(data)
+        try:
+            self.geometry = self.pdf.buildGeometry(self.dpi)
+        except Exception:
+            self.pdf.close()
+            raise
+        self.maxRenders = maxRenders
+        self._renders = OrderedDict()
+        self.renderHits = 0
+        self.renderMisses = 0
+        self._renderdoc = None
+
+    def isValid(self):
+        """Checks that the file has not changed since it was loaded."""
+        return self.stamp is not None and fileStamp(self.fileName) == self.stamp
+
+    def close(self):
+        self._renders.clear()
+        if self._renderdoc is not None:
+            # when cropping with PyMuPDF, the document is shared with self.pdf
+            if lib_crop != 'PyMuPDF':
+                self._renderdoc.close()
+            self._renderdoc = None
+        if self.pdf is not None:
+            self.pdf.close()
+            self.pdf = None
+
+    def numPages(self):
+        return self.geometry.numPages()
+
+    def renderDocument(self):
+        """Returns the PyMuPDF document used for rendering."""
+        if self._renderdoc is None:
+            if lib_crop == 'PyMuPDF':
+                self._renderdoc = self.pdf.reader
+            else:
+                fitz = importPyMuPdf()
+                if self.data is None:
+                    self._renderdoc = fitz.open(self.fileName)
+                else:
+                    self._renderdoc = fitz.open(stream=self.data, filetype="pdf")
+        return self._renderdoc
+
+    def renderPage(self, idx, dpi=None):
+        """Renders a page as GrayRaster (by default, at the resolution used
+        for trimming)."""
+        key = (idx, dpi or self.dpi)
+        raster = self._renders.get(key)
+        if raster is not None:
+            self._renders.move_to_end(key)
+            self.renderHits += 1
+            return raster
+        self.renderMisses += 1
+        raster = renderGray(self.renderDocument(), idx, dpi or self.dpi)
+        if self.maxRenders > 0:
+            self._renders[key] = raster
+            while len(self._renders) > self.maxRenders:
+                self._renders.popitem(last=False)
+        return raster
+
+
+class HeadlessKrop:
+    """Crops a PDF file according to selections given by their crop values.
+
+    As in the graphical interface, all selections are created on the initial
+    page and apply to other pages according to the selection mode and the
+    exceptions."""
+
+    def __init__(self, document=None):
+        self.document = document
+        self._ownsDocument = False
+        self.selectionMode = SelectionMode.all
+        self.selectionExceptions = []
+        self.initialPageIndex = 0
+        self.selections = [] # crop values of selections on initial page
+        self.selectionScopes = [] # scope of each selection (or None)
+        self.pageGrids = [] # grids created on every page individually
+        self.layoutGrids = [] # grids created on every page, shared by layout
+        self.columnScopes = [] # scopes of selections for the text columns
+        self.pageCrops = None # PageCrops for pageGrids (once trimmed)
+        self.plan = None # if set, provides the crop values instead
+        self._index = None
+
+    def load(self, fileName):
+        self.close()
+        self.document = HeadlessDocument(fileName)
+        self._ownsDocument = True
+
+    def close(self):
+        """Closes the document unless it was provided by the caller."""
+        if self.document is not None and self._ownsDocument:
+            self.document.close()
+        self.document = None
+
+    @property
+    def pdf(self):
+        return self.document.pdf
+
+    @property
+    def geometry(self):
+        return self.document.geometry
+
+    def warn(self, title, text):
+        sys.stderr.write('WARNING: ' + title + '\n' + text + '\n')
+
+    def numPages(self):
+        return self.document.numPages() if self.document is not None else 0
+
+    def setInitialPage(self, text):
+        """Mirrors the page edit of the graphical interface: invalid values
+        are ignored and out of range values are clamped."""
+        try:
+            idx = int(text) - 1
+        except ValueError:
+            return
+        self.initialPageIndex = max(0, min(idx, self.numPages()-1))
+
+    def isPortrait(self):
+        return self.geometry.isPortrait(self.initialPageIndex)
+
+    def createSelectionGrid(self, grid):
+        grids = []
+        pageGrids = []
+        layoutGrids = []
+        for g, scope in parseGridScopes(grid, self.numPages()):
+            if g == 'auto':
+                g = self.autoGrid(scope)
+            if g == 'columns':
+                self.columnScopes.append(None if scope in ('all', 'layout') else scope)
+                continue
+            if scope in ('all', 'layout'):
+                parseGrid(g, True)
+                (pageGrids if scope == 'all' else layoutGrids).append(g)
+                continue
+            grids.append((parseScopedGrid(g, scope, self.geometry,
+                self.initialPageIndex), scope))
+        self.pageGrids.extend(pageGrids)
+        self.layoutGrids.extend(layoutGrids)
+        self.pageCrops = None
+        for (cols, rows), scope in grids:
+            cropValues = gridCropValues(cols, rows)
+            self.selections.extend(cropValues)
+            self.selectionScopes.extend([scope]*len(cropValues))
+        self._index = None
+
+    def autoGrid(self, scope=None):
+        """Proposes a grid like "2x1" for the pages within scope (see
+        layouts.autoGrid), looking at only a few of them."""
+        first, last = 0, self.numPages()-1
+        if scope not in (None, 'all', 'layout'):
+            first, last = scope[0], scope[1]
+        return autoGrid(self.document.renderPage,
+                samplePages(first, last, self.initialPageIndex))
+
+    def selectMatches(self, pattern, padding=(0,0,0,0), workers=None):
+        """Adds a selection around each block of text matching pattern (see
+        textlayer.TextIndex.search), applying only to its page; padding is
+        in pixels (as for trimming)."""
+        index = textIndex(self.numPages(), self.document.fileName,
+                self.document.data, workers, self.document)
+        scale = 72.0 / self.document.dpi
+        for idx, cropValues in index.search(pattern, [ p*scale for p in padding ]):
+            self.selections.append(cropValues)
+            self.selectionScopes.append((idx, idx, None))
+        self._index = None
+
+    def selectionVisibleOnPage(self, idx):
+        """Determines if the selections without scope are visible on page
+        idx."""
+        return selectionVisibleOnPage(idx, self.initialPageIndex,
+                self.selectionMode, self.selectionExceptions)
+
+    def visibleSelections(self, idx):
+        """Returns the indices of the selections visible on page idx."""
+        if self._index is None:
+            self._index = SelectionIndex()
+            self._index.mode = self.selectionMode
+            self._index.exceptions = self.selectionExceptions
+            for k, scope in enumerate(self.selectionScopes):
+                self._index.add(k, self.initialPageIndex, scope)
+        return self._index.visibleSelections(idx)
+
+    def trimSelections(self, useAllPages=False, padding=(0,0,0,0),
+            sensitivity=5.0, allowedchanges=0.0, speckSize=0):
+        """Trims the margins of all selections (creating one for the full
+        page if there are none), just like trimming in the graphical
+        interface. If speckSize is positive, specks smaller than that are
+        ignored (see raster.despeckle)."""
+        if not self.selections:
+            if self.pageGrids or self.layoutGrids or self.columnScopes:
+                return
+            self.selections.append((0, 0, 0, 0))
+            self.selectionScopes.append(None)
+            self._index = None
+        # if requested, use all pages for trimming; otherwise, just the
+        # initial page (or, for selections not visible there, the first page
+        # they are visible on)
+        pages = {} # page index -> indices of the selections trimmed there
+        if useAllPages:
+            for idx in range(self.numPages()):
+                visible = self.visibleSelections(idx)
+                if visible:
+                    pages[idx] = visible
+        else:
+            remaining = set(range(len(self.selections)))
+            for idx in [self.initialPageIndex] + list(range(self.numPages())):
+                visible = remaining.intersection(self.visibleSelections(idx))
+                if visible:
+                    pages.setdefault(idx, []).extend(sorted(visible))
+                    remaining -= visible
+                if not remaining:
+                    break
+        # the crop values of a selection refer to the initial page or, if
+        # it is not trimmed there, the first page it is trimmed on
+        refs = [self.initialPageIndex]*len(self.selections)
+        for idx in sorted(pages, reverse=True):
+            for k in pages[idx]:
+                refs[k] = idx
+        for k in pages.get(self.initialPageIndex, []):
+            refs[k] = self.initialPageIndex
+        sizes = [ self.geometry.pixelSize(idx) for idx in refs ]
+        # orect is the original selection, nrect is the trimmed version
+        orects = [ (int(round(cv[0]*width)), int(round(cv[1]*height)),
+                int(round((1-cv[2])*width)), int(round((1-cv[3])*height)))
+                for cv, (width, height) in zip(self.selections, sizes) ]
+        nrects = [ None for cv in self.selections ]
+        # render each page only once (and keep only one page in memory)
+        for idx in sorted(pages):
+            raster = self.document.renderPage(idx)
+            if speckSize > 0:
+                raster = despeckle(raster, speckSize)
+            for k in pages[idx]:
+                nrects[k] = trimRaster(raster, orects[k], nrects[k], sensitivity, allowedchanges)
+        dtop, dright, dbottom, dleft = padding
+        for k, (orect, nrect) in enumerate(zip(orects, nrects)):
+            if nrect is None:
+                # the selection is not visible on any page
+                continue
+            width, height = sizes[k]
+            # adjust for padding but don't overadjust
+            x0, y0, x1, y1 = intersectRects((nrect[0]-dleft, nrect[1]-dtop,
+                nrect[2]+dright, nrect[3]+dbottom), orect)
+            self.selections[k] = (x0/width, y0/height, 1-x1/width, 1-y1/height)
+
+    def trimPages(self, pages=None, padding=(0,0,0,0), sensitivity=5.0,
+            allowedchanges=0.0, workers=None, smoothing=None, speckSize=0,
+            furniture=False, useAllPages=True):
+        """Trims the page grids on each page individually (by default, on
+        all pages). If smoothing is given as (window, method, evenodd), the
+        results are smoothed over neighbouring pages (see
+        PageCrops.smooth). With furniture, running headers and footers are
+        excluded (see krop.furniture). Selections that are blank on a page
+        are cropped as on a neighbouring page (see PageCrops.fillBlank).
+
+        The grids shared by layout are trimmed on all pages of each layout
+        or, unless useAllPages is set, only on its leader (see
+        krop.layouts)."""
+        grids = self.pageGrids + self.layoutGrids
+        if not grids:
+            return
+        if pages is None:
+            pages = range(self.numPages())
+        pages = [ idx for idx in pages if 0 <= idx < self.numPages() ]
+        labels = None
+        if self.layoutGrids:
+            labels, leaders = findLayouts(self.geometry, self.document.fileName,
+                    self.document.data, workers, document=self.document)
+            if not useAllPages and not self.pageGrids:
+                pages = sorted({ leaders[labels[idx]] for idx in pages })
+        self.pageCrops = PageCrops(self.numPages(), pageGridCount(grids))
+        for idx, cropValues in trimPages(pages, grids, padding,
+                sensitivity, allowedchanges, self.document.fileName,
+                self.document.data, workers, dpi=self.document.dpi,
+                speckSize=speckSize, furniture=furniture, document=self.document):
+            self.pageCrops.set(idx, cropValues)
+        if smoothing is not None:
+            self.pageCrops.smooth(*smoothing)
+        if labels is not None:
+            self.pageCrops.share(labels, pageGridCount(self.pageGrids))
+        self.pageCrops.fillBlank()
+
+    def applyOptions(self, options):
+        """Sets up selections according to KropOptions (trimming them if
+        requested)."""
+        if options.selections is not None:
+            self.selectionMode = SelectionMode.fromName(options.selections)
+        if options.exceptions is not None:
+            self.selectionExceptions = str2pages(options.exceptions, self.numPages())
+        if options.initialPage is not None:
+            self.setInitialPage(options.initialPage)
+        self._index = None
+        if options.grid:
+            try:
+                self.createSelectionGrid(options.grid)
+            except ValueError:
+                self.warn("Bad value for grid parameter", "For creating a grid "
+                    "of selections, you need to specify the dimensions of the grid in the form '2x3'. "
+                    "You can also enter a single number, in which case the number of columns/rows is "
+                    "determined according to whether the page is landscape or portrait. "
+                    "To use a grid only on some pages, append them as in '2x1@11-20:odd'; "
+                    "several grids are separated by ';'.")
+        if options.trim or options.selectMatches:
+            try:
+                padding = parsePadding(options.trimPadding)
+            except ValueError:
+                self.warn("Bad value for padding", "The value of padding "
+                    "must be a list of one to four floats, separated by a comma.")
+                padding = [0,0,0,0]
+        if options.selectMatches:
+            try:
+                self.selectMatches(options.selectMatches, padding, options.trimWorkers)
+            except re.error:
+                self.warn("Bad value for pattern", "The pattern to select around "
+                    "must be a regular expression, like 'Figure [0-9]+'.")
+        if options.trim:
+            self.trimSelections(options.trimUseAllPages, padding,
+                    options.trimSensitivity, options.trimAllowedChanges,
+                    options.trimSpeckSize)
+            smoothing = None
+            if options.trimSmoothing:
+                try:
+                    smoothing = parseSmoothing(options.trimSmoothing)
+                except ValueError:
+                    self.warn("Bad value for smoothing", "Smoothing is specified "
+                        "by the number of pages, optionally preceded by 'median' or 'max' "
+                        "and followed by 'evenodd', as in 'max:5:evenodd'.")
+            pages = None
+            if options.whichPages:
+                pages = str2pages(options.whichPages, self.numPages())
+            self.trimPages(pages, padding, options.trimSensitivity,
+                    options.trimAllowedChanges, options.trimWorkers, smoothing,
+                    options.trimSpeckSize, options.trimFurniture,
+                    options.trimUseAllPages)
+
+    def usePlan(self, plan):
+        """Crops according to a CropPlan instead of the selections."""
+        plan.checkDocument(self.numPages())
+        self.plan = plan
+        self.selectionMode = plan.selectionMode
+        self.selectionExceptions = list(plan.selectionExceptions)
+        self.initialPageIndex = min(plan.initialPageIndex, self.numPages()-1)
+        self._index = None
+
+    def cropPlan(self, rotation=0):
+        return cropPlan(self.numPages(), self.cropValues, self.selectionMode,
+                self.selectionExceptions, self.initialPageIndex, rotation,
+                self.selectionScopes)
+
+    def cropValues(self, idx):
+        if self.plan is not None:
+            return self.plan.cropValues(idx)
+        cropValues = [ self.selections[k] for k in self.visibleSelections(idx) ]
+        if self.pageGrids or self.layoutGrids:
+            if self.pageCrops is not None and idx in self.pageCrops:
+                cropValues.extend(self.pageCrops.get(idx))
+            else:
+                cropValues.extend(pageGridCropValues(self.pageGrids + self.layoutGrids,
+                    self.geometry.isPortrait(idx)))
+        if any(scope is None or scopeContains(scope, idx) for scope in self.columnScopes):
+            cropValues.extend(pageColumns(self.document.renderDocument()[idx]))
+        r = self.geometry.rotation(idx)
+        return [ cropValuesForRotation(cv, r) for cv in cropValues ]
+
+    def krop(self, output, pages=None, alwaysinclude=False,
+            rotation=0, optimize=False, removeBlank=None, workers=None):
+        """Writes the cropped PDF to output (a file name or a writable binary
+        stream). If removeBlank is 'pages' or 'subpages', blank pages or
+        blank parts of pages are left out (see blankpages.removeBlank)."""
+        if pages is None:
+            pages = range(self.numPages())
+        cropped = [ (nr, self.cropValues(nr)) for nr in pages ]
+        if removeBlank:
+            cropped = removeBlankPages([ (nr, c) for nr, c in cropped
+                    if c or alwaysinclude ], removeBlank, self.document.fileName,
+                    self.document.data, workers, document=self.document)
+        cropper = PdfCropper()
+        cropper.copyDocumentRoot(self.pdf)
+        for nr, c in cropped:
+            cropper.addPageCropped(self.pdf, nr, c, alwaysinclude, rotation)
+        writeCroppedPdf(cropper, output, optimize)
+
+
+def kropFile(inputFileName, outputFileName, options, document=None,
+        stages=None, progress=None):
+    """Crops a PDF file according to KropOptions without the graphical
+    interface. An already loaded HeadlessDocument for the file can be
+    provided (it is not closed). The output may also be a writable binary
+    stream. If stages is a dict, the time spent on loading, setting up
+    selections and cropping is recorded in it; progress(stage, seconds) is
+    called as soon as each of these stages is done."""
+    def stageDone(stage, since):
+        now = time.perf_counter()
+        if stages is not None:
+            stages[stage] = now - since
+        if progress is not None:
+            progress(stage, now - since)
+        return now
+
+    job = HeadlessKrop(document)
+    start = time.perf_counter()
+    try:
+        if document is None:
+            job.load(inputFileName)
+        loaded = stageDone('load', start)
+        rotation = options.rotate or 0
+        if options.plan is not None:
+            # the selections are known, so no need to render or trim
+            plan = options.plan
+            if isinstance(plan, str):
+                plan = CropPlan.load(plan)
+            job.usePlan(plan)
+            if options.rotate is None:
+                rotation = plan.rotation
+        else:
+            job.applyOptions(options)
+        if options.savePlan:
+            job.cropPlan(rotation).save(options.savePlan)
+        pages = None
+        if options.whichPages:
+            pages = str2pages(options.whichPages, job.numPages())
+        selected = stageDone('select', loaded)
+        job.krop(outputFileName, pages, options.alwaysInclude,
+                rotation, options.optimize, options.removeBlank,
+                options.trimWorkers)
+        stageDone('crop', selected)
+    finally:
+        job.close()
+
+
+def crop(source, output=None, *, grid=None, selections=None, exceptions=None,
+        initialPage=None, trim=False, trimUseAllPages=False, padding=None,
+        rotate=None, pages=None, plan=None, alwaysInclude=False, optimize=False,
+        removeBlank=None):
+    """Crops a PDF document without the graphical interface.
+
+    source is a file name, the data of a PDF (bytes, bytearray or
+    memoryview) or a binary file object to read it from. The cropped PDF is
+    written to output (a file name or a writable binary stream); if output
+    is None, it is returned as bytes instead.
+
+    The options correspond to the command line options: for instance,
+    grid='2x1' splits each page into two columns, selections is one of
+    'all', 'evenodd' or 'individual', and trim=True trims the margins of the
+    selections (with padding given as a string like "2,0" or as a list of
+    one to four numbers). pages and exceptions are strings like "1-5,7" or
+    lists of page numbers (counted from 1). Instead of selections, a CropPlan
+    (or the name of a file containing one) can be given as plan. Blank pages
+    (or blank parts of pages) are left out if removeBlank is 'pages' (or
+    'subpages').
+
+        pdf = krop.crop(data, grid=2, trim=True)
+    """
+    def pageString(p):
+        if p is None or isinstance(p, str):
+            return p
+        return ','.join(str(n) for n in p)
+
+    options = KropOptions()
+    options.grid = None if grid is None else str(grid)
+    options.selections = selections
+    options.exceptions = pageString(exceptions)
+    options.initialPage = None if initialPage is None else str(initialPage)
+    options.whichPages = pageString(pages)
+    options.rotate = rotate
+    options.plan = plan
+    options.optimize = optimize
+    options.alwaysInclude = alwaysInclude
+    options.removeBlank = removeBlank
+    options.trim = trim
+    options.trimUseAllPages = trimUseAllPages
+    if padding is not None:
+        if not isinstance(padding, str):
+            padding = ','.join(str(p) for p in padding)
+        options.trimPadding = padding
+
+    if isinstance(source, (str, os.PathLike)):
+        document = HeadlessDocument(os.fspath(source))
+    else:
+        if hasattr(source, 'read'):
+            source = source.read()
+        if not isinstance(source, (bytes, bytearray, memoryview)):
+            raise TypeError("cannot read a PDF from {0}".format(type(source).__name__))
+        document = HeadlessDocument(data=source)
+    try:
+        stream = io.BytesIO() if output is None else output
+        kropFile(None, stream, options, document)
+    finally:
+        document.close()
+    if output is None:
+        return stream.getvalue()
@@ -0,0 +1,305 @@
+# -*- coding: iso-8859-1 -*-
+
+"""
+Grouping the pages of a document by their layout.
+
+A grid like "2@layout" is created on every page (like "2@all", see
+krop.pagetrim), but trimmed only once for each group of pages with the same
+layout, so that these pages share their selections. Two pages have the same
+layout if they have the same size and rotation, the same column gutters and
+if the content of one lies within the content of the other (so that short
+pages, like the last page of a chapter, join the full pages).
+
+The features of a page are computed from a render at low resolution: its
+content box and the gutters between columns, found in the projection
+profile of the ink onto the horizontal axis. Pages are then grouped in one
+pass, largest content first, each page joining the first group whose leader
+it fits; groups are looked up by page size, so that this scales to large
+documents.
+
+The same projection profiles serve to propose a grid for n-up pages (like
+"--grid=auto" for handouts with 2x2 slides per page): on a few sample pages,
+gutters dividing the page into parts of equal size are looked for.
+
+Copyright (C) 2010-2025 Armin Straub, http://arminstraub.com
+"""
+
+"""
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 3 of the License, or
+(at your option) any later version.
+"""
+
+from array import array
+from collections import Counter
+from math import log
+
+from krop.pagetrim import mapPages, workerRender
+
+
+# resolution used for rendering pages when computing their features
+DPI = 36
+# pixels darker than this count as ink (at low resolution, small print is
+# rendered in light gray)
+THRESHOLD = 192
+# gaps between columns are at least this fraction of the page width
+MIN_GUTTER = 0.02
+# gaps between rows of pages are at least this fraction of the page height
+# (which is more than the space between paragraphs)
+MIN_ROW_GUTTER = 0.03
+# columns with ink in at most this fraction of the rows of the content count
+# as empty (so that a heading across both columns does not hide the gutter);
+# likewise for rows
+GUTTER_INK = 0.03
+# how far (as fraction of the page) content and gutters may differ from
+# those of the leader of a group
+TOLERANCE = 0.02
+# pages whose sizes (in points) differ by at most this fraction have the
+# same size
+SIZE_TOLERANCE = 0.02
+# how many pages are rendered for proposing a grid
+GRID_SAMPLES = 5
+# the largest number of columns (or rows) proposed
+MAX_PARTS = 4
+# the content of each part of a page spans at least this fraction of it
+MIN_EXTENT = 0.25
+# parts of a page look alike if this fraction of the positions with ink in
+# one of them have ink in the other
+SIMILARITY = 0.8
+
+
+def contentBox(raster, threshold=THRESHOLD):
+    """Returns the box (x0, y0, x1, y1), where x1 and y1 are exclusive,
+    containing all ink of a GrayRaster, or None for a blank page."""
+    light = bytes(range(threshold, 256))
+    rows = [ y for y in range(raster.height) if raster.row(y).translate(None, light) ]
+    if not rows:
+        return None
+    columns = [ x for x in range(raster.width)
+            if raster.column(x, rows[0], rows[-1]+1).translate(None, light) ]
+    return columns[0], rows[0], columns[-1]+1, rows[-1]+1
+
+def columnProfile(raster, box, threshold=THRESHOLD):
+    """Returns the projection profile of the ink within box onto the
+    horizontal axis: for each column of the box, the number of rows of ink.
+    Columns are counted by bytes.translate, so that the loop in Python only
+    runs over the columns (a few hundred at DPI)."""
+    light = bytes(range(threshold, 256))
+    x0, y0, x1, y1 = box
+    return [ len(raster.column(x, y0, y1).translate(None, light)) for x in range(x0, x1) ]
+
+def rowProfile(raster, box, threshold=THRESHOLD):
+    """Returns the projection profile of the ink within box onto the
+    vertical axis: for each row of the box, the number of columns of ink."""
+    light = bytes(range(threshold, 256))
+    x0, y0, x1, y1 = box
+    return [ len(raster.row(y, x0, x1).translate(None, light)) for y in range(y0, y1) ]
+
+def findGaps(profile, empty, minWidth):
+    """Returns the runs of at least minWidth entries of a profile which are
+    at most empty as list of (start, end), where end is exclusive; runs at
+    either end of the profile are left out."""
+    gaps = []
+    start = None
+    for x, ink in enumerate(profile + [empty + 1]):
+        if ink <= empty:
+            if start is None:
+                start = x
+        elif start is not None:
+            if start > 0 and x - start >= minWidth:
+                gaps.append((start, x))
+            start = None
+    return gaps
+
+def findGutters(raster, box=None, threshold=THRESHOLD):
+    """Returns the gutters between columns of text as list of (x0, x1),
+    where x1 is exclusive, found in the column profile within box (by
+    default, the content box)."""
+    if box is None:
+        box = contentBox(raster, threshold)
+        if box is None:
+            return []
+    x0, y0, x1, y1 = box
+    gaps = findGaps(columnProfile(raster, box, threshold),
+            GUTTER_INK * (y1 - y0), max(1, int(MIN_GUTTER * raster.width)))
+    return [ (x0 + g0, x0 + g1) for g0, g1 in gaps ]
+
+def findRowGutters(raster, box=None, threshold=THRESHOLD):
+    """Returns the gutters between rows (like between the pages of a 2x2
+    handout) as list of (y0, y1), where y1 is exclusive, found in the row
+    profile within box (by default, the content box)."""
+    if box is None:
+        box = contentBox(raster, threshold)
+        if box is None:
+            return []
+    x0, y0, x1, y1 = box
+    gaps = findGaps(rowProfile(raster, box, threshold),
+            GUTTER_INK * (x1 - x0), max(1, int(MIN_ROW_GUTTER * raster.height)))
+    return [ (y0 + g0, y0 + g1) for g0, g1 in gaps ]
+
+def pageFeatures(raster, threshold=THRESHOLD):
+    """Returns the content box and the centers of the gutters of a page as
+    fractions of its width and height (the content box is None for blank
+    pages)."""
+    width, height = raster.width, raster.height
+    box = contentBox(raster, threshold)
+    if box is None:
+        return None, ()
+    gutters = findGutters(raster, box, threshold)
+    return ((box[0]/width, box[1]/height, box[2]/width, box[3]/height),
+            tuple((g0 + g1) / (2*width) for g0, g1 in gutters))
+
+def featureWorker(pages, dpi):
+    """Returns a list of (page index, features) for the given pages of the
+    document of the worker process (see pageFeatures)."""
+    return [ (idx, pageFeatures(workerRender(idx, dpi))) for idx in pages ]
+
+
+def evenSplit(profile, empty, minWidth, maxParts=MAX_PARTS):
+    """Returns the largest number n of at most maxParts parts such that
+    gaps in a profile (see findGaps) separate it into n parts of equal size
+    which look alike: aligned at their first ink, the positions with ink in
+    one part mostly have ink in the other parts as well (up to a small
+    shift); this is 1 if there is no such split."""
+    length = len(profile)
+    tolerance = int(TOLERANCE * length)
+    gaps = findGaps(profile, empty, minWidth)
+    ink = [ v > empty for v in profile ]
+
+    def alike(a, b):
+        # parts may hold more or less content, but not a lot more
+        inkA, inkB = sum(a), sum(b)
+        if 3*min(inkA, inkB) < max(inkA, inkB):
+            return False
+        # with the parts as integers (a bit per position), each of the
+        # 2*tolerance+1 shifts takes a few operations on integers of
+        # length bits, instead of a loop over the positions in Python
+        a, b = _bits(a), _bits(b)
+        common = max(bin(a >> d & b if d >= 0 else a & b >> -d).count('1')
+                for d in range(-tolerance, tolerance+1))
+        return common >= SIMILARITY * min(inkA, inkB)
+
+    for n in range(maxParts, 1, -1):
+        if not all(any(g0 - tolerance <= k*length/n <= g1 + tolerance for g0, g1 in gaps)
+                for k in range(1, n)):
+            continue
+        size = length // n
+        parts = [ ink[k*length//n:k*length//n + size] for k in range(n) ]
+        if not all(any(part) for part in parts):
+            continue
+        parts = [ part[part.index(True):] for part in parts ]
+        # the content of each part spans a good deal of it
+        if any(len(part) - part[::-1].index(True) < MIN_EXTENT*size for part in parts):
+            continue
+        if all(alike(parts[0], part) for part in parts[1:]):
+            return n
+    return 1
+
+def _bits(flags):
+    """Returns the integer whose bit i is set if flags[i] is true."""
+    return int(''.join('1' if f else '0' for f in reversed(flags)) or '0', 2)
+
+def proposeGrid(rasters):
+    """Proposes a grid (cols, rows) for pages like the given ones (a few
+    GrayRasters), which is the grid of gutters dividing most of them into
+    parts of equal size that look alike, or None if all pages are blank."""
+    votes = Counter()
+    for raster in rasters:
+        box = contentBox(raster)
+        if box is None:
+            continue
+        x0, y0, x1, y1 = box
+        # the profiles span the whole page, so that parts are of equal size
+        # with respect to the page
+        cols = evenSplit(columnProfile(raster, (0, y0, raster.width, y1)),
+                GUTTER_INK * (y1 - y0), max(1, int(MIN_GUTTER * raster.width)))
+        rows = evenSplit(rowProfile(raster, (x0, 0, x1, raster.height)),
+                GUTTER_INK * (x1 - x0), max(1, int(MIN_ROW_GUTTER * raster.height)))
+        votes[cols, rows] += 1
+    if not votes:
+        return None
+    return votes.most_common(1)[0][0]
+
+def samplePages(first, last, initial=None, count=GRID_SAMPLES):
+    """Returns up to count pages from first to last (inclusive), spread
+    evenly and starting with initial (if it is among them)."""
+    n = last - first + 1
+    pages = [ first + (k*n) // count for k in range(min(count, n)) ]
+    if initial is not None and first <= initial <= last:
+        pages = [initial] + [ idx for idx in pages if idx != initial ][:count-1]
+    return pages
+
+def autoGrid(render, pages, dpi=DPI):
+    """Proposes a grid like "2x1" for the given pages of a document (see
+    proposeGrid), which are rendered as GrayRaster by render(idx, dpi); this
+    is "1x1" if nothing is found."""
+    grid = proposeGrid([ render(idx, dpi) for idx in pages ])
+    if grid is None:
+        return "1x1"
+    return "{0}x{1}".format(*grid)
+
+
+def fitsLayout(features, leader):
+    """Checks whether a page with the given features (content box, gutters)
+    fits the layout of the leader of a group."""
+    box, gutters = features
+    leaderBox, leaderGutters = leader
+    if len(gutters) != len(leaderGutters) or any(abs(g - h) > TOLERANCE
+            for g, h in zip(gutters, leaderGutters)):
+        return False
+    if box is None:
+        return True
+    if leaderBox is None:
+        return False
+    return (box[0] >= leaderBox[0] - TOLERANCE and box[1] >= leaderBox[1] - TOLERANCE
+            and box[2] <= leaderBox[2] + TOLERANCE and box[3] <= leaderBox[3] + TOLERANCE)
+
+def clusterLayouts(sizes, features):
+    """Groups pages given by their sizes (width, height, rotation) and
+    features (see pageFeatures) and returns the group of each page (as an
+    array of indices into the list of leaders, which is also returned)."""
+    def area(k):
+        box = features[k][0]
+        return 0 if box is None else (box[2]-box[0]) * (box[3]-box[1])
+    def bucket(width, height, rotation):
+        # sizes within SIZE_TOLERANCE fall into the same or neighbouring
+        # buckets
+        step = log(1 + SIZE_TOLERANCE)
+        return (rotation, int(log(max(width, 1)) / step), int(log(max(height, 1)) / step))
+    labels = array('i', [-1]*len(features))
+    leaders = []
+    buckets = {} # bucket -> groups whose leaders fall into it
+
+    def findGroup(k):
+        width, height, rotation = sizes[k]
+        r, bw, bh = bucket(width, height, rotation)
+        for key in [ (r, bw+dw, bh+dh) for dw in (-1, 0, 1) for dh in (-1, 0, 1) ]:
+            for label in buckets.get(key, ()):
+                lw, lh, lr = sizes[leaders[label]]
+                if (abs(width - lw) <= SIZE_TOLERANCE * lw
+                        and abs(height - lh) <= SIZE_TOLERANCE * lh
+                        and fitsLayout(features[k], features[leaders[label]])):
+                    return label
+        buckets.setdefault((r, bw, bh), []).append(len(leaders))
+        leaders.append(k)
+        return len(leaders) - 1
+
+    for k in sorted(range(len(features)), key=area, reverse=True):
+        labels[k] = findGroup(k)
+    return labels, leaders
+
+
+def findLayouts(geometry, fileName=None, data=None, workers=None, dpi=DPI,
+        document=None):
+    """Groups the pages of a PDF file (or of the PDF given by its data, or
+    its HeadlessDocument document as in pagetrim.mapPages), whose
+    PageGeometry is given, by their layout and returns the group of each
+    page and the leaders of the groups (see clusterLayouts)."""
+    numPages = geometry.numPages()
+    sizes = [ geometry.pageSize(idx) + (geometry.rotation(idx),) for idx in range(numPages) ]
+    features = [ None ] * numPages
+    for idx, f in mapPages(featureWorker, list(range(numPages)), (dpi,),
+            fileName, data, workers, document=document):
+        features[idx] = f
+    return clusterLayouts(sizes, features)
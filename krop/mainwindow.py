@@ -13,7 +13,9 @@ the Free Software Foundation; either version 3 of the License, or
 (at your option) any later version.
 """
 
+import re
 import sys
+from functools import partial
 from os.path import exists, splitext
 from shutil import which
 
@@ -27,8 +29,16 @@ else:
 
 from krop.viewerselections import ViewerSelections, aspectRatioFromStr
 from krop.vieweritem import ViewerItem
-from krop.pdfcropper import PdfFile, PdfCropper, PdfEncryptedError, optimizePdfGhostscript
-from krop.autotrim import autoTrimMargins
+from krop.pdfcropper import PdfFile, PdfCropper, PdfEncryptedError, writeCroppedPdf, lib_crop, hasPyMuPdf
+from krop.cropplan import cropPlan
+from krop.blankpages import removeBlank
+from krop.layouts import autoGrid, samplePages
+from krop.pagetrim import openRenderDocument
+from krop.raster import renderGray
+from krop.textlayer import startTextIndex
+from krop.options import str2pages, parseScopedGrid, parseGridScopes, parsePadding
+from krop.selectionmodel import parseScope, scopeToStr
+from krop.autotrim import autoTrimMargins, despeckleImage
 
 
 class AspectRatioType:
@@ -120,6 +130,22 @@ class DeviceTypeManager(AspectRatioTypeManager):
 class MainWindow(QMainWindow):
 
     fileName = None
+    # if set, the crop plan is saved there when cropping
+    planFileName = None
+    # how to smooth grids trimmed on every page, see pagetrim.parseSmoothing
+    trimSmoothing = None
+    # if positive, specks smaller than that are ignored when trimming
+    trimSpeckSize = 0
+    # whether running headers and footers are excluded when trimming grids
+    # on every page
+    trimFurniture = False
+    # if 'pages' or 'subpages', blank pages (or parts) are left out when
+    # cropping, see blankpages.removeBlank
+    removeBlank = None
+    # Future for the TextIndex of the file (see textlayer.startTextIndex)
+    textIndex = None
+    # the last pattern selected around
+    matchPattern = ""
 
     def __init__(self):
         QMainWindow.__init__(self)
@@ -139,6 +165,14 @@ class MainWindow(QMainWindow):
         self.ui.labelSensitivity.hide()
         self.ui.editSensitivity.hide()
 
+        # whether to cut the pieces for a device at whitespace rows
+        self.checkDistributeSnap = QCheckBox(self.tr("Cut between lines of text"),
+                self.ui.groupDistribute)
+        self.checkDistributeSnap.setToolTip(self.tr("<p>Move each cut up to the nearest "
+            "row without ink, so that lines of text are not sliced in half. The pieces "
+            "are then a little shorter than the aspect ratio asks for.</p>"))
+        self.ui.formLayout.insertRow(2, self.checkDistributeSnap)
+
         # self.ui.tabWidget.
 
         # http://standards.freedesktop.org/icon-naming-spec/icon-naming-spec-latest.html
@@ -189,6 +223,16 @@ class MainWindow(QMainWindow):
         self.addAction(self.ui.actionFirstPage)
         self.addAction(self.ui.actionLastPage)
 
+        self.actionSelectionPageRange = QAction(self.tr('Page Range...'), self)
+        self.actionSelectionPageRange.setToolTip(self.tr('Apply the selection to a range of pages'))
+        self.actionSelectMatches = QAction(self.tr('Select Around Matches...'), self)
+        self.actionSelectMatches.setToolTip(self.tr('Create a selection around each block '
+            'of text matching a pattern, on the page it is on'))
+        self.actionSnapToEdges = QAction(self.tr('Snap to Content'), self)
+        self.actionSnapToEdges.setToolTip(self.tr('Let the edges of selections snap to '
+            'the edges of the content nearby when dragging them'))
+        self.actionSnapToEdges.setCheckable(True)
+
         self.ui.actionOpenFile.triggered.connect(self.slotOpenFile)
         self.ui.actionSelectFile.triggered.connect(self.slotSelectFile)
         self.ui.actionKrop.triggered.connect(self.slotKrop)
@@ -204,6 +248,9 @@ class MainWindow(QMainWindow):
         self.ui.actionNewSelectionGrid.triggered.connect(self.slotNewSelectionGrid)
         self.ui.actionTrimMargins.triggered.connect(self.slotTrimMargins)
         self.ui.actionTrimMarginsAll.triggered.connect(self.slotTrimMarginsAll)
+        self.actionSelectionPageRange.triggered.connect(self.slotSelectionPageRange)
+        self.actionSelectMatches.triggered.connect(self.slotSelectMatches)
+        self.actionSnapToEdges.toggled.connect(self.slotSnapToEdgesChanged)
         self.ui.documentView.customContextMenuRequested.connect(self.slotContextMenu)
         self.ui.editCurrentPage.textEdited.connect(self.slotCurrentPageEdited)
         self.ui.radioSelAll.toggled.connect(self.slotSelectionMode)
@@ -215,6 +262,7 @@ class MainWindow(QMainWindow):
         self.ui.editSelAspectRatio.editingFinished.connect(self.slotSelAspectRatioChanged)
         self.ui.comboDistributeDevice.currentIndexChanged.connect(self.slotDeviceTypeChanged)
         self.ui.editDistributeAspectRatio.editingFinished.connect(self.slotDistributeAspectRatioChanged)
+        self.checkDistributeSnap.toggled.connect(self.slotDistributeSnapChanged)
         self.ui.splitter.splitterMoved.connect(self.slotSplitterMoved)
 
         self.pdfScene = QGraphicsScene(self.ui.documentView)
@@ -237,6 +285,13 @@ class MainWindow(QMainWindow):
             self.ui.checkGhostscript.setChecked(False)
             self.ui.checkGhostscript.setEnabled(False)
 
+        # disable selecting around text and cutting between lines of text
+        # if PyMuPDF (for reading and rendering pages) is not available
+        if not hasPyMuPdf():
+            self.actionSelectMatches.setEnabled(False)
+            self.checkDistributeSnap.setChecked(False)
+            self.checkDistributeSnap.setEnabled(False)
+
         self.ui.documentView.setScene(self.pdfScene)
         self.ui.documentView.setFocus()
 
@@ -250,20 +305,23 @@ class MainWindow(QMainWindow):
         return self.viewer.selections
 
     def currentSelectionUpdated(self):
+        # called once per frame while dragging, so unchanged controls are
+        # left alone
         sel = self.selections.currentSelection
         if sel:
             r = sel.boundingRect()
             self.ui.groupCurrentSel.setEnabled(True)
             index, s = sel.aspectRatioData
-            self.ui.comboSelAspectRatioType.setCurrentIndex(index)
-            self.ui.editSelAspectRatio.setText(s)
             if index == 0:
                 w, h = int(r.width()), int(r.height())
-                self.ui.editSelAspectRatio.setText("{} : {}".format(w, h))
+                s = "{} : {}".format(w, h)
         else:
-            self.ui.comboSelAspectRatioType.setCurrentIndex(0)
-            self.ui.editSelAspectRatio.setText("")
+            index, s = 0, ""
             self.ui.groupCurrentSel.setEnabled(False)
+        if self.ui.comboSelAspectRatioType.currentIndex() != index:
+            self.ui.comboSelAspectRatioType.setCurrentIndex(index)
+        if self.ui.editSelAspectRatio.text() != s:
+            self.ui.editSelAspectRatio.setText(s)
 
     def readSettings(self):
         settings = QSettings()
@@ -283,6 +341,10 @@ class MainWindow(QMainWindow):
         self.ui.editSensitivity.setText(
                 settings.value("Trim/Sensitivity", "5"))
 
+        self.checkDistributeSnap.setChecked(settings.value("Distribute/Snap", "") == "true")
+        self.actionSnapToEdges.setChecked(settings.value("Selections/SnapToEdges", "true") == "true")
+        self.selections.snapToEdges = self.actionSnapToEdges.isChecked()
+
         self.ui.checkGhostscript.setChecked(settings.value("PDF/Optimize", "gs") == "gs")
         self.ui.checkIncludePagesWithoutSelections.setChecked(
                 settings.value("PDF/IncludePagesWithoutSelections", "") == "true")
@@ -306,6 +368,11 @@ class MainWindow(QMainWindow):
         settings.setValue("Trim/Sensitivity",
                 self.ui.editSensitivity.text())
 
+        settings.setValue("Distribute/Snap", "true" if
+                self.checkDistributeSnap.isChecked() else "false")
+        settings.setValue("Selections/SnapToEdges", "true" if
+                self.actionSnapToEdges.isChecked() else "false")
+
         settings.setValue("PDF/Optimize", "gs" if
                 self.ui.checkGhostscript.isChecked() else "no")
         settings.setValue("PDF/IncludePagesWithoutSelections", "true" if
@@ -317,9 +384,11 @@ class MainWindow(QMainWindow):
     def openFile(self, fileName):
         if fileName:
             self.viewer.load(fileName)
+            self.textIndex = None
             if not self.viewer.isEmpty():
                 self.fileName = fileName
                 outputFileName = "%s-cropped.pdf" % splitext(fileName)[0]
+                self.selections.updateRowProfiles()
                 self.slotFitInView(self.ui.actionFitInView.isChecked())
             else:
                 self.fileName = ''
@@ -349,6 +418,17 @@ class MainWindow(QMainWindow):
             # new versions of Qt return a tuple (fileName, selectedFilter)
             self.ui.editFile.setText(fileName[0])
 
+    def requirePyMuPdf(self, feature):
+        """Returns whether PyMuPDF is available; if not, tells the user that
+        it is needed for feature."""
+        if hasPyMuPdf():
+            return True
+        self.showWarning(self.tr("PyMuPDF is needed"), feature + self.tr(" looks at the "
+            "contents of pages, for which PyMuPDF is needed. Please install it first; "
+            "on recent versions of Ubuntu, the following should do the trick:"
+            "\n\tsudo apt-get install python3-pymupdf"))
+        return False
+
     def showWarning(self, title, text):
         # if krop is called with parameter --go, then the main window is never
         # shown; in that case, we output the warning to the shell
@@ -358,15 +438,7 @@ class MainWindow(QMainWindow):
             sys.stderr.write(self.tr('WARNING: ') + title + '\n' + text + '\n')
 
     def str2pages(self, s):
-        pages = []
-        intervals = [ [ n.strip() for n in i.split('-') ]
-                for i in s.split(',') ]
-        for i in intervals:
-            a,b = i[0], i[-1]
-            if a:
-                if not b: b = self.viewer.numPages()
-                pages.extend(range(int(a)-1,int(b))) # subtract 1 because pages are counted from 0 internally
-        return pages
+        return str2pages(s, self.viewer.numPages())
 
     def slotKrop(self):
         # file names
@@ -392,24 +464,35 @@ class MainWindow(QMainWindow):
 
         QApplication.setOverrideCursor(Qt.CursorShape.WaitCursor)
         try:
-            pdf = PdfFile()
-            pdf.loadFromFile(inputFileName)
-            cropper = PdfCropper()
-            cropper.copyDocumentRoot(pdf)
-            for nr in pages:
-                c = self.viewer.cropValues(nr)
-                cropper.addPageCropped(pdf, nr, c, alwaysinclude, rotation)
-            if self.ui.checkGhostscript.isChecked():
-                import tempfile, os
-                with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as fp:
-                    cropper.writeToStream(fp.file)
-                    # we close the file because it depends on the platform
-                    # whether it can be read a second time while still open
-                    fp.close()
-                    optimizePdfGhostscript(fp.name, outputFileName)
-                    os.remove(fp.name)
-            else:
-                cropper.writeToFile(outputFileName)
+            # the input is memory-mapped and released as soon as the cropped
+            # PDF has been written; if both viewer and cropper use PyMuPDF,
+            # we reuse the document that is already open in the viewer
+            with PdfFile() as pdf:
+                session = None
+                if lib_crop == 'PyMuPDF':
+                    session = self.viewer.documentSession(inputFileName)
+                if session is not None:
+                    pdf.loadFromSession(session)
+                else:
+                    pdf.loadFromFile(inputFileName)
+                # the whitespace rows (if needed) are known by now, see
+                # ViewerSelections.updateRowProfiles
+                cropped = [ (nr, self.viewer.cropValues(nr)) for nr in pages ]
+                if self.removeBlank:
+                    cropped = removeBlank([ (nr, c) for nr, c in cropped
+                            if c or alwaysinclude ], self.removeBlank, inputFileName)
+                cropper = PdfCropper()
+                cropper.copyDocumentRoot(pdf)
+                for nr, c in cropped:
+                    cropper.addPageCropped(pdf, nr, c, alwaysinclude, rotation)
+                writeCroppedPdf(cropper, outputFileName,
+                        self.ui.checkGhostscript.isChecked())
+            if self.planFileName:
+                cropPlan(self.viewer.numPages(), self.viewer.cropValues,
+                        self.selections.selectionMode,
+                        self.selections.selectionExceptions,
+                        self.viewer.currentPageIndex, rotation,
+                        [ r.scope for r in self.selections.records ]).save(self.planFileName)
             QApplication.restoreOverrideCursor()
         except PdfEncryptedError as err:
             QApplication.restoreOverrideCursor()
@@ -541,6 +624,12 @@ class MainWindow(QMainWindow):
     def slotDistributeAspectRatioChanged(self):
         self.selections.distributeAspectRatio = aspectRatioFromStr(self.ui.editDistributeAspectRatio.text())
 
+    def slotSnapToEdgesChanged(self, checked):
+        self.selections.snapToEdges = checked
+
+    def slotDistributeSnapChanged(self, checked):
+        self.selections.snapCuts = checked
+
     def slotDeviceTypeChanged(self, index):
         t = self.deviceTypes.getType(index)
         ar = t and "%s : %s" % (t.width, t.height) or "w : h"
@@ -565,8 +654,12 @@ class MainWindow(QMainWindow):
         if menuForSelection:
             popMenu.addAction(self.ui.actionDeleteSelection)
             popMenu.addAction(self.ui.actionTrimMargins)
+            popMenu.addAction(self.actionSelectionPageRange)
         else:
             popMenu.addAction(self.ui.actionTrimMarginsAll)
+        popMenu.addAction(self.actionSelectMatches)
+        popMenu.addSeparator()
+        popMenu.addAction(self.actionSnapToEdges)
         popMenu.exec_(self.ui.documentView.mapToGlobal(pos))
 
     def slotDeleteSelection(self):
@@ -586,60 +679,148 @@ class MainWindow(QMainWindow):
             if ok:
                 self.createSelectionGrid(grid)
 
+    def slotSelectionPageRange(self):
+        sel = self.selections.currentSelection
+        if sel is None:
+            return
+        text = scopeToStr(sel.scope) if sel.scope is not None else ""
+        text, ok = QInputDialog.getText(self, self.tr('Page Range...'),
+                self.tr('Pages the selection applies to (like 5-20 or 5-:odd; leave empty to follow the selection mode):'),
+                text=text)
+        if not ok:
+            return
+        scope = None
+        if text.strip():
+            try:
+                scope = parseScope(text, self.viewer.numPages())
+            except ValueError:
+                self.showWarning(self.tr("Bad value for page range"), self.tr("The page range "
+                    "must be given in the form '5-20' (or '5-' for all pages from page 5 on), "
+                    "optionally followed by ':odd' or ':even'."))
+                return
+        self.selections.setSelectionScope(sel, scope)
+        self.pdfScene.update()
+
+    def slotSelectMatches(self):
+        if self.viewer.isEmpty() or not self.fileName:
+            return
+        if not self.requirePyMuPdf(self.tr("Selecting around matches")):
+            return
+        # the text is extracted while the pattern is entered
+        if self.textIndex is None:
+            self.textIndex = startTextIndex(self.viewer.numPages(), self.fileName)
+        pattern, ok = QInputDialog.getText(self, self.tr('Select Around Matches...'),
+                self.tr('Pattern to look for in the text (a regular expression, like ^Figure [0-9]+):'),
+                text=self.matchPattern)
+        if ok and pattern:
+            self.selectMatches(pattern)
+
+    def selectMatches(self, pattern):
+        """Creates a selection around each block of text matching pattern
+        (see textlayer.TextIndex.search) which applies only to its page."""
+        if self.viewer.isEmpty() or not self.fileName:
+            return
+        if not self.requirePyMuPdf(self.tr("Selecting around matches")):
+            return
+        self.matchPattern = pattern
+        try:
+            padding = parsePadding(self.ui.editPadding.text())
+        except ValueError:
+            padding = [0,0,0,0]
+        # padding is given in pixels (as for trimming)
+        scale = 72.0 / self.viewer.dpi
+        if self.textIndex is None:
+            self.textIndex = startTextIndex(self.viewer.numPages(), self.fileName)
+        QApplication.setOverrideCursor(Qt.CursorShape.WaitCursor)
+        try:
+            hits = self.textIndex.result().search(pattern, [ p*scale for p in padding ])
+        except re.error:
+            QApplication.restoreOverrideCursor()
+            self.showWarning(self.tr("Bad value for pattern"), self.tr("The pattern to select "
+                "around must be a regular expression, like 'Figure [0-9]+'."))
+            return
+        QApplication.restoreOverrideCursor()
+        if not hits:
+            self.showWarning(self.tr("No matches"), self.tr("No text matching the pattern "
+                "was found in the document."))
+            return
+        self.selections.addPageSelections(hits)
+        self.pdfScene.update()
+
     def createSelectionGrid(self, grid):
         if self.viewer.isEmpty():
             return
 
+        # proposing a grid and finding text columns look at the contents of
+        # pages
+        kinds = { part.partition('@')[0].strip() for part in grid.split(';') }
+        if 'auto' in kinds and not self.requirePyMuPdf(self.tr("Proposing a grid")):
+            return
+        if 'columns' in kinds and not self.requirePyMuPdf(self.tr("Finding text columns")):
+            return
+
         try:
-            colsrows = [int(x) for x in grid.split('x')]
-            cols = colsrows[0]
             # if only one value is specified, we determine the number of
             # columns/rows according to whether the page is landscape or
             # portrait
-            if len(colsrows) == 1:
-                if self.viewer.isPortrait():
-                    cols, rows = 1, cols
-                else:
-                    rows = 1
-            else:
-                rows = colsrows[1]
+            grids = []
+            for g, scope in parseGridScopes(grid, self.viewer.numPages()):
+                if g == 'auto':
+                    g = self.autoGrid(scope)
+                if g == 'columns':
+                    grids.append((g, None, scope))
+                    continue
+                grids.append((g, parseScopedGrid(g, scope, self.viewer.geometry,
+                    self.viewer.currentPageIndex), scope))
         except:
             self.showWarning(self.tr("Bad value for grid parameter"), self.tr("For creating a grid "
                 "of selections, you need to specify the dimensions of the grid in the form '2x3'. "
                 "You can also enter a single number, in which case the number of columns/rows is "
-                "determined according to whether the page is landscape or portrait."))
+                "determined according to whether the page is landscape or portrait. "
+                "To use a grid only on some pages, append them as in '2x1@11-20:odd'; "
+                "several grids are separated by ';'."))
             return
 
-        for j in range(rows):
-            for i in range(cols):
-                sel = self.selections.addSelection()
-                r = sel.boundingRect()
-                w = r.width()/cols
-                h = r.height()/rows
-                p0 = QPointF(r.left()+i*w, r.top()+j*h)
-                sel.setBoundingRect(p0, p0 + QPointF(w, h))
+        for g, size, scope in grids:
+            if g == 'columns':
+                # a selection for each column of text on every page
+                self.selections.addColumns(self.fileName,
+                        None if scope in ('all', 'layout') else scope)
+                continue
+            if scope in ('all', 'layout'):
+                # a grid on every page individually (or shared by the pages
+                # with the same layout)
+                self.selections.addPageGrid(g, scope == 'layout')
+                continue
+            cols, rows = size
+            for j in range(rows):
+                for i in range(cols):
+                    sel = self.selections.addSelection()
+                    r = sel.boundingRect()
+                    w = r.width()/cols
+                    h = r.height()/rows
+                    p0 = QPointF(r.left()+i*w, r.top()+j*h)
+                    sel.setBoundingRect(p0, p0 + QPointF(w, h))
+                    if scope is not None:
+                        self.selections.setSelectionScope(sel, scope)
         self.pdfScene.update()
 
+    def autoGrid(self, scope=None):
+        """Proposes a grid like "2x1" for the pages within scope, looking at
+        only a few of them (see layouts.autoGrid)."""
+        first, last = 0, self.viewer.numPages()-1
+        if scope not in (None, 'all', 'layout'):
+            first, last = scope[0], scope[1]
+        doc = openRenderDocument(self.fileName)
+        try:
+            return autoGrid(partial(renderGray, doc), samplePages(first, last, self.viewer.currentPageIndex))
+        finally:
+            doc.close()
+
     def getPadding(self):
         """Return [top, right, bottom, left] tuple specifying padding for trimming margins."""
         try:
-            # padding can be specified as in CSS (using one to four values):
-            # top, right, bottom, left
-            # top, right+left, bottom
-            # top+bottom, right+left
-            # top+bottom+right+left
-            padding = [ float(a) for a in self.ui.editPadding.text().split(',') if a ]
-            if len(padding) == 0:
-                return [0,0,0,0]
-            if len(padding) == 1:
-                return 4*padding
-            if len(padding) == 2:
-                return 2*padding
-            if len(padding) == 3:
-                return padding + [padding[1]]
-            if len(padding) == 4:
-                return padding
-            raise ValueError
+            return parsePadding(self.ui.editPadding.text())
         except ValueError:
             self.showWarning(self.tr("Bad value for padding"), self.tr("The value of padding "
                 "(under settings for trimming margins) must be a list of one to four floats, "
@@ -654,15 +835,33 @@ class MainWindow(QMainWindow):
         # trim margins of all selections on the current page
         noSelections = True
         for sel in self.selections.items:
-            if sel.isVisible():
-                noSelections = False
-                self.trimMarginsSelection(sel)
+            noSelections = False
+            self.trimMarginsSelection(sel)
+        # grids on every page are trimmed on every page
+        if (self.selections.pageGrids or self.selections.layoutGrids) and self.fileName:
+            noSelections = False
+            self.trimMarginsPages()
+        # text columns fit their text already
+        if self.selections.columnScopes:
+            noSelections = False
         # if there is no selections, then create one
         if noSelections and not self.viewer.isEmpty():
             sel = self.selections.addSelection()
             self.trimMarginsSelection(sel)
         self.pdfScene.update()
 
+    def trimMarginsPages(self):
+        sensitivity = float(self.ui.editSensitivity.text())
+        allowedchanges = float(self.ui.editAllowedChanges.text())
+        QApplication.setOverrideCursor(Qt.CursorShape.WaitCursor)
+        try:
+            self.selections.trimPages(self.fileName, self.getPadding(),
+                    sensitivity, allowedchanges, self.trimSmoothing,
+                    self.trimSpeckSize, self.trimFurniture,
+                    self.ui.checkTrimUseAllPages.isChecked())
+        finally:
+            QApplication.restoreOverrideCursor()
+
     def slotTrimMargins(self):
         if self.selections.currentSelection is not None:
             self.trimMarginsSelection(self.selections.currentSelection)
@@ -685,6 +884,8 @@ class MainWindow(QMainWindow):
             for idx in pages:
                 # calculate values for trimming
                 img = self.viewer.getImage(idx)
+                if self.trimSpeckSize > 0:
+                    img = despeckleImage(img, self.trimSpeckSize)
                 nrect = autoTrimMargins(img, orect, nrect, sensitivity, allowedchanges)
 
             orect = QRectF(orect)
@@ -0,0 +1,137 @@
+# -*- coding: iso-8859-1 -*-
+
+"""
+The options for cropping without the graphical interface, and the parsers
+for the values given on the command line (which the graphical interface
+understands as well).
+
+Copyright (C) 2010-2025 Armin Straub, http://arminstraub.com
+"""
+
+"""
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 3 of the License, or
+(at your option) any later version.
+"""
+
+from krop.selectionmodel import parseScope
+
+
+def str2pages(s, numPages):
+    """Converts a string like "1-5" or "1,3-" into a list of page indices
+    (counted from 0)."""
+    pages = []
+    intervals = [ [ n.strip() for n in i.split('-') ]
+            for i in s.split(',') ]
+    for i in intervals:
+        a,b = i[0], i[-1]
+        if a:
+            if not b: b = numPages
+            pages.extend(range(int(a)-1,int(b))) # subtract 1 because pages are counted from 0 internally
+    return pages
+
+def parseGrid(grid, portrait):
+    """Parses a grid like "2x3" (2 columns, 3 rows) and returns the tuple
+    (cols, rows). If only one value is specified, the number of columns/rows
+    is determined according to whether the page is landscape or portrait.
+    Raises ValueError for bad values."""
+    colsrows = [int(x) for x in grid.split('x')]
+    if len(colsrows) == 1:
+        if portrait:
+            return 1, colsrows[0]
+        return colsrows[0], 1
+    if len(colsrows) != 2:
+        raise ValueError(grid)
+    return colsrows[0], colsrows[1]
+
+def parseScopedGrid(grid, scope, geometry, initialPageIndex):
+    """Parses a grid with its scope (see parseGridScopes) as in parseGrid:
+    whether the page is landscape or portrait is decided by the first page
+    of the scope or, for grids without pages (and grids on every page), by
+    the initial page. Both HeadlessKrop and the graphical interface use this
+    so that a grid gives the same selections in both."""
+    idx = initialPageIndex if scope in (None, 'all', 'layout') else scope[0]
+    return parseGrid(grid, geometry.isPortrait(idx))
+
+def parseGridScopes(grid, numPages):
+    """Splits a grid specification into a list of tuples (grid, scope).
+    Several grids can be separated by ';' and each can be followed by '@'
+    and the pages it applies to, as in "1@1-10;2x1@11-" (see
+    selectionmodel.parseScope); the scope of grids without pages is None.
+    The scope of "1@all" is 'all': such a grid is created on every page
+    individually (see krop.pagetrim). The scope of "1@layout" is 'layout':
+    such a grid is created on every page as well, but shared by the pages
+    with the same layout when trimming (see krop.layouts). Instead of a grid,
+    "auto" asks for a proposal (see layouts.autoGrid), and "columns" for a
+    selection for each column of text (see krop.textlayer). Raises
+    ValueError for bad values."""
+    specs = []
+    for part in grid.split(';'):
+        if not part.strip():
+            continue
+        g, sep, pages = part.partition('@')
+        if pages.strip() in ('all', 'layout'):
+            scope = pages.strip()
+        else:
+            scope = parseScope(pages, numPages) if sep else None
+        specs.append((g.strip(), scope))
+    if not specs:
+        raise ValueError(grid)
+    return specs
+
+def parsePadding(s):
+    """Returns [top, right, bottom, left] padding for trimming margins.
+    Raises ValueError for bad values."""
+    # padding can be specified as in CSS (using one to four values):
+    # top, right, bottom, left
+    # top, right+left, bottom
+    # top+bottom, right+left
+    # top+bottom+right+left
+    padding = [ float(a) for a in s.split(',') if a ]
+    if len(padding) == 0:
+        return [0,0,0,0]
+    if len(padding) == 1:
+        return 4*padding
+    if len(padding) == 2:
+        return 2*padding
+    if len(padding) == 3:
+        return padding + [padding[1]]
+    if len(padding) == 4:
+        return padding
+    raise ValueError(s)
+
+def gridCropValues(cols, rows):
+    """Returns the crop values (left, top, right, bottom as fractions of the
+    displayed page) of a grid of selections, ordered by rows."""
+    return [ (i/cols, j/rows, 1-(i+1)/cols, 1-(j+1)/rows)
+            for j in range(rows) for i in range(cols) ]
+
+
+class KropOptions:
+    """Choices for cropping a file without the graphical interface; these
+    correspond to the command line options."""
+    def __init__(self):
+        self.grid = None
+        self.selections = None # 'all', 'evenodd' or 'individual'
+        self.exceptions = None
+        self.initialPage = None
+        self.whichPages = None
+        self.rotate = None # None means: as in the plan (if any), otherwise 0
+        self.optimize = False
+        self.alwaysInclude = False
+        self.removeBlank = None # 'pages' or 'subpages', see blankpages.removeBlank
+        self.trim = False
+        self.trimUseAllPages = False
+        self.trimPadding = "2"
+        self.trimSensitivity = 5.0
+        self.trimAllowedChanges = 0.0
+        self.trimWorkers = None # processes for trimming pages individually
+        self.trimSmoothing = None # like "median:5", see pagetrim.parseSmoothing
+        self.trimSpeckSize = 0 # if positive, despeckle pages before trimming
+        self.trimFurniture = False # exclude running headers and footers
+        self.selectMatches = None # select the blocks of text matching this pattern
+        self.plan = None # CropPlan (or the name of its file) to crop by
+        self.savePlan = None # file name to save the CropPlan to
+        self.buildCache = False # skip files whose output is up to date
+        self.force = False # crop even if the output is up to date
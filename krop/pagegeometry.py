@@ -0,0 +1,115 @@
+# -*- coding: iso-8859-1 -*-
+
+"""
+Page geometry of the PDF documents handled by krop.
+
+Copyright (C) 2010-2025 Armin Straub, http://arminstraub.com
+"""
+
+"""
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 3 of the License, or
+(at your option) any later version.
+"""
+
+from array import array
+from math import ceil, floor
+
+
+# MuPDF tolerates rounding errors this large when rounding to pixels
+EPSILON = 0.001
+
+
+class PageGeometry:
+    """Table with the geometry of all pages of a document.
+
+    For every page, we store MediaBox and CropBox (in PDF coordinates, that
+    is, (0,0) is the bottom-left point), the rotation and the size in pixels
+    of the page when rendered at the resolution dpi. The table is filled in
+    one pass when the document is opened; afterwards, queries neither render
+    nor load any pages."""
+
+    def __init__(self, dpi=96):
+        self.dpi = dpi
+        self._boxes = array('d') # 8 values per page: MediaBox, CropBox
+        self._rotations = array('H')
+        self._sizes = array('L') # 2 values per page: width, height
+
+    def __len__(self):
+        return len(self._rotations)
+
+    def numPages(self):
+        return len(self._rotations)
+
+    def appendPage(self, mediabox, cropbox, rotation, size=None):
+        """Adds the next page. If size is None, the size in pixels is
+        computed from the CropBox; renderers which know better (because they
+        round differently) can specify it."""
+        rotation = int(rotation) % 360
+        self._boxes.extend(float(x) for x in mediabox)
+        self._boxes.extend(float(x) for x in cropbox)
+        self._rotations.append(rotation)
+        if size is None:
+            x0, y0, x1, y1 = cropbox
+            if rotation in (90, 270):
+                x0, y0, x1, y1 = y0, x0, y1, x1
+            z = self.dpi / 72.0
+            size = (_pixelExtent(x0, x1, z), _pixelExtent(y0, y1, z))
+        self._sizes.extend(size)
+
+    def mediaBox(self, idx):
+        return tuple(self._boxes[8*idx:8*idx+4])
+
+    def cropBox(self, idx):
+        return tuple(self._boxes[8*idx+4:8*idx+8])
+
+    def rotation(self, idx):
+        return self._rotations[idx]
+
+    def pageSize(self, idx):
+        """Returns the size (in points) of the page as displayed, that is,
+        the size of the rotated CropBox."""
+        x0, y0, x1, y1 = self._boxes[8*idx+4:8*idx+8]
+        w, h = abs(x1-x0), abs(y1-y0)
+        if self._rotations[idx] in (90, 270):
+            return h, w
+        return w, h
+
+    def pixelSize(self, idx):
+        return self._sizes[2*idx], self._sizes[2*idx+1]
+
+    def isPortrait(self, idx):
+        w, h = self._sizes[2*idx], self._sizes[2*idx+1]
+        return w <= h
+
+
+def _float32(x):
+    return array('f', [x])[0]
+
+def _pixelExtent(a, b, z):
+    """Returns the number of pixels covered by the interval from a to b (in
+    points) when rendered at zoom z, computed like MuPDF does: the page is
+    moved to the origin and scaled, both ends are rounded outwards (up to
+    EPSILON) and the results are subtracted, all in single precision (so
+    that sizes agree with MuPDF even where the product is close to an
+    integer)."""
+    a, b = _float32(min(a, b)), _float32(max(a, b))
+    z, eps = _float32(z), _float32(EPSILON)
+    x0 = _float32(_float32(a - a) * z)
+    x1 = _float32(_float32(b - a) * z)
+    return max(int(ceil(_float32(x1 - eps))) - int(floor(_float32(x0 + eps))), 0)
+
+
+def cropValuesForRotation(cv, r):
+    """Crop values (left, top, right, bottom) are determined with respect to
+    the page as displayed; this returns them with respect to the unrotated
+    page."""
+    if r == 90: # Landscape
+        return [ cv[1], cv[2], cv[3], cv[0] ]
+    elif r == 180: # UpsideDown
+        return [ cv[2], cv[3], cv[0], cv[1] ]
+    elif r == 270: # Seascape
+        return [ cv[3], cv[0], cv[1], cv[2] ]
+    else: # r == 0, Portrait
+        return cv
@@ -0,0 +1,416 @@
+# -*- coding: iso-8859-1 -*-
+
+"""
+Trimming the margins of every page individually.
+
+A grid like "1@all" creates its selections on every page individually (see
+options.parseGridScopes). Instead of a selection for each page, such page
+grids are kept as their crop values only: PageCrops stores them compactly,
+and trimPages computes them for the whole document.
+
+Trimming pages independently makes the crops jitter from page to page (a
+short last line or a page number changes the box); PageCrops.smooth evens
+this out over neighbouring pages afterwards, without rendering again.
+
+Optionally, running headers and footers are left out (see krop.furniture).
+Which bands are furniture is only known after seeing all pages, so for each
+page the trims without the first few candidate bands are kept as well; the
+pages are still rendered only once.
+
+Pages are rendered and trimmed in several processes. They are handed out in
+chunks, and only a few chunks are in flight at any time, so that memory use
+does not depend on the number of pages; results are yielded in page order.
+
+Copyright (C) 2010-2025 Armin Straub, http://arminstraub.com
+"""
+
+"""
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 3 of the License, or
+(at your option) any later version.
+"""
+
+import multiprocessing
+import os
+from array import array
+from bisect import bisect_left, insort
+from collections import deque
+
+from krop.furniture import FurnitureDetector, candidateBands
+from krop.options import parseGrid, gridCropValues
+from krop.raster import renderGray, trimRaster, intersectRects, despeckle
+
+
+# selections trimmed to less than this fraction of the page (in both
+# directions) are considered blank
+BLANK = 0.01
+
+
+def pageGridCropValues(grids, portrait):
+    """Returns the crop values of the page grids (given as strings like
+    "2x1") on a page which is portrait or landscape."""
+    cropValues = []
+    for grid in grids:
+        cols, rows = parseGrid(grid, portrait)
+        cropValues.extend(gridCropValues(cols, rows))
+    return cropValues
+
+def pageGridCount(grids):
+    """Returns the number of selections created by page grids on each page
+    (which does not depend on the orientation of the page)."""
+    return len(pageGridCropValues(grids, True))
+
+
+class PageCrops:
+    """Crop values of the page grids of each page, stored in a flat array.
+
+    Every page has the same number of selections (count), so the values of
+    page idx are found at a fixed offset."""
+
+    def __init__(self, numPages, count):
+        self.numPages = numPages
+        self.count = count
+        self._values = array('d', bytes(array('d').itemsize*4*count*numPages))
+        self._known = array('b', bytes(numPages))
+
+    def __contains__(self, idx):
+        return bool(self._known[idx])
+
+    def set(self, idx, cropValues):
+        k = 4*self.count*idx
+        self._values[k:k+4*self.count] = array('d', [ x for cv in cropValues for x in cv ])
+        self._known[idx] = 1
+
+    def get(self, idx):
+        k = 4*self.count*idx
+        v = self._values
+        return [ tuple(v[k+4*i:k+4*i+4]) for i in range(self.count) ]
+
+    def blank(self, idx, i):
+        """Returns whether selection i on page idx was trimmed to (almost)
+        nothing, since it is blank there."""
+        k = 4*self.count*idx + 4*i
+        return isBlank(self._values[k:k+4])
+
+    def smooth(self, window, method='median', evenodd=False):
+        """Replaces each crop value by the median (method 'median') or the
+        minimum (method 'max', giving the largest box) of that value on the
+        pages within a window of neighbouring pages. If evenodd is set, even
+        and odd pages are smoothed separately (the window then counts pages
+        of the same parity). Only pages with known crop values are used,
+        and a selection is left out on pages where it is blank (its crop
+        values would otherwise be pulled into its neighbours)."""
+        if window <= 1:
+            return
+        smoothed = _rollingMedian if method == 'median' else _rollingMin
+        pages = [ idx for idx in range(self.numPages) if self._known[idx] ]
+        step = 2 if evenodd else 1
+        groups = [ pages ]
+        if evenodd:
+            groups = [ [ idx for idx in pages if idx % 2 == parity ] for parity in (0, 1) ]
+        for group in groups:
+            for i in range(self.count):
+                self._smoothSelection(i, [ idx for idx in group if not self.blank(idx, i) ],
+                        window, smoothed, step)
+
+    def _smoothSelection(self, i, pages, window, smoothed, step):
+        """Smoothes the crop values of selection i over the given pages."""
+        if not pages:
+            return
+        stride = 4*self.count
+        if pages == list(range(pages[0], pages[-1]+1, step)):
+            # the values of one coordinate on these pages form a slice of
+            # the array
+            for j in range(4*i, 4*i+4):
+                coordinate = slice(pages[0]*stride + j, pages[-1]*stride + j + 1, step*stride)
+                self._values[coordinate] = array('d', smoothed(self._values[coordinate], window))
+            return
+        for j in range(4*i, 4*i+4):
+            values = smoothed([ self._values[idx*stride + j] for idx in pages ], window)
+            for idx, x in zip(pages, values):
+                self._values[idx*stride + j] = x
+
+    def share(self, labels, start=0):
+        """Replaces the crop values of the selections from start on by their
+        union (that is, the smallest crop values) over all pages with the
+        same label. Selections which were trimmed to (almost) nothing, since
+        they are blank on a page, are left out of the union. If start is 0,
+        pages whose crop values are not known get them from the pages with
+        their label as well."""
+        stride = 4*self.count
+        union = {} # (label, selection) -> crop values
+        first = {} # (label, selection) -> crop values on the first page
+        for idx in range(self.numPages):
+            if not self._known[idx]:
+                continue
+            for i in range(start, self.count):
+                k = idx*stride + 4*i
+                cv = self._values[k:k+4]
+                # if the selection is blank on all pages, it stays blank
+                first.setdefault((labels[idx], i), cv)
+                if isBlank(cv):
+                    continue
+                u = union.get((labels[idx], i))
+                union[labels[idx], i] = cv if u is None else array('d', map(min, u, cv))
+        for idx in range(self.numPages):
+            if not (self._known[idx] or start == 0):
+                continue
+            found = [ union.get((labels[idx], i), first.get((labels[idx], i)))
+                    for i in range(start, self.count) ]
+            if not self._known[idx] and None in found:
+                continue
+            for i, u in zip(range(start, self.count), found):
+                if u is not None:
+                    k = idx*stride + 4*i
+                    self._values[k:k+4] = u
+            self._known[idx] = 1
+
+    def fillBlank(self):
+        """Gives selections which are blank on a page the crop values of the
+        nearest page on which they are not, preferring pages of the same
+        parity (so that blank pages are cropped like their neighbours
+        instead of to a single point). Selections which are blank on all
+        pages stay blank."""
+        stride = 4*self.count
+        pages = [ idx for idx in range(self.numPages) if self._known[idx] ]
+        for i in range(self.count):
+            filled = [ idx for idx in pages if not self.blank(idx, i) ]
+            if not filled or len(filled) == len(pages):
+                continue
+            byParity = [ [ idx for idx in filled if idx % 2 == parity ] for parity in (0, 1) ]
+            for idx in pages:
+                if not self.blank(idx, i):
+                    continue
+                nearest = _nearest(byParity[idx % 2] or filled, idx)
+                k, n = idx*stride + 4*i, nearest*stride + 4*i
+                self._values[k:k+4] = self._values[n:n+4]
+
+
+def isBlank(cropValues):
+    """Returns whether a selection, given by its crop values, was trimmed
+    to (almost) nothing."""
+    x0, y0, x1, y1 = cropValues
+    return 1 - x0 - x1 < BLANK and 1 - y0 - y1 < BLANK
+
+def _nearest(items, x):
+    """Returns the entry of the sorted, nonempty list items nearest to x."""
+    k = bisect_left(items, x)
+    if k == len(items) or (k > 0 and x - items[k-1] <= items[k] - x):
+        return items[k-1]
+    return items[k]
+
+
+def _rollingMedian(values, window):
+    """Returns the medians of values within a centered window (which is
+    truncated at both ends). The window is kept sorted, so that each step
+    takes a binary search and a move of at most window entries in C; even
+    for thousands of pages, this takes milliseconds (next to rendering the
+    pages, which takes minutes), so NumPy is not worth an import here."""
+    h = window // 2
+    n = len(values)
+    current = sorted(values[:h])
+    result = []
+    for i in range(n):
+        if i + h < n:
+            insort(current, values[i+h])
+        if i - h - 1 >= 0:
+            del current[bisect_left(current, values[i-h-1])]
+        result.append(current[len(current)//2])
+    return result
+
+def _rollingMin(values, window):
+    """Returns the minima of values within a centered window (which is
+    truncated at both ends), in linear time (each index enters and leaves
+    the deque of candidates once)."""
+    h = window // 2
+    n = len(values)
+    candidates = deque() # indices of increasing values
+    result = []
+    for i in range(n + h):
+        if i < n:
+            while candidates and values[candidates[-1]] >= values[i]:
+                candidates.pop()
+            candidates.append(i)
+        if i - h >= 0:
+            while candidates[0] < i - 2*h:
+                candidates.popleft()
+            result.append(values[candidates[0]])
+    return result
+
+
+def parseSmoothing(s):
+    """Parses how to smooth trimmed pages, as in "5" (median over windows of
+    5 pages), "max:5" or "median:5:evenodd", and returns the tuple (window,
+    method, evenodd). Raises ValueError for bad values."""
+    parts = [ p.strip() for p in s.split(':') ]
+    method, evenodd = 'median', False
+    if parts and parts[-1] == 'evenodd':
+        evenodd = True
+        parts.pop()
+    if len(parts) == 2:
+        method = parts.pop(0)
+    if len(parts) != 1 or method not in ('median', 'max'):
+        raise ValueError(s)
+    window = int(parts[0])
+    if window < 0:
+        raise ValueError(s)
+    return window, method, evenodd
+
+
+def trimCropValues(raster, cropValues, padding=(0,0,0,0), sensitivity=5.0,
+        allowedchanges=0.0, rows=None):
+    """Trims selections (given by their crop values) on a single page. If
+    rows is given as (y0, y1), only these rows are considered."""
+    width, height = raster.width, raster.height
+    dtop, dright, dbottom, dleft = padding
+    trimmed = []
+    for cv in cropValues:
+        orect = (int(round(cv[0]*width)), int(round(cv[1]*height)),
+                int(round((1-cv[2])*width)), int(round((1-cv[3])*height)))
+        if rows is not None and max(orect[1], rows[0]) < min(orect[3], rows[1]):
+            orect = (orect[0], max(orect[1], rows[0]), orect[2], min(orect[3], rows[1]))
+        nrect = trimRaster(raster, orect, None, sensitivity, allowedchanges)
+        # adjust for padding but don't overadjust
+        x0, y0, x1, y1 = intersectRects((nrect[0]-dleft, nrect[1]-dtop,
+            nrect[2]+dright, nrect[3]+dbottom), orect)
+        trimmed.append((x0/width, y0/height, 1-x1/width, 1-y1/height))
+    return trimmed
+
+
+# the document opened by a worker process and, when pages are processed in
+# this process, the HeadlessDocument providing it (see mapPages)
+_document = None
+_source = None
+
+def openRenderDocument(fileName=None, data=None):
+    from krop.pdfcropper import importPyMuPdf
+    fitz = importPyMuPdf()
+    if data is None:
+        return fitz.open(fileName)
+    return fitz.open(stream=data, filetype="pdf")
+
+def initTrimWorker(fileName, data, source=None):
+    global _document, _source
+    if source is not None:
+        _document, _source = source.renderDocument(), source
+    else:
+        _document = openRenderDocument(fileName, data)
+
+def closeTrimWorker():
+    global _document, _source
+    # the document of a HeadlessDocument is closed by its owner
+    if _source is None:
+        _document.close()
+    _document = _source = None
+
+def workerDocument():
+    """Returns the document opened in this worker process (see mapPages)."""
+    return _document
+
+def workerRender(idx, dpi):
+    """Renders page idx of the document of this worker process as
+    GrayRaster, using the render cache of its HeadlessDocument if any."""
+    if _source is not None:
+        return _source.renderPage(idx, dpi)
+    return renderGray(_document, idx, dpi)
+
+def trimWorker(pages, gridValues, padding, sensitivity, allowedchanges, dpi,
+        speckSize=0, furniture=False):
+    """Trims the page grids on the given pages of the document of the
+    worker process and returns a list of (page index, crop values).
+    gridValues are the crop values of the page grids on landscape and on
+    portrait pages. If speckSize is positive, the pages are despeckled
+    first (see raster.despeckle).
+
+    With furniture, the crop values are replaced by the tuple (trims, top,
+    bottom): top and bottom are the signatures of the candidate bands (see
+    furniture.candidateBands) and trims[i][j] are the crop values without
+    the first i bands at the top and j bands at the bottom."""
+    results = []
+    for idx in pages:
+        raster = workerRender(idx, dpi)
+        if speckSize > 0:
+            raster = despeckle(raster, speckSize)
+        cropValues = gridValues[raster.width <= raster.height]
+        if not furniture:
+            results.append((idx, trimCropValues(raster, cropValues, padding,
+                sensitivity, allowedchanges)))
+            continue
+        top, bottom = candidateBands(raster)
+        tops = [0] + [ cut for y0, y1, cut, signature in top ]
+        bottoms = [raster.height] + [ cut for y0, y1, cut, signature in bottom ]
+        trims = [ [ trimCropValues(raster, cropValues, padding, sensitivity,
+            allowedchanges, (y0, y1)) for y1 in bottoms ] for y0 in tops ]
+        results.append((idx, (trims, [ b[3] for b in top ], [ b[3] for b in bottom ])))
+    return results
+
+
+def trimPages(pages, grids, padding=(0,0,0,0), sensitivity=5.0,
+        allowedchanges=0.0, fileName=None, data=None, workers=None,
+        chunkSize=8, dpi=96, speckSize=0, furniture=False, document=None):
+    """Trims the page grids on each of the pages of a PDF file (or of the
+    PDF given by its data) and yields (page index, crop values) in order of
+    the pages. The pages are processed by a pool of worker processes (one
+    per CPU if workers is None), or with the HeadlessDocument document if
+    given (see mapPages). With furniture, running headers and footers are
+    excluded (and results are only yielded once all pages have been
+    seen)."""
+    pages = list(pages)
+    gridValues = (pageGridCropValues(grids, False), pageGridCropValues(grids, True))
+    args = (gridValues, padding, sensitivity, allowedchanges, dpi, speckSize, furniture)
+    results = mapPages(trimWorker, pages, args, fileName, data, workers,
+            chunkSize, document)
+    if not furniture:
+        yield from results
+        return
+    detector = FurnitureDetector()
+    candidates = []
+    for idx, (trims, top, bottom) in results:
+        detector.add(top + bottom)
+        candidates.append((idx, trims, top, bottom))
+    for idx, trims, top, bottom in candidates:
+        yield idx, trims[detector.excluded(top)][detector.excluded(bottom)]
+
+def mapPages(worker, items, args=(), fileName=None, data=None, workers=None,
+        chunkSize=8, document=None):
+    """Calls worker(chunk, *args) on chunks of items (usually page indices)
+    in the worker processes, each of which has the document opened, and
+    yields the entries of the returned lists in order.
+
+    If the items are processed in this process and document (an already
+    loaded HeadlessDocument of the file) is given, its PyMuPDF document and
+    its cache of renders are used instead of opening the file again (see
+    workerRender)."""
+    chunks = [ items[k:k+chunkSize] for k in range(0, len(items), chunkSize) ]
+    if workers is None:
+        workers = os.cpu_count() or 1
+    # when already running in a worker process (in batch mode or as part of
+    # the service), the pages are trimmed right there
+    if workers <= 1 or len(chunks) <= 1 or multiprocessing.parent_process() is not None:
+        initTrimWorker(fileName, data, document)
+        try:
+            for chunk in chunks:
+                yield from worker(chunk, *args)
+        finally:
+            closeTrimWorker()
+        return
+    from concurrent.futures import ProcessPoolExecutor
+    workers = min(workers, len(chunks))
+    # workers are spawned since forking the graphical interface is unsafe
+    with ProcessPoolExecutor(max_workers=workers, initializer=initTrimWorker,
+            initargs=(fileName, data),
+            mp_context=multiprocessing.get_context('spawn')) as executor:
+        pending = deque()
+        chunks = iter(chunks)
+        for chunk in chunks:
+            pending.append(executor.submit(worker, chunk, *args))
+            # keep every worker busy, but not more than that
+            if len(pending) >= 2*workers:
+                break
+        while pending:
+            results = pending.popleft().result()
+            chunk = next(chunks, None)
+            if chunk is not None:
+                pending.append(executor.submit(worker, chunk, *args))
+            yield from results
@@ -14,22 +14,134 @@ the Free Software Foundation; either version 3 of the License, or
 """
 
 import copy
+import io
+import mmap
+import os
 import sys
 
-from krop.config import PYQT6
+from krop.pagegeometry import PageGeometry
 
 
 class PdfEncryptedError(Exception):
     pass
 
 
+class PdfInputBuffer:
+    """Read-only, memory-mapped view of a PDF file.
+
+    The mapping is shared with the page cache of the operating system, so
+    handing it to a PDF library does not copy the file into memory. Files
+    that cannot be mapped (for instance, empty files or pipes) fall back to
+    the plain file object."""
+    def __init__(self, filename):
+        self.file = open(filename, "rb")
+        try:
+            self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):
+            self.mmap = None
+    @property
+    def stream(self):
+        """A seekable file-like object positioned at the start of the data."""
+        if self.mmap is not None:
+            self.mmap.seek(0)
+            return self.mmap
+        self.file.seek(0)
+        return self.file
+    def close(self):
+        if self.mmap is not None:
+            try:
+                self.mmap.close()
+            except BufferError:
+                # some library still holds a view; the mapping will be
+                # released once that view is garbage collected
+                pass
+            self.mmap = None
+        self.file.close()
+
+def fileStamp(filename):
+    """Returns modification time and size of a file (or None if the file
+    cannot be accessed), which serves to detect changes on disk."""
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+class PdfDocumentSession:
+    """A PyMuPDF document opened once (by the viewer) and shared with
+    PyMuPdfFile, so that cropping does not have to parse the file again.
+
+    The owner of the session is the only one allowed to close the document;
+    users of a session only read from it."""
+    def __init__(self, filename, document):
+        self.filename = os.path.abspath(filename)
+        self.stamp = fileStamp(filename)
+        self.document = document
+    def isValid(self, filename=None):
+        """Checks that the document is still open and that the file has not
+        changed since it was opened."""
+        if self.document is None or self.document.is_closed:
+            return False
+        if filename is not None and os.path.abspath(filename) != self.filename:
+            return False
+        return self.stamp is not None and fileStamp(self.filename) == self.stamp
+    def close(self):
+        if self.document is not None:
+            self.document.close()
+            self.document = None
+
 class AbstractPdfFile:
     """Abstract class for loading a PDF document used in a corresponding
     PdfCropper class"""
+    _input = None
     def loadFromStream(self, stream):
         pass
+    def loadFromBuffer(self, buf):
+        self.loadFromStream(buf.stream)
     def loadFromFile(self, filename):
-        self.loadFromStream(open(filename, "rb"))
+        self.close()
+        self._input = PdfInputBuffer(filename)
+        try:
+            self.loadFromBuffer(self._input)
+        except Exception:
+            self.close()
+            raise
+    def loadFromMemory(self, data):
+        self.loadFromStream(io.BytesIO(data))
+    def loadFromData(self, data):
+        """Loads a PDF document held in memory (bytes, bytearray or
+        memoryview); data must not be modified while the document is used."""
+        self.close()
+        try:
+            self.loadFromMemory(data)
+        except Exception:
+            self.close()
+            raise
+    def numPages(self):
+        return 0
+    def pageGeometry(self, nr):
+        """Returns MediaBox, CropBox (both in PDF coordinates) and rotation of
+        a page."""
+        pass
+    def buildGeometry(self, dpi=96):
+        geometry = PageGeometry(dpi)
+        for nr in range(self.numPages()):
+            geometry.appendPage(*self.pageGeometry(nr))
+        return geometry
+    def closeReader(self):
+        pass
+    def close(self):
+        """Releases the document and the underlying file. The document must
+        not be used after this (in particular, cropping needs to be completed
+        before the input is closed)."""
+        self.closeReader()
+        if self._input is not None:
+            self._input.close()
+            self._input = None
+    def __enter__(self):
+        return self
+    def __exit__(self, *exc):
+        self.close()
 
 class PyPdfFile(AbstractPdfFile):
     """Implementation of PdfFile using the new pypdf"""
@@ -45,6 +157,16 @@ class PyPdfFile(AbstractPdfFile):
                 raise PdfEncryptedError
     def getPage(self, nr):
         return self.reader.pages[nr]
+    def numPages(self):
+        return len(self.reader.pages)
+    def pageGeometry(self, nr):
+        page = self.getPage(nr)
+        # pypdf copies inherited attributes such as /Rotate to the pages
+        return (tuple(page.mediabox), tuple(page.cropbox),
+                int(page.get('/Rotate', 0)))
+    def closeReader(self):
+        # the reader holds on to the stream to lazily read objects
+        self.reader = None
 
 class PyPdfOldFile(PyPdfFile):
     """Implementation of PdfFile using PyPDF2 (<2) which uses camelCase rather
@@ -59,17 +181,81 @@ class PyPdfOldFile(PyPdfFile):
                 raise PdfEncryptedError
     def getPage(self, nr):
         return self.reader.getPage(nr)
+    def numPages(self):
+        return self.reader.getNumPages()
+    def pageGeometry(self, nr):
+        page = self.getPage(nr)
+        return (tuple(page.mediaBox), tuple(page.cropBox),
+                int(page.get('/Rotate', 0)))
 
 class PyMuPdfFile(AbstractPdfFile):
     """Implementation of PdfFile using PyMuPDF"""
     def __init__(self):
         self.reader = None
+        self._view = None
+        self._shared = False
     def loadFromStream(self, stream):
         self.reader = self.pymupdf.open(stream)
         if self.reader.is_encrypted:
             raise PdfEncryptedError
+    def loadFromBuffer(self, buf):
+        if buf.mmap is None:
+            # MuPDF reads the file lazily by itself
+            self.loadFromStream(buf.file.name)
+            return
+        # MuPDF reads directly from the mapped memory; the memoryview keeps
+        # the mapping alive and has to be released before it is closed
+        self._view = memoryview(buf.mmap)
+        try:
+            self.reader = self.pymupdf.open(stream=self._view, filetype="pdf")
+        except TypeError:
+            # older versions of PyMuPDF only accept bytes
+            self._view.release()
+            self._view = None
+            self.reader = self.pymupdf.open(buf.file.name)
+        if self.reader.is_encrypted:
+            raise PdfEncryptedError
+    def loadFromMemory(self, data):
+        try:
+            self.reader = self.pymupdf.open(stream=data, filetype="pdf")
+        except TypeError:
+            # older versions of PyMuPDF only accept bytes
+            self.reader = self.pymupdf.open(stream=bytes(data), filetype="pdf")
+        if self.reader.is_encrypted:
+            raise PdfEncryptedError
+    def loadFromSession(self, session):
+        """Uses the document of a PdfDocumentSession instead of opening the
+        file again."""
+        self.close()
+        self.reader = session.document
+        self._shared = True
+        if self.reader.is_encrypted:
+            raise PdfEncryptedError
     def getPage(self, nr):
         return self.reader[nr]
+    def numPages(self):
+        return len(self.reader)
+    def pageGeometry(self, nr):
+        page = self.reader[nr]
+        mb, cb = page.mediabox, page.cropbox
+        # MuPDF uses coordinates where (0,0) is the top-left point of the
+        # MediaBox, unlike PDF where (0,0) is the bottom-left.
+        cropbox = (cb.x0, mb.y1-cb.y1, cb.x1, mb.y1-cb.y0)
+        return tuple(mb), cropbox, page.rotation
+    def closeReader(self):
+        if self.reader is not None:
+            # a shared document is closed by the owner of the session
+            if not self._shared:
+                self.reader.close()
+            self.reader = None
+            self._shared = False
+        if self._view is not None:
+            try:
+                self._view.release()
+            except BufferError:
+                # still referenced by an old version of PyMuPDF
+                pass
+            self._view = None
 
 class PikePdfFile(AbstractPdfFile):
     """Implementation of PdfFile using pikepdf"""
@@ -79,8 +265,29 @@ class PikePdfFile(AbstractPdfFile):
         self.reader = self.Pdf.open(stream)
         if self.reader.is_encrypted:
             raise PdfEncryptedError
+    def loadFromBuffer(self, buf):
+        try:
+            # let qpdf map the file itself rather than reading it through
+            # Python callbacks
+            self.reader = self.Pdf.open(buf.file.name, access_mode=self.AccessMode.mmap)
+        except (AttributeError, TypeError):
+            # access_mode was introduced in pikepdf 2.x
+            self.reader = self.Pdf.open(buf.stream)
+        if self.reader.is_encrypted:
+            raise PdfEncryptedError
     def getPage(self, nr):
         return self.reader.pages[nr]
+    def numPages(self):
+        return len(self.reader.pages)
+    def pageGeometry(self, nr):
+        page = self.getPage(nr)
+        rotation = page.obj.get('/Rotate', 0)
+        return (tuple(float(x) for x in page.mediabox),
+                tuple(float(x) for x in page.cropbox), int(rotation))
+    def closeReader(self):
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
 
 
 class AbstractPdfCropper:
@@ -247,26 +454,90 @@ def computeCropBoxCoords(box, crop, pdf_coords=True):
     y0, y1 = y0+crop[3]*(y1-y0), y1-crop[1]*(y1-y0)
     return x0, y0, x1, y1
 
-def optimizePdfGhostscript(oldfilename, newfilename):
+def optimizePdfGhostscript(data, output):
+    """Optimizes the PDF given by data (a bytes-like object) using
+    Ghostscript and writes the result to output (a file name or a writable
+    binary stream). No temporary files are involved: where possible, the
+    input is passed as an anonymous in-memory file (Ghostscript needs to
+    seek in a PDF), otherwise through a pipe; the output is read from a
+    pipe unless it goes to a file anyway."""
     import subprocess
-    subprocess.check_call(('gs', '-sDEVICE=pdfwrite', '-sOutputFile=' + newfilename,
-        '-dNOPAUSE', '-dBATCH', oldfilename))
+    isStream = hasattr(output, 'write')
+    # -sstdout=%stderr keeps messages of Ghostscript out of the output
+    args = ['gs', '-q', '-sstdout=%stderr', '-sDEVICE=pdfwrite',
+            '-sOutputFile=' + ('-' if isStream else output), '-dNOPAUSE', '-dBATCH']
+    stdout = subprocess.PIPE if isStream else subprocess.DEVNULL
+    if hasattr(os, 'memfd_create'):
+        fd = os.memfd_create('krop.pdf')
+        try:
+            with open(fd, 'wb', closefd=False) as f:
+                f.write(data)
+            result = subprocess.run(args + ['/dev/fd/{0}'.format(fd)],
+                    pass_fds=(fd,), stdout=stdout, check=True)
+        finally:
+            os.close(fd)
+    else:
+        result = subprocess.run(args + ['-'], input=data, stdout=stdout, check=True)
+    if isStream:
+        output.write(result.stdout)
+
+def writeCroppedPdf(cropper, output, optimize=False):
+    """Writes the PDF assembled by cropper to output (a file name or a
+    writable binary stream), optionally optimizing it using Ghostscript.
+    A stream is only written to (at its current position), never reopened
+    or rewound."""
+    isStream = hasattr(output, 'write')
+    if optimize or isStream:
+        # libraries may seek while writing, which pipes (such as standard
+        # output) do not support, or reopen a file object by its name
+        # (PyMuPDF does); so we assemble the PDF in memory
+        buf = io.BytesIO()
+        cropper.writeToStream(buf)
+        if optimize:
+            optimizePdfGhostscript(buf.getbuffer(), output)
+        else:
+            output.write(buf.getbuffer())
+    else:
+        cropper.writeToFile(output)
 
 
 # In the following, we determine which cropping library to use.
 # See lib_crop_options below for a list of the supported libraries.
 
+def importPyMuPdf():
+    """Returns the PyMuPDF module. Since 1.24.3, it is called pymupdf;
+    recent versions print a deprecation notice to standard output when it
+    is imported as fitz, which would end up in a PDF written there."""
+    try:
+        import pymupdf as fitz
+    except ImportError:
+        import fitz
+    return fitz
+
+def hasPyMuPdf():
+    """Checks whether PyMuPDF is available. It is needed for looking at the
+    contents of pages (rendering them or reading their text), also when
+    another library is used for rendering or cropping."""
+    try:
+        importPyMuPdf()
+    except ImportError:
+        return False
+    return True
+
 def import_pymupdf():
-    import fitz
-    # note: since 1.24.3, one can use 'import pymupdf' instead but fitz is
-    # promised to always be supported as well
+    fitz = importPyMuPdf()
     PyMuPdfFile.pymupdf = fitz
     PyMuPdfCropper.pymupdf = fitz
     return PyMuPdfFile, PyMuPdfCropper
 
 def import_pikepdf():
     from pikepdf import Pdf
+    try:
+        from pikepdf import AccessMode
+    except ImportError:
+        AccessMode = None
     PikePdfFile.Pdf = Pdf
+    PikePdfFile.AccessMode = AccessMode
     PikePdfCropper.Pdf = Pdf
     return PikePdfFile, PikePdfCropper
 
@@ -318,6 +589,11 @@ for load_only_if_requested in [True, False]:
 # complain if no library could be imported
 if not lib_crop:
     _msg = "Please install one of the supported cropping libraries first (PyMuPDF, pypdf, or pikepdf)."
+    # krop may be used without Qt (see krop.headless)
+    try:
+        from krop.config import PYQT6
+    except RuntimeError:
+        PYQT6 = True
     if PYQT6:
         _msg += "\n\tFor instance, on recent versions of Ubuntu, the following should do the trick:"\
             "\n\tsudo apt-get install python3-pymupdf"
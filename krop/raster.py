@@ -0,0 +1,266 @@
+# -*- coding: iso-8859-1 -*-
+
+"""
+Grayscale page rasters for analysing pages without the graphical interface.
+
+Copyright (C) 2010-2025 Armin Straub, http://arminstraub.com
+"""
+
+"""
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 3 of the License, or
+(at your option) any later version.
+"""
+
+import re
+from array import array
+from bisect import bisect_left
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class GrayRaster:
+    """An 8-bit grayscale image stored row by row in a bytes object.
+
+    Rows and columns are returned as bytes, so that functions like min, max
+    or count run over them at C speed."""
+
+    def __init__(self, width, height, stride, samples):
+        self.width = width
+        self.height = height
+        self.stride = stride
+        self.samples = samples
+
+    def rect(self):
+        return (0, 0, self.width, self.height)
+
+    def row(self, y, x0=0, x1=None):
+        if x1 is None:
+            x1 = self.width
+        start = y*self.stride
+        return self.samples[start+x0:start+x1]
+
+    def column(self, x, y0=0, y1=None):
+        if y1 is None:
+            y1 = self.height
+        if y1 <= y0:
+            return b''
+        return self.samples[y0*self.stride+x:(y1-1)*self.stride+x+1:self.stride]
+
+
+def renderGray(doc, idx, dpi=96):
+    """Renders page idx of the PyMuPDF document doc as a GrayRaster."""
+    pix = doc[idx].get_pixmap(colorspace="gray", dpi=dpi, alpha=False)
+    return GrayRaster(pix.width, pix.height, pix.stride, pix.samples)
+
+
+def despeckle(raster, size, threshold=128):
+    """Returns a black and white copy of a GrayRaster without specks: pixels
+    darker than threshold count as ink, and connected areas of ink which fit
+    into a square of size x size pixels are dropped.
+
+    Ink is handled as runs within rows, which are joined across rows into
+    connected areas. With NumPy, this is done by array operations (see
+    _despeckleArrays); otherwise, only the runs (found by a regular
+    expression) are visited in Python."""
+    width, height = raster.width, raster.height
+    if size <= 0 or not width or not height:
+        return raster
+    if numpy is not None:
+        return _despeckleArrays(raster, size, threshold)
+    ink = bytes(0x31 if v < threshold else 0x30 for v in range(256))
+    runs = re.compile(b'1+')
+    # for each run: row, start, end (exclusive); parent for union-find and,
+    # for roots, the bounding box of the connected area
+    rowRuns = []
+    parent = []
+    box = []
+
+    def find(k):
+        while parent[k] != k:
+            parent[k] = parent[parent[k]]
+            k = parent[k]
+        return k
+
+    previous = []
+    for y in range(height):
+        current = []
+        for m in runs.finditer(raster.row(y).translate(ink)):
+            x0, x1 = m.span()
+            k = len(parent)
+            parent.append(k)
+            box.append([x0, y, x1, y+1])
+            current.append((x0, x1, k))
+        # join runs which touch a run of the previous row (diagonally, too)
+        i = 0
+        for x0, x1, k in current:
+            while i < len(previous) and previous[i][1] < x0:
+                i += 1
+            j = i
+            while j < len(previous) and previous[j][0] <= x1:
+                a, b = find(k), find(previous[j][2])
+                if a != b:
+                    parent[b] = a
+                    ba, bb = box[a], box[b]
+                    box[a] = [min(ba[0], bb[0]), min(ba[1], bb[1]),
+                            max(ba[2], bb[2]), max(ba[3], bb[3])]
+                j += 1
+        rowRuns.append(current)
+        previous = current
+    samples = bytearray(b'\xff'*(width*height))
+    for y, current in enumerate(rowRuns):
+        for x0, x1, k in current:
+            x0b, y0b, x1b, y1b = box[find(k)]
+            if x1b - x0b > size or y1b - y0b > size:
+                samples[y*width+x0:y*width+x1] = bytes(x1-x0)
+    return GrayRaster(width, height, width, bytes(samples))
+
+def _despeckleArrays(raster, size, threshold):
+    """Implements despeckle using NumPy: the runs of ink of all rows are
+    found at once, and connected areas are labelled by propagating the
+    smallest run index along the pairs of touching runs."""
+    width, height = raster.width, raster.height
+    pixels = numpy.frombuffer(raster.samples, numpy.uint8, height*raster.stride)
+    ink = numpy.zeros((height, width+2), numpy.int8)
+    ink[:,1:-1] = pixels.reshape(height, raster.stride)[:,:width] < threshold
+    # runs start where ink starts and end (exclusive) where it stops; as
+    # positions within the whole array, runs in different rows are at
+    # least two apart (because of the padding)
+    steps = numpy.diff(ink, axis=1)
+    ys, x0s = numpy.nonzero(steps == 1)
+    x1s = numpy.nonzero(steps == -1)[1]
+    stride = width + 2
+    starts, ends = ys*stride + x0s, ys*stride + x1s
+    # the runs of the previous row which touch a run (diagonally, too) are
+    # those which end at or after its start and start at or before its end
+    # once moved one row down
+    first = numpy.searchsorted(ends + stride, starts)
+    last = numpy.searchsorted(starts + stride, ends, side='right')
+    counts = numpy.maximum(last - first, 0)
+    a = numpy.repeat(numpy.arange(len(starts)), counts)
+    b = numpy.repeat(first - numpy.cumsum(counts) + counts, counts) + numpy.arange(counts.sum())
+    labels = numpy.arange(len(starts))
+    while True:
+        smaller = numpy.minimum(labels[a], labels[b])
+        updated = labels.copy()
+        numpy.minimum.at(updated, a, smaller)
+        numpy.minimum.at(updated, b, smaller)
+        updated = updated[updated]
+        if numpy.array_equal(updated, labels):
+            break
+        labels = updated
+    # the bounding boxes of the areas, indexed by their labels
+    boxes = [ numpy.full(len(starts), v) for v in (width, height, 0, 0) ]
+    numpy.minimum.at(boxes[0], labels, x0s)
+    numpy.minimum.at(boxes[1], labels, ys)
+    numpy.maximum.at(boxes[2], labels, x1s)
+    numpy.maximum.at(boxes[3], labels, ys+1)
+    large = (boxes[2] - boxes[0] > size) | (boxes[3] - boxes[1] > size)
+    keep = large[labels]
+    # paint the runs which are kept
+    edges = numpy.zeros(height*stride + 1, numpy.int8)
+    numpy.add.at(edges, starts[keep], 1)
+    numpy.add.at(edges, ends[keep], -1)
+    black = numpy.cumsum(edges[:-1]).reshape(height, stride)[:,:width] > 0
+    samples = numpy.where(black, 0, 255).astype(numpy.uint8)
+    return GrayRaster(width, height, width, samples.tobytes())
+
+
+class EdgeIndex:
+    """The edges of the content of a page: the columns and rows where ink
+    starts or ends (as sorted arrays of pixel boundaries, so that the
+    nearest edge is found by binary search)."""
+
+    def __init__(self, columns, rows):
+        self.columns = columns
+        self.rows = rows
+
+    @staticmethod
+    def nearest(edges, value, reach):
+        """Returns the edge nearest to value if it is at most reach away,
+        otherwise None."""
+        k = bisect_left(edges, value)
+        candidates = edges[max(0, k-1):k+1]
+        if not candidates:
+            return None
+        edge = min(candidates, key=lambda e: abs(e - value))
+        return edge if abs(edge - value) <= reach else None
+
+    def snapX(self, x, reach):
+        return self.nearest(self.columns, x, reach)
+
+    def snapY(self, y, reach):
+        return self.nearest(self.rows, y, reach)
+
+
+def inkEdges(raster, threshold=160):
+    """Returns the EdgeIndex of a GrayRaster, where pixels darker than
+    threshold count as ink: an edge lies between a row (or column) without
+    ink and one with ink, or at the border of the raster next to ink."""
+    light = bytes(range(threshold, 256))
+    def edges(ink):
+        found = array('i')
+        previous = False
+        for k, current in enumerate(ink):
+            if current != previous:
+                found.append(k)
+            previous = current
+        if previous:
+            found.append(len(ink))
+        return found
+    rows = [ bool(raster.row(y).translate(None, light)) for y in range(raster.height) ]
+    columns = [ bool(raster.column(x).translate(None, light)) for x in range(raster.width) ]
+    return EdgeIndex(edges(columns), edges(rows))
+
+
+def intersectRects(r1, r2):
+    x0, y0 = max(r1[0], r2[0]), max(r1[1], r2[1])
+    x1, y1 = min(r1[2], r2[2]), min(r1[3], r2[3])
+    return (x0, y0, max(x0, x1), max(y0, y1))
+
+
+def trimRaster(raster, r, minr, sensitivity, allowedchanges):
+    """Given a GrayRaster and a rectangle r = (x0, y0, x1, y1) (where x1 and
+    y1 are exclusive), automatically trims the margins of that rectangle
+    according to the parameters. This is the equivalent of autoTrimMargins
+    for rasters."""
+
+    def isTrimmable(L):
+        # margins are usually (almost) uniform, which we can detect quickly
+        if not L or max(L) - min(L) <= sensitivity:
+            return True
+        changes = 0
+        y = L[0]
+        for x in L:
+            if abs(x-y) > sensitivity:
+                changes += 1
+                if changes > allowedchanges:
+                    return False
+            y = x
+        return True
+
+    x0, y0, x1, y1 = intersectRects(r, raster.rect())
+
+    # we shouldn't trim r to something smaller than minr
+    while y1 > y0 and (minr is None or y0 < minr[1]):
+        if not isTrimmable(raster.row(y0, x0, x1)):
+            break
+        y0 += 1
+    while y1 > y0 and (minr is None or y1 > minr[3]):
+        if not isTrimmable(raster.row(y1-1, x0, x1)):
+            break
+        y1 -= 1
+    while x1 > x0 and (minr is None or x0 < minr[0]):
+        if not isTrimmable(raster.column(x0, y0, y1)):
+            break
+        x0 += 1
+    while x1 > x0 and (minr is None or x1 > minr[2]):
+        if not isTrimmable(raster.column(x1-1, y0, y1)):
+            break
+        x1 -= 1
+
+    return (x0, y0, x1, y1)
@@ -0,0 +1,397 @@
+# -*- coding: iso-8859-1 -*-
+
+"""
+Rules for which pages selections apply to, independent of the graphical
+interface.
+
+Copyright (C) 2010-2025 Armin Straub, http://arminstraub.com
+"""
+
+"""
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 3 of the License, or
+(at your option) any later version.
+"""
+
+from bisect import bisect_left
+from math import ceil
+
+
+# when snapping cuts, they are moved up by at most this fraction of the
+# height of a piece; pieces which cannot be cut in whitespace overlap the
+# next one by as much
+SNAP_RANGE = 0.2
+
+class SelectionMode:
+    """Possible modes for which pages selections apply to."""
+    all = 0
+    evenodd = 1
+    individual = 2
+
+    names = ['all', 'evenodd', 'individual']
+
+    @staticmethod
+    def fromName(name):
+        return SelectionMode.names.index(name)
+
+
+def parseScope(s, numPages):
+    """Parses a page range like "5-20", "5-" or "7" (pages counted from 1),
+    optionally followed by ":odd" or ":even", and returns the scope
+    (first, last, parity) where first and last are page indices (counted
+    from 0) and parity is None, 'odd' or 'even'. Raises ValueError for bad
+    values."""
+    s, _, parity = s.strip().partition(':')
+    parity = parity.strip() or None
+    if parity not in (None, 'odd', 'even'):
+        raise ValueError(parity)
+    a, sep, b = [ x.strip() for x in s.partition('-') ]
+    first = int(a) - 1
+    last = (int(b) - 1 if b else numPages - 1) if sep else first
+    # ranges may extend beyond the last page, but must not start there
+    last = min(last, numPages - 1)
+    if first < 0 or last < first:
+        raise ValueError(s)
+    return (first, last, parity)
+
+def scopeToStr(scope):
+    first, last, parity = scope
+    s = str(first+1) if first == last else '{0}-{1}'.format(first+1, last+1)
+    return s + ':' + parity if parity else s
+
+def scopeContains(scope, pageIndex):
+    first, last, parity = scope
+    if not first <= pageIndex <= last:
+        return False
+    # odd and even refer to page numbers (counted from 1)
+    if parity == 'odd':
+        return pageIndex % 2 == 0
+    if parity == 'even':
+        return pageIndex % 2 == 1
+    return True
+
+
+def selectionVisibleOnPage(pageIndex, selectionPageIndex, mode, exceptions):
+    """Determines if a selection created on page selectionPageIndex is
+    visible on page pageIndex. Pages in exceptions (preferably a set)
+    require individual selections."""
+    if pageIndex in exceptions or selectionPageIndex in exceptions or mode == SelectionMode.individual:
+        return pageIndex == selectionPageIndex
+    if mode == SelectionMode.all:
+        return True
+    if mode == SelectionMode.evenodd:
+        return (pageIndex - selectionPageIndex) % 2 == 0
+
+def scopedSelectionVisibleOnPage(pageIndex, scope, exceptions):
+    """Determines if a selection with the given scope is visible on page
+    pageIndex. Pages in exceptions only show selections whose scope is just
+    that page (like the ones created for matches of a search), since these
+    were made for it."""
+    if not scopeContains(scope, pageIndex):
+        return False
+    return scope[0] == scope[1] or pageIndex not in exceptions
+
+
+class SelectionRecord:
+    """The data of a single selection.
+
+    Rectangles are stored as tuples (x, y, width, height) in the coordinates
+    of the viewer: rect is the selection itself and parentRect the page it
+    was last adjusted on. Graphics items only exist for the selections shown
+    on the current page; item refers to it (or is None)."""
+
+    __slots__ = ('pageIndex', 'scope', 'rect', 'parentRect',
+            'aspectRatioData', 'aspectRatio', 'item')
+
+    def __init__(self, pageIndex, rect, scope=None):
+        self.pageIndex = pageIndex
+        self.scope = scope
+        self.rect = rect
+        self.parentRect = rect
+        self.aspectRatioData = None
+        self.aspectRatio = None
+        self.item = None
+
+    def pieces(self, distributeAspectRatio=None, rows=None, pageRect=None):
+        """Returns the pieces (x, y, width, height) of this selection of the
+        given aspect ratio (see distributeRect); if rows (a RowProfile of
+        the page, see krop.splitpoints) are given, they are cut at
+        whitespace rows. The page is at pageRect (by default, parentRect)."""
+        snap = None
+        if rows is not None:
+            px, py, pw, ph = self.parentRect if pageRect is None else pageRect
+            x, _, w, _ = self.rect
+            x0, x1 = (x-px)/pw, (x+w-px)/pw
+            def snap(y, limit):
+                t = rows.snap((y-py)/ph, (limit-py)/ph, x0, x1)
+                return None if t is None else py + t*ph
+        return distributeRect(self.rect, distributeAspectRatio, snap)
+
+    def cropValues(self, distributeAspectRatio=None, rows=None):
+        """Returns the crop values (left, top, right, bottom as fractions of
+        the page) of this selection, divided into pieces of the given aspect
+        ratio if requested (see pieces)."""
+        px, py, pw, ph = self.parentRect
+        pr, pb = px + pw, py + ph
+        return [ ((x-px)/pw, (y-py)/ph, (pr-(x+w))/pw, (pb-(y+h))/ph)
+                for x, y, w, h in self.pieces(distributeAspectRatio, rows) ]
+
+
+def distributeRect(rect, aspectRatio, snap=None):
+    """Divides rect = (x, y, width, height) into overlapping pieces of the
+    same width which have the given aspect ratio (if not None).
+
+    If snap is given, each piece is instead cut at snap(y, limit), which
+    returns a position between limit and y (like a row without ink, see
+    krop.splitpoints) or None; such pieces do not overlap, and are a little
+    shorter than the aspect ratio asks for."""
+    if aspectRatio is None:
+        return [ rect ]
+    x0, y0, w, h = rect
+    x1, y1 = x0 + w, y0 + h
+    h = (x1-x0) / aspectRatio # height of each piece
+    # how many pieces?
+    nr = int(ceil((y1-y0) / h))
+    if nr == 1:
+        return [ rect ]
+    if snap is not None:
+        pieces = []
+        top = y0
+        while y1 - top > h:
+            cut = snap(top + h, top + (1-SNAP_RANGE)*h)
+            if cut is None:
+                pieces.append((x0, top, x1-x0, h))
+                top += (1-SNAP_RANGE)*h
+            else:
+                pieces.append((x0, top, x1-x0, cut-top))
+                top = cut
+        pieces.append((x0, top, x1-x0, y1-top))
+        return pieces
+    o = (nr*h - (y1-y0)) / float(nr-1) # overlap
+    return [ (x0, y0+i*(h-o), x1-x0, h) for i in range(nr) ]
+
+
+class IntervalTree:
+    """Values attached to intervals [first, last] of integers, supporting
+    queries for the values whose interval contains a given point.
+
+    This is a centered interval tree; it is rebuilt when queried after the
+    intervals have changed, so that queries take logarithmic time (plus the
+    number of values found)."""
+
+    def __init__(self):
+        self._intervals = {} # value -> (first, last)
+        self._root = None
+        self._dirty = False
+
+    def __len__(self):
+        return len(self._intervals)
+
+    def add(self, value, first, last):
+        self._intervals[value] = (first, last)
+        self._dirty = True
+
+    def remove(self, value):
+        del self._intervals[value]
+        self._dirty = True
+
+    def clear(self):
+        self._intervals.clear()
+        self._root = None
+        self._dirty = False
+
+    @staticmethod
+    def _build(intervals):
+        # a node is (center, intervals containing center sorted by first,
+        # the same sorted by last in decreasing order, left, right)
+        if not intervals:
+            return None
+        endpoints = sorted(x for first, last, value in intervals for x in (first, last))
+        center = endpoints[len(endpoints)//2]
+        left = [ i for i in intervals if i[1] < center ]
+        right = [ i for i in intervals if i[0] > center ]
+        mid = [ i for i in intervals if i[0] <= center <= i[1] ]
+        return (center, sorted(mid, key=lambda i: i[0]),
+                sorted(mid, key=lambda i: -i[1]),
+                IntervalTree._build(left), IntervalTree._build(right))
+
+    def stab(self, point):
+        """Returns the values whose interval contains point."""
+        if self._dirty:
+            self._root = self._build([ (first, last, value)
+                for value, (first, last) in self._intervals.items() ])
+            self._dirty = False
+        values = []
+        node = self._root
+        while node is not None:
+            center, byFirst, byLast, left, right = node
+            if point < center:
+                for first, last, value in byFirst:
+                    if first > point:
+                        break
+                    values.append(value)
+                node = left
+            elif point > center:
+                for first, last, value in byLast:
+                    if last < point:
+                        break
+                    values.append(value)
+                node = right
+            else:
+                values.extend(value for first, last, value in byFirst)
+                node = None
+        return values
+
+
+class _OrderedSelections:
+    """Selections kept in the order of their creation (given by sequence
+    numbers), supporting insertion and removal without scanning."""
+
+    def __init__(self):
+        self.seqs = []
+        self.items = []
+
+    def __len__(self):
+        return len(self.items)
+
+    def insert(self, seq, s):
+        k = bisect_left(self.seqs, seq)
+        self.seqs.insert(k, seq)
+        self.items.insert(k, s)
+
+    def remove(self, seq):
+        k = bisect_left(self.seqs, seq)
+        if k < len(self.seqs) and self.seqs[k] == seq:
+            del self.seqs[k]
+            del self.items[k]
+
+
+class SelectionIndex:
+    """Knows which selections are visible on which page.
+
+    Selections are registered with the page on which they were created. The
+    index is updated incrementally when selections are added or removed and
+    when the mode or the exceptions change, so that looking up the selections
+    visible on a page takes time proportional to their number (rather than
+    to the number of all selections).
+
+    Selections with a scope (see parseScope) apply to the pages of a range
+    regardless of the mode (see scopedSelectionVisibleOnPage); these are
+    kept in an interval tree."""
+
+    def __init__(self):
+        self._mode = SelectionMode.all
+        self._exceptions = set()
+        self._seq = 0
+        self._info = {} # selection -> (sequence number, page index, scope)
+        self._scoped = IntervalTree()
+        self._byPage = {} # page index -> selections created on that page
+        # selections created on pages which are not exceptions; in evenodd
+        # mode, these are split according to the parity of their page
+        self._shared = _OrderedSelections()
+        self._sharedParity = (_OrderedSelections(), _OrderedSelections())
+
+    def getMode(self):
+        return self._mode
+
+    def setMode(self, mode):
+        self._mode = mode
+
+    mode = property(getMode, setMode)
+
+    def getExceptions(self):
+        return self._exceptions
+
+    def setExceptions(self, exceptions):
+        exceptions = set(exceptions)
+        for idx in self._exceptions - exceptions:
+            for seq, s in self._pageSelections(idx):
+                self._share(seq, idx, s)
+        for idx in exceptions - self._exceptions:
+            for seq, s in self._pageSelections(idx):
+                self._unshare(seq, idx)
+        self._exceptions = exceptions
+
+    exceptions = property(getExceptions, setExceptions)
+
+    def _pageSelections(self, idx):
+        page = self._byPage.get(idx)
+        return list(zip(page.seqs, page.items)) if page else []
+
+    def _share(self, seq, idx, s):
+        self._shared.insert(seq, s)
+        self._sharedParity[idx % 2].insert(seq, s)
+
+    def _unshare(self, seq, idx):
+        self._shared.remove(seq)
+        self._sharedParity[idx % 2].remove(seq)
+
+    def add(self, s, pageIndex, scope=None):
+        self._seq += 1
+        self._insert(s, self._seq, pageIndex, scope)
+
+    def _insert(self, s, seq, pageIndex, scope):
+        self._info[s] = (seq, pageIndex, scope)
+        if scope is not None:
+            self._scoped.add(s, scope[0], scope[1])
+            return
+        self._byPage.setdefault(pageIndex, _OrderedSelections()).insert(seq, s)
+        if pageIndex not in self._exceptions:
+            self._share(seq, pageIndex, s)
+
+    def remove(self, s):
+        seq, idx, scope = self._info.pop(s)
+        if scope is not None:
+            self._scoped.remove(s)
+            return
+        page = self._byPage[idx]
+        page.remove(seq)
+        if not page:
+            del self._byPage[idx]
+        if idx not in self._exceptions:
+            self._unshare(seq, idx)
+
+    def setScope(self, s, scope):
+        """Changes the scope of a selection (None to remove it)."""
+        seq, idx, old = self._info[s]
+        self.remove(s)
+        self._insert(s, seq, idx, scope)
+
+    def scope(self, s):
+        return self._info[s][2]
+
+    def clear(self):
+        """Removes all selections (but keeps mode and exceptions)."""
+        self._info.clear()
+        self._scoped.clear()
+        self._byPage.clear()
+        self._shared = _OrderedSelections()
+        self._sharedParity = (_OrderedSelections(), _OrderedSelections())
+
+    def pageIndex(self, s):
+        """The page on which a selection was created."""
+        return self._info[s][1]
+
+    def visibleSelections(self, pageIndex):
+        """Returns the selections visible on a page in order of creation."""
+        if self._mode == SelectionMode.individual or pageIndex in self._exceptions:
+            page = self._byPage.get(pageIndex)
+            visible = list(page.items) if page else []
+        elif self._mode == SelectionMode.evenodd:
+            visible = list(self._sharedParity[pageIndex % 2].items)
+        else:
+            visible = list(self._shared.items)
+        if self._scoped:
+            scoped = [ s for s in self._scoped.stab(pageIndex)
+                    if scopedSelectionVisibleOnPage(pageIndex, self._info[s][2], self._exceptions) ]
+            if scoped:
+                visible.extend(scoped)
+                visible.sort(key=lambda s: self._info[s][0])
+        return visible
+
+    def isVisible(self, s, pageIndex):
+        seq, idx, scope = self._info[s]
+        if scope is not None:
+            return scopedSelectionVisibleOnPage(pageIndex, scope, self._exceptions)
+        return selectionVisibleOnPage(pageIndex, idx, self._mode, self._exceptions)
@@ -0,0 +1,398 @@
+# -*- coding: iso-8859-1 -*-
+
+"""
+A long-running krop service accepting crop jobs on a local Unix socket.
+
+The service keeps the PDF libraries imported and recently used documents
+(and page renders) open in a pool of worker processes, so that a job only
+costs the actual cropping. A client connects, sends a single JSON object
+terminated by a newline, and receives JSON lines until the connection is
+closed:
+
+    {"input": "in.pdf", "output": "out.pdf", "options": {"grid": "2x1"}}
+        -> {"event": "queued", "job": 1, "queueDepth": 1}
+        -> {"event": "stage", "job": 1, "stage": "open", "seconds": 0.01}
+        -> ... (the stages load, select and crop, see headless.kropFile)
+        -> {"event": "done", "job": 1, "status": "ok", "seconds": 0.1, ...}
+
+    {"command": "stats"}
+        -> {"event": "stats", "jobs": 1, "queueDepth": 0, ...}
+
+The options are attributes of krop.options.KropOptions (only those listed
+in JOB_OPTIONS); options which are not specified default to the command
+line options of the service. The socket can only be used by the user
+running the service.
+
+Copyright (C) 2010-2025 Armin Straub, http://arminstraub.com
+"""
+
+"""
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 3 of the License, or
+(at your option) any later version.
+"""
+
+import copy
+import json
+import multiprocessing
+import os
+import queue
+import signal
+import socket
+import socketserver
+import stat
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from krop.batch import initWorker
+
+
+class DocumentCache:
+    """Keeps the most recently used documents open (in a worker process)."""
+    def __init__(self, maxDocuments=8, maxRenders=64):
+        self.maxDocuments = maxDocuments
+        self.maxRenders = maxRenders
+        self._documents = OrderedDict()
+
+    def get(self, fileName):
+        """Returns the tuple (document, hit) where document is a
+        HeadlessDocument and hit tells if it was taken from the cache."""
+        from krop.headless import HeadlessDocument
+        key = os.path.abspath(fileName)
+        document = self._documents.pop(key, None)
+        if document is not None:
+            if document.isValid():
+                self._documents[key] = document
+                return document, True
+            # the file has changed
+            document.close()
+        document = HeadlessDocument(fileName, self.maxRenders)
+        self._documents[key] = document
+        while len(self._documents) > self.maxDocuments:
+            self._documents.popitem(last=False)[1].close()
+        return document, False
+
+
+# the options a job may set; others (like where to save a crop plan or the
+# number of processes) are up to the service
+JOB_OPTIONS = frozenset(['grid', 'selections', 'exceptions', 'initialPage',
+    'whichPages', 'rotate', 'optimize', 'alwaysInclude', 'removeBlank',
+    'trim', 'trimUseAllPages', 'trimPadding', 'trimSensitivity',
+    'trimAllowedChanges', 'trimSmoothing', 'trimSpeckSize', 'trimFurniture',
+    'selectMatches'])
+
+# the cache of a worker process, and the queue for reporting progress
+_documentCache = None
+_events = None
+
+def initServiceWorker(argv, maxDocuments, maxRenders, events=None):
+    global _documentCache, _events
+    initWorker(argv)
+    _documentCache = DocumentCache(maxDocuments, maxRenders)
+    _events = events
+
+def serviceWorker(inputFileName, outputFileName, options, job=None):
+    """Crops a single file using the cache of the worker process and returns
+    a dict describing the result; this never raises. The stages of the job
+    are reported as they are done, followed by the result (see
+    KropService)."""
+    from krop.headless import kropFile
+    result = { 'input': inputFileName, 'output': outputFileName,
+            'status': 'ok', 'error': None, 'seconds': 0.0, 'stages': {},
+            'documentHit': False, 'renderHits': 0, 'renderMisses': 0,
+            'outputSize': None }
+
+    def progress(stage, seconds):
+        if _events is not None:
+            _events.put((job, { 'event': 'stage', 'stage': stage, 'seconds': seconds }))
+
+    start = time.perf_counter()
+    try:
+        document, result['documentHit'] = _documentCache.get(inputFileName)
+        result['stages']['open'] = time.perf_counter() - start
+        progress('open', result['stages']['open'])
+        hits, misses = document.renderHits, document.renderMisses
+        try:
+            kropFile(inputFileName, outputFileName, options, document,
+                    result['stages'], progress)
+        finally:
+            # pages rendered before a failure count as well
+            result['renderHits'] = document.renderHits - hits
+            result['renderMisses'] = document.renderMisses - misses
+        result['outputSize'] = os.path.getsize(outputFileName)
+    except Exception as err:
+        result['status'] = 'failed'
+        result['error'] = '{0}: {1}'.format(type(err).__name__, err)
+    result['seconds'] = time.perf_counter() - start
+    if _events is not None:
+        # tells that all stages have been reported
+        _events.put((job, None))
+    return result
+
+
+class KropService:
+    """Runs crop jobs on a pool of worker processes and keeps statistics.
+
+    No more jobs are handed to the pool than there are workers, the others
+    wait in a queue. If a worker dies (for instance, crashing in a PDF
+    library), the pool is replaced and each of the jobs it was running is
+    run again on its own process, so that only the job which crashed its
+    worker fails."""
+
+    def __init__(self, defaults, workers=None, maxDocuments=8, maxRenders=64):
+        self.defaults = defaults
+        self.workers = workers or os.cpu_count() or 1
+        self.maxDocuments = maxDocuments
+        self.maxRenders = maxRenders
+        # progress reported by the workers, see _forwardEvents
+        self._events = multiprocessing.Queue()
+        self._listeners = {} # job -> function called with its messages
+        self._finishing = {} # see _finished
+        # reentrant, as callbacks of futures which are already done run
+        # right away
+        self._lock = threading.RLock()
+        self.executor = self._newExecutor()
+        self._queue = deque() # jobs waiting for a worker
+        self._running = 0
+        self._lastJob = 0
+        self.counters = { 'jobs': 0, 'completed': 0, 'failed': 0,
+                'documentHits': 0, 'documentMisses': 0,
+                'renderHits': 0, 'renderMisses': 0, 'crashes': 0 }
+        self.stageTotals = {}
+        threading.Thread(target=self._forwardEvents, daemon=True).start()
+
+    def _newExecutor(self, workers=None):
+        return ProcessPoolExecutor(max_workers=workers or self.workers,
+                initializer=initServiceWorker, initargs=(sys.argv,
+                    self.maxDocuments, self.maxRenders, self._events))
+
+    def jobOptions(self, options):
+        """Returns KropOptions for a job: the defaults updated by the given
+        dict. Raises ValueError for options which are unknown or may not be
+        set by a job (see JOB_OPTIONS)."""
+        jobOptions = copy.copy(self.defaults)
+        for name, value in (options or {}).items():
+            if name not in JOB_OPTIONS:
+                raise ValueError("unknown option '{0}'".format(name))
+            setattr(jobOptions, name, value)
+        return jobOptions
+
+    def submit(self, inputFileName, outputFileName, options=None, listener=None):
+        """Queues a job; returns the tuple (job, future, queueDepth) where
+        future provides the result. If given, listener(message) is called
+        with the progress of the job (the stages and finally the result, as
+        in the protocol) from another thread."""
+        jobOptions = self.jobOptions(options)
+        future = Future()
+        with self._lock:
+            self._lastJob += 1
+            job = self._lastJob
+            self.counters['jobs'] += 1
+            queueDepth = self.counters['jobs'] - self.counters['completed']
+            if listener is not None:
+                self._listeners[job] = listener
+            self._queue.append((job, future, (inputFileName, outputFileName, jobOptions, job)))
+            self._dispatch()
+        return job, future, queueDepth
+
+    def _dispatch(self):
+        # hands waiting jobs to the pool (called with the lock held)
+        while self._queue and self._running < self.workers:
+            job, future, args = self._queue.popleft()
+            self._running += 1
+            self._start(job, future, args, self.executor)
+
+    def _start(self, job, future, args, executor, isolated=False):
+        try:
+            f = executor.submit(serviceWorker, *args)
+        except BrokenProcessPool:
+            # a worker died since; replace the pool, the jobs it was
+            # running are taken care of in _jobDone
+            if executor is self.executor:
+                self.executor.shutdown(wait=False)
+                self.executor = executor = self._newExecutor()
+            f = executor.submit(serviceWorker, *args)
+        f.add_done_callback(lambda f: self._jobDone(job, future, args, executor, isolated, f))
+        if isolated:
+            executor.shutdown(wait=False)
+
+    def _jobDone(self, job, future, args, executor, isolated, f):
+        fromWorker = False
+        try:
+            result = f.result()
+            fromWorker = True
+        except BrokenProcessPool:
+            with self._lock:
+                self.counters['crashes'] += 1
+                if executor is self.executor:
+                    self.executor.shutdown(wait=False)
+                    self.executor = self._newExecutor()
+                if not isolated:
+                    # find out whether this job crashed the worker
+                    self._start(job, future, args, self._newExecutor(1), True)
+                    return
+            result = { 'input': args[0], 'output': args[1], 'status': 'failed',
+                    'error': 'the worker process died while cropping this file',
+                    'stages': {} }
+        except Exception as err:
+            result = { 'input': args[0], 'output': args[1], 'status': 'failed',
+                    'error': '{0}: {1}'.format(type(err).__name__, err), 'stages': {} }
+        with self._lock:
+            c = self.counters
+            c['completed'] += 1
+            if result['status'] != 'ok':
+                c['failed'] += 1
+            if 'documentHit' in result:
+                c['documentHits' if result['documentHit'] else 'documentMisses'] += 1
+                c['renderHits'] += result['renderHits']
+                c['renderMisses'] += result['renderMisses']
+            for stage, seconds in result['stages'].items():
+                total, count = self.stageTotals.get(stage, (0.0, 0))
+                self.stageTotals[stage] = (total + seconds, count + 1)
+            self._running -= 1
+            self._dispatch()
+        future.set_result(result)
+        if fromWorker:
+            self._finished(job, result)
+        else:
+            self._notify(job, dict(result, event='done'))
+
+    def _finished(self, job, result=None):
+        """Called when a worker has reported all stages of a job (with
+        result None) and when its result is accounted for; the result is
+        passed on after both, so that it is the last message and the
+        statistics include it."""
+        with self._lock:
+            if job not in self._finishing:
+                self._finishing[job] = result
+                return
+            other = self._finishing.pop(job)
+            result = result or other
+            if result is None:
+                # the worker died after reporting; wait for the rerun
+                self._finishing[job] = None
+                return
+        self._notify(job, dict(result, event='done'))
+
+    def _notify(self, job, message):
+        """Passes a message to the listener of a job; the result of the job
+        is the last one."""
+        message['job'] = job
+        with self._lock:
+            if message['event'] == 'done':
+                listener = self._listeners.pop(job, None)
+            else:
+                listener = self._listeners.get(job)
+        if listener is not None:
+            listener(message)
+
+    def _forwardEvents(self):
+        while True:
+            job, message = self._events.get()
+            if message is None:
+                self._finished(job)
+            else:
+                self._notify(job, message)
+
+    def stats(self):
+        def rate(hits, misses):
+            return hits / (hits + misses) if hits + misses else None
+        with self._lock:
+            c = dict(self.counters)
+            stages = { stage: total / count
+                    for stage, (total, count) in self.stageTotals.items() }
+        c['queueDepth'] = c['jobs'] - c['completed']
+        c['averageStageSeconds'] = stages
+        c['documentHitRate'] = rate(c['documentHits'], c['documentMisses'])
+        c['renderHitRate'] = rate(c['renderHits'], c['renderMisses'])
+        return c
+
+    def serve(self, socketPath):
+        """Accepts jobs on the Unix socket socketPath until interrupted (or
+        terminated). Only the user running the service may connect."""
+        # remove a socket left behind by a previous run (but nothing else)
+        if os.path.exists(socketPath) and stat.S_ISSOCK(os.stat(socketPath).st_mode):
+            os.remove(socketPath)
+        # create the socket with permissions 0600 right away
+        umask = os.umask(0o177)
+        try:
+            server = KropServer(socketPath, KropRequestHandler)
+        finally:
+            os.umask(umask)
+        server.service = self
+        sys.stderr.write('krop service listening on {0}\n'.format(socketPath))
+        # shut down cleanly (removing the socket) also when started in the
+        # background, where SIGINT may be ignored
+        signal.signal(signal.SIGINT, _interrupt)
+        signal.signal(signal.SIGTERM, _interrupt)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            os.remove(socketPath)
+            self.executor.shutdown()
+
+
+def _interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+class KropServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class KropRequestHandler(socketserver.StreamRequestHandler):
+    """Handles a single request (a job or a command) per connection."""
+
+    def send(self, message):
+        self.wfile.write((json.dumps(message) + '\n').encode('utf-8'))
+        self.wfile.flush()
+
+    def handle(self):
+        service = self.server.service
+        try:
+            request = json.loads(self.rfile.readline().decode('utf-8'))
+            if request.get('command') == 'stats':
+                message = service.stats()
+                message['event'] = 'stats'
+                self.send(message)
+                return
+            messages = queue.Queue()
+            job, future, queueDepth = service.submit(request['input'],
+                    request['output'], request.get('options'), messages.put)
+        except (ValueError, KeyError, TypeError, AttributeError) as err:
+            self.send({ 'event': 'error', 'error': 'bad request: {0}'.format(err) })
+            return
+        self.send({ 'event': 'queued', 'job': job, 'queueDepth': queueDepth })
+        while True:
+            message = messages.get()
+            self.send(message)
+            if message['event'] == 'done':
+                break
+
+
+def submitJob(socketPath, inputFileName, outputFileName, **options):
+    """Sends a crop job to a running service and yields the messages (as
+    dicts) which report its progress."""
+    request = { 'input': os.path.abspath(inputFileName),
+            'output': os.path.abspath(outputFileName), 'options': options }
+    return _request(socketPath, request)
+
+def serviceStats(socketPath):
+    """Returns the statistics of a running service."""
+    return next(_request(socketPath, { 'command': 'stats' }))
+
+def _request(socketPath, request):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.connect(socketPath)
+        s.sendall((json.dumps(request) + '\n').encode('utf-8'))
+        with s.makefile('rb') as f:
+            for line in f:
+                yield json.loads(line.decode('utf-8'))
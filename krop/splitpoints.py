@@ -0,0 +1,140 @@
+# -*- coding: iso-8859-1 -*-
+
+"""
+Finding whitespace rows for cutting selections into pieces for a device.
+
+When a selection is distributed into pieces of the aspect ratio of a device
+(see selectionmodel.distributeRect), the cuts can be moved up to a row
+without ink, so that lines of text are not sliced in half. For this, each
+page is rendered once at a low resolution and reduced to its row profile:
+for each row, a bit mask telling which of a few vertical bands of the page
+hold ink there. The profiles are small and cached, so that choosing cuts
+(for another selection or aspect ratio) does not look at the page again.
+
+Copyright (C) 2010-2025 Armin Straub, http://arminstraub.com
+"""
+
+"""
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 3 of the License, or
+(at your option) any later version.
+"""
+
+from array import array
+from collections import OrderedDict
+
+from krop.blankpages import documentKey
+from krop.pagetrim import mapPages, workerDocument
+from krop.raster import renderGray
+
+
+# resolution used for rendering pages (which separates lines of text)
+DPI = 72
+# pixels darker than this count as ink
+THRESHOLD = 160
+# the page is divided into this many vertical bands (at most 16)
+BANDS = 16
+# a band of a row holds ink if more than this many of its pixels are ink
+# (which ignores single specks of scans)
+NOISE = 1
+
+
+class RowProfile:
+    """For each row of a page (from top to bottom), a bit mask of the
+    vertical bands of the page which hold ink in that row."""
+
+    def __init__(self, masks):
+        self.masks = masks
+
+    def bandMask(self, x0=0.0, x1=1.0):
+        """Returns the bit mask of the bands overlapping x0 to x1 (as
+        fractions of the page width)."""
+        first = max(0, min(BANDS-1, int(x0*BANDS)))
+        last = max(first, min(BANDS-1, int(x1*BANDS - 1e-9)))
+        return ((1 << (last+1)) - 1) & ~((1 << first) - 1)
+
+    def snap(self, y, limit, x0=0.0, x1=1.0):
+        """Returns the middle of the whitespace rows (within x0 to x1)
+        nearest above y but not above limit, or None if there is no such
+        row; all positions are fractions of the page."""
+        masks = self.masks
+        n = len(masks)
+        mask = self.bandMask(x0, x1)
+        k = min(n, int(y*n)) - 1
+        while k >= 0 and k >= limit*n and masks[k] & mask:
+            k -= 1
+        if k < 0 or k < limit*n:
+            return None
+        # extend the whitespace upwards and cut in its middle
+        j = k
+        while j > 0 and j-1 >= limit*n and not masks[j-1] & mask:
+            j -= 1
+        return (j + k + 1) / (2*n)
+
+
+def rowMasks(raster, threshold=THRESHOLD, noise=NOISE):
+    """Returns the masks of a RowProfile for a GrayRaster."""
+    light = bytes(range(threshold, 256))
+    width = raster.width
+    bands = [ (b*width // BANDS, (b+1)*width // BANDS) for b in range(BANDS) ]
+    masks = array('H')
+    for y in range(raster.height):
+        row = raster.row(y)
+        mask = 0
+        # rows without ink are the common case between lines
+        if len(row.translate(None, light)) > noise:
+            for b, (x0, x1) in enumerate(bands):
+                if len(row[x0:x1].translate(None, light)) > noise:
+                    mask |= 1 << b
+        masks.append(mask)
+    return masks
+
+def profileWorker(pages, dpi, threshold):
+    """Returns a list of (page index, masks) for the given pages of the
+    document of the worker process (see rowMasks); pages are rendered as
+    displayed."""
+    doc = workerDocument()
+    return [ (idx, rowMasks(renderGray(doc, idx, dpi), threshold)) for idx in pages ]
+
+
+class ProfileCache:
+    """Row profiles of pages of documents, least recently used first (see
+    blankpages.CoverageCache)."""
+
+    def __init__(self, maxEntries=20000):
+        self.maxEntries = maxEntries
+        self._profiles = OrderedDict()
+
+    def get(self, key):
+        profile = self._profiles.get(key)
+        if profile is not None:
+            self._profiles.move_to_end(key)
+        return profile
+
+    def set(self, key, profile):
+        self._profiles[key] = profile
+        while len(self._profiles) > self.maxEntries:
+            self._profiles.popitem(last=False)
+
+_cache = ProfileCache()
+
+def rowProfiles(pages, fileName=None, data=None, workers=None, dpi=DPI,
+        threshold=THRESHOLD):
+    """Returns a dictionary of the RowProfiles of the given pages of a PDF
+    file (or of the PDF given by its data); pages which have not been seen
+    before are rendered in worker processes (see pagetrim.mapPages)."""
+    document = documentKey(fileName, data)
+    profiles = {}
+    missing = []
+    for idx in pages:
+        profile = _cache.get((document, dpi, threshold, idx))
+        if profile is None:
+            missing.append(idx)
+        else:
+            profiles[idx] = profile
+    for idx, masks in mapPages(profileWorker, missing, (dpi, threshold),
+            fileName, data, workers):
+        profiles[idx] = RowProfile(masks)
+        _cache.set((document, dpi, threshold, idx), profiles[idx])
+    return profiles
@@ -0,0 +1,262 @@
+# -*- coding: iso-8859-1 -*-
+
+"""
+Using the text layer of PDF documents (read with PyMuPDF).
+
+For multi-column papers, the grid "columns" creates one selection for each
+column of text on every page (see detectColumns). The columns are found
+from the blocks of text (and images) on a page: the horizontal extents of
+narrow blocks of several lines of text are merged into columns, and blocks spanning several
+columns (like titles, abstracts and wide figures) cut the page into bands.
+Each band yields a selection for each of its columns, in reading order, and
+the wide blocks in between a selection of their own.
+
+Results are cached by a digest of the contents of a page, so that pages
+which have been seen before (by the service or in the graphical interface)
+are not analyzed again.
+
+For selecting around matches of a pattern (like every figure caption), the
+blocks of text of all pages are extracted once into a TextIndex, which is
+then searched with one pattern after another. In the graphical interface,
+the index is built in another process while the pattern is being entered.
+
+Copyright (C) 2010-2025 Armin Straub, http://arminstraub.com
+"""
+
+"""
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 3 of the License, or
+(at your option) any later version.
+"""
+
+import hashlib
+import multiprocessing
+import re
+from collections import OrderedDict
+
+from krop.blankpages import documentKey
+from krop.pagetrim import mapPages, workerDocument
+from krop.pdfcropper import importPyMuPdf
+
+
+# blocks wider than this fraction of the text on a page span columns
+WIDE = 0.6
+# blocks with fewer lines of text, like headings and page numbers, do not
+# define columns
+MIN_LINES = 3
+# blocks at most this far apart (in points) belong to the same column
+GAP = 2
+# margin (in points) left around the text of each selection
+MARGIN = 3
+
+# the crop values of a whole page
+WHOLE_PAGE = (0.0, 0.0, 0.0, 0.0)
+# how many documents are kept in the cache of text indices
+MAX_INDICES = 8
+
+
+def pageBlocks(page):
+    """Returns the blocks of text and images on a PyMuPDF page as list of
+    (x0, y0, x1, y1, lines): the rectangle in points, with respect to the
+    page as displayed, and the number of lines of text (0 for images)."""
+    fitz = importPyMuPdf()
+    m = page.rotation_matrix
+    blocks = page.get_text("blocks", flags=fitz.TEXTFLAGS_BLOCKS | fitz.TEXT_PRESERVE_IMAGES)
+    return [ tuple(fitz.Rect(b[:4]) * m) + (b[4].strip().count('\n') + 1 if b[6] == 0 else 0,)
+            for b in blocks if b[6] != 0 or b[4].strip() ]
+
+def contentDigest(page):
+    """Returns a digest of what is drawn on a PyMuPDF page: its contents,
+    size and rotation."""
+    doc = page.parent
+    h = hashlib.sha256()
+    h.update(repr((tuple(page.rect), page.rotation)).encode('ascii'))
+    for xref in page.get_contents():
+        h.update(doc.xref_stream(xref) or b'')
+    # the same contents may use other fonts and images
+    h.update(doc.xref_object(page.xref, compressed=True).encode('latin-1', 'replace'))
+    return h.digest()
+
+def mergeIntervals(intervals, gap=GAP):
+    """Merges intervals (start, end) which overlap or are at most gap
+    apart, and returns them sorted."""
+    merged = []
+    for a, b in sorted(intervals):
+        if merged and a <= merged[-1][1] + gap:
+            merged[-1][1] = max(merged[-1][1], b)
+        else:
+            merged.append([a, b])
+    return [ tuple(m) for m in merged ]
+
+def boundingBox(rects):
+    return (min(r[0] for r in rects), min(r[1] for r in rects),
+            max(r[2] for r in rects), max(r[3] for r in rects))
+
+def detectColumns(blocks):
+    """Given the blocks on a page (see pageBlocks), returns the rectangles
+    to crop in reading order: one for each column of each band of the page,
+    and one for each group of wide blocks between bands."""
+    if not blocks:
+        return []
+    left = min(b[0] for b in blocks)
+    right = max(b[2] for b in blocks)
+    width = right - left
+    narrow = [ b for b in blocks if b[2] - b[0] <= WIDE*width ]
+    columns = mergeIntervals((b[0], b[2]) for b in narrow if b[4] >= MIN_LINES)
+    if len(columns) <= 1:
+        return [ boundingBox(blocks) ]
+
+    # assign blocks to columns; blocks overlapping several columns are wide,
+    # and blocks overlapping none (like a page number in the gutter) are
+    # left out
+    wide = []
+    inColumn = []
+    for b in blocks:
+        hits = [ k for k, (a, c) in enumerate(columns) if b[0] < c and b[2] > a ]
+        if len(hits) > 1:
+            wide.append(b)
+        elif len(hits) == 1:
+            inColumn.append((hits[0], b))
+
+    # consecutive wide blocks form groups which separate the bands
+    groups = [ list(g) for g in mergeIntervals((b[1], b[3]) for b in wide) ]
+    rects = []
+    top = None
+    for g0, g1 in groups + [ (float('inf'), float('inf')) ]:
+        for k in range(len(columns)):
+            band = [ b for j, b in inColumn if j == k
+                    and (top is None or (b[1] + b[3]) / 2 >= top) and (b[1] + b[3]) / 2 < g0 ]
+            if band:
+                rects.append(boundingBox(band))
+        if g0 != float('inf'):
+            rects.append(boundingBox([ b for b in wide if g0 <= b[1] and b[3] <= g1 ]))
+        # blocks next to the wide ones go with the following band
+        top = g0
+    return rects
+
+def columnCropValues(page):
+    """Returns the crop values (as fractions of the page as displayed) of
+    the columns of a PyMuPDF page (see detectColumns); pages without text
+    are kept as a whole."""
+    rects = detectColumns(pageBlocks(page))
+    if not rects:
+        return [ WHOLE_PAGE ]
+    width, height = page.rect.width, page.rect.height
+    return [ (max(0.0, (x0 - MARGIN) / width), max(0.0, (y0 - MARGIN) / height),
+            max(0.0, 1 - (x1 + MARGIN) / width), max(0.0, 1 - (y1 + MARGIN) / height))
+            for x0, y0, x1, y1 in rects ]
+
+
+class ColumnCache:
+    """Crop values of the columns of pages by the digest of their contents,
+    least recently used first."""
+
+    def __init__(self, maxEntries=100000):
+        self.maxEntries = maxEntries
+        self._columns = OrderedDict()
+
+    def get(self, key):
+        columns = self._columns.get(key)
+        if columns is not None:
+            self._columns.move_to_end(key)
+        return columns
+
+    def set(self, key, columns):
+        self._columns[key] = columns
+        while len(self._columns) > self.maxEntries:
+            self._columns.popitem(last=False)
+
+_cache = ColumnCache()
+
+def pageColumns(page):
+    """Returns the crop values of the columns of a PyMuPDF page (see
+    columnCropValues), using the cache."""
+    key = contentDigest(page)
+    columns = _cache.get(key)
+    if columns is None:
+        columns = columnCropValues(page)
+        _cache.set(key, columns)
+    return list(columns)
+
+
+def pageText(page):
+    """Returns the size (width, height) of a PyMuPDF page as displayed and
+    its blocks of text as list of (x0, y0, x1, y1, text), where the
+    rectangle is in points with respect to the page as displayed and the
+    whitespace of the text is normalized."""
+    fitz = importPyMuPdf()
+    m = page.rotation_matrix
+    blocks = [ tuple(fitz.Rect(b[:4]) * m) + (" ".join(b[4].split()),)
+            for b in page.get_text("blocks") if b[6] == 0 and b[4].strip() ]
+    return (page.rect.width, page.rect.height), blocks
+
+def textWorker(pages):
+    """Returns a list of (page index, text) for the given pages of the
+    document of the worker process (see pageText)."""
+    doc = workerDocument()
+    return [ (idx, pageText(doc[idx])) for idx in pages ]
+
+
+class TextIndex:
+    """The blocks of text on the pages of a document (see pageText), for
+    searching them repeatedly."""
+
+    def __init__(self, pages):
+        self.pages = pages
+
+    def search(self, pattern, padding=(0,0,0,0)):
+        """Returns a list of (page index, crop values) for the blocks of
+        text matching pattern (a regular expression, ignoring case), enlarged
+        by padding (top, right, bottom, left in points). Raises re.error for
+        bad patterns."""
+        regex = re.compile(pattern, re.IGNORECASE)
+        dtop, dright, dbottom, dleft = padding
+        hits = []
+        for idx, ((width, height), blocks) in enumerate(self.pages):
+            for x0, y0, x1, y1, text in blocks:
+                if regex.search(text):
+                    hits.append((idx, (max(0.0, (x0 - dleft) / width),
+                        max(0.0, (y0 - dtop) / height),
+                        max(0.0, 1 - (x1 + dright) / width),
+                        max(0.0, 1 - (y1 + dbottom) / height))))
+        return hits
+
+
+def buildTextIndex(numPages, fileName=None, data=None, workers=None,
+        document=None):
+    """Extracts the TextIndex of a PDF file (or of the PDF given by its
+    data) with numPages pages, using worker processes or its already loaded
+    HeadlessDocument document (see pagetrim.mapPages)."""
+    pages = [ None ] * numPages
+    for idx, text in mapPages(textWorker, list(range(numPages)), (),
+            fileName, data, workers, document=document):
+        pages[idx] = text
+    return TextIndex(pages)
+
+_indices = OrderedDict() # document -> TextIndex, least recently used first
+
+def textIndex(numPages, fileName=None, data=None, workers=None, document=None):
+    """Returns the TextIndex of a PDF file (or of the PDF given by its
+    data), which is only built if it is not cached already."""
+    key = documentKey(fileName, data)
+    index = _indices.get(key)
+    if index is None:
+        index = buildTextIndex(numPages, fileName, data, workers, document)
+        _indices[key] = index
+        while len(_indices) > MAX_INDICES:
+            _indices.popitem(last=False)
+    _indices.move_to_end(key)
+    return index
+
+def startTextIndex(numPages, fileName):
+    """Starts building the TextIndex of a PDF file in another process and
+    returns a Future for it."""
+    from concurrent.futures import ProcessPoolExecutor
+    # spawned since forking the graphical interface is unsafe
+    executor = ProcessPoolExecutor(max_workers=1,
+            mp_context=multiprocessing.get_context('spawn'))
+    future = executor.submit(buildTextIndex, numPages, fileName)
+    # the process exits once the index is built
+    executor.shutdown(wait=False)
+    return future
@@ -19,13 +19,22 @@ from krop.config import PYQT6
 from krop.qt import *
 
 from krop.viewerselections import ViewerSelections
+from krop.pdfcropper import PdfDocumentSession, importPyMuPdf
+from krop.pagegeometry import PageGeometry, cropValuesForRotation
 
 
 class AbstractViewerItem(QGraphicsItem):
     """Abstract class for displaying a PDF document and for allowing the user
     to create selections."""
+
+    # resolution used for displaying pages
+    dpi = 96
+    _gridPen = None # see gridPen
+
     def __init__(self, mainwindow):
         QGraphicsItem.__init__(self)
+        # only the exposed part of the page is painted (see paint)
+        self.setFlag(QGraphicsItem.GraphicsItemFlag.ItemUsesExtendedStyleOption)
         self.selections = ViewerSelections(self)
         self.reset()
         self.mainwindow = mainwindow
@@ -35,20 +44,46 @@ class AbstractViewerItem(QGraphicsItem):
         self.brect = QRectF()
         self.irect = QRectF()
         self._images = []
+        self.geometry = PageGeometry(self.dpi)
         self.selections.deleteSelections()
 
     def boundingRect(self):
         return self.brect
 
     def isPortrait(self):
-        return self.irect.width() <= self.irect.height()
+        if self.isEmpty():
+            return True
+        return self.geometry.isPortrait(self.currentPageIndex)
 
     def paint(self, painter, option, widget):
         img = self.getImage(self.currentPageIndex)
         if img is None:
             return
-        painter.drawRect(self.irect.adjusted(-1,-1,1,1))
-        painter.drawImage(self.irect, img)
+        r = self.irect
+        painter.drawRect(r.adjusted(-1,-1,1,1))
+        # while dragging selections, only small parts of large pages need to
+        # be painted again
+        exposed = option.exposedRect.intersected(r)
+        if not exposed.isEmpty():
+            sx, sy = img.width() / r.width(), img.height() / r.height()
+            painter.drawImage(exposed, img, QRectF((exposed.left()-r.left())*sx,
+                (exposed.top()-r.top())*sy, exposed.width()*sx, exposed.height()*sy))
+
+        # outlines of the page grids (which have no graphics items)
+        painter.setPen(self.gridPen)
+        painter.setBrush(Qt.BrushStyle.NoBrush)
+        for cv in self.selections.pageGridCropValues(self.currentPageIndex):
+            painter.drawRect(QRectF(QPointF(r.left()+cv[0]*r.width(), r.top()+cv[1]*r.height()),
+                QPointF(r.right()-cv[2]*r.width(), r.bottom()-cv[3]*r.height())))
+
+    @property
+    def gridPen(self):
+        # created once, as it is needed for every paint
+        if AbstractViewerItem._gridPen is None:
+            pen = QPen(QColor(0,0,128))
+            pen.setStyle(Qt.PenStyle.DashLine)
+            AbstractViewerItem._gridPen = pen
+        return AbstractViewerItem._gridPen
 
     def mapRectToImage(self, r):
         return r.translated(-self.irect.left(), -self.irect.top())
@@ -66,17 +101,17 @@ class AbstractViewerItem(QGraphicsItem):
             idx = 0
         self._currentPageIndex = idx
 
-        img = self.getImage(idx)
-        if img is None:
+        if self.isEmpty():
             return
         self.selections.updateSelectionVisibility()
 
+        # the size of the page is known without rendering it
         self.prepareGeometryChange()
-        rect = QRectF(img.rect())
+        width, height = self.geometry.pixelSize(idx)
         # inflate slightly so that bounding rect will be visible
         padding = 5
-        self.brect = QRectF(0,0,rect.width()+2*padding,rect.height()+2*padding)
-        self.irect = QRectF(padding,padding,rect.width(),rect.height())
+        self.brect = QRectF(0,0,width+2*padding,height+2*padding)
+        self.irect = QRectF(padding,padding,width,height)
         self.scene().setSceneRect(self.brect)
 
     currentPageIndex = property(getCurrentPageIndex, setCurrentPageIndex)
@@ -113,6 +148,8 @@ class AbstractViewerItem(QGraphicsItem):
         self.reset()
         self.doLoad(filename)
         self._images = [None for i in range(self.numPages())]
+        if not self.isEmpty():
+            self.geometry = self.buildGeometry()
         self.firstPage()
 
     # To be implemented in deriving classes:
@@ -129,22 +166,22 @@ class AbstractViewerItem(QGraphicsItem):
     def cacheImage(self, idx):        
         return None
 
+    def buildGeometry(self):
+        """Returns a PageGeometry table for all pages of the document."""
+        return PageGeometry(self.dpi)
+
     def pageGetRotation(self, idx):        
-        return 0
+        return self.geometry.rotation(idx)
+
+    def documentSession(self, filename):
+        """Returns a PdfDocumentSession for the opened file if it can be
+        shared with the cropper (and is still valid), otherwise None."""
+        return None
 
     def cropValues(self, idx):
-        def adjustForOrientation(cv):
-            if r == 90: # Landscape
-                return [ cv[1], cv[2], cv[3], cv[0] ]
-            elif r == 180: # UpsideDown
-                return [ cv[2], cv[3], cv[0], cv[1] ]
-            elif r == 270: # Seascape
-                return [ cv[3], cv[0], cv[1], cv[2] ]
-            else: # r == 0, Portrait
-                return cv
         crop_values = self.selections.cropValues(idx)
         r = self.pageGetRotation(idx)
-        return [ adjustForOrientation(cv) for cv in crop_values ]
+        return [ cropValuesForRotation(cv, r) for cv in crop_values ]
 
 
 class PopplerViewerItem(AbstractViewerItem):
@@ -167,30 +204,47 @@ class PopplerViewerItem(AbstractViewerItem):
 
     def cacheImage(self, idx):        
         page = self._pdfdoc.page(idx)
-        return page.renderToImage(96.0, 96.0) # dpi = 96
+        return page.renderToImage(float(self.dpi), float(self.dpi))
         # return page.renderToImage() # default dpi = 72
 
-    def pageGetRotation(self, idx):        
-        page = self._pdfdoc.page(idx)
-        o = page.orientation()
-        if o == page.Landscape:
-            return 90
-        elif o == page.UpsideDown:
-            return 180
-        elif o == page.Seascape:
-            return 270
-        else: # o == page.Portrait
-            return 0
+    def buildGeometry(self):
+        # Poppler Qt does not expose the page boxes; we only know the size of
+        # the CropBox (which is what gets displayed)
+        geometry = PageGeometry(self.dpi)
+        for idx in range(self.numPages()):
+            page = self._pdfdoc.page(idx)
+            o = page.orientation()
+            if o == page.Landscape:
+                r = 90
+            elif o == page.UpsideDown:
+                r = 180
+            elif o == page.Seascape:
+                r = 270
+            else: # o == page.Portrait
+                r = 0
+            size = page.pageSizeF()
+            w, h = size.width(), size.height()
+            if r in (90, 270):
+                w, h = h, w
+            box = (0, 0, w, h)
+            geometry.appendPage(box, box, r)
+        return geometry
 
 
 class MuPDFViewerItem(AbstractViewerItem):
     """Viewer implementation which uses PyMuPDF to display PDF documents."""
+    _session = None
+
     def reset(self):
         AbstractViewerItem.reset(self)
+        if self._session is not None:
+            self._session.close()
+            self._session = None
         self._pdfdoc = None
 
     def doLoad(self, filename):
-        self._pdfdoc = fitz.open(filename)
+        self._session = PdfDocumentSession(filename, fitz.open(filename))
+        self._pdfdoc = self._session.document
         # if self._pdfdoc:
         #     self._pdfdoc.setRenderHint(Poppler.Document.Antialiasing and
         #             Poppler.Document.TextAntialiasing)
@@ -203,7 +257,7 @@ class MuPDFViewerItem(AbstractViewerItem):
 
     def cacheImage(self, idx):        
         page = self._pdfdoc[idx]
-        pix = page.get_pixmap(alpha=False, dpi=96) # default dpi is 72
+        pix = page.get_pixmap(alpha=False, dpi=self.dpi) # default dpi is 72
         return QImage(pix.samples, pix.width, pix.height, pix.stride, QImage.Format.Format_RGB888)
         # It might be faster to use samples_ptr but the code results in crashes.
         # https://pymupdf.readthedocs.io/en/latest/tutorial.html
@@ -212,9 +266,20 @@ class MuPDFViewerItem(AbstractViewerItem):
         # fmt = QImage.Format_RGBA8888 if pix.alpha else QImage.Format.Format_RGB888
         # return QImage(pix.samples_ptr, pix.width, pix.height, fmt)
 
-    def pageGetRotation(self, idx):        
-        page = self._pdfdoc[idx]
-        return page.rotation
+    def buildGeometry(self):
+        geometry = PageGeometry(self.dpi)
+        for page in self._pdfdoc:
+            mb, cb = page.mediabox, page.cropbox
+            # MuPDF uses coordinates where (0,0) is the top-left point of the
+            # MediaBox, unlike PDF where (0,0) is the bottom-left.
+            cropbox = (cb.x0, mb.y1-cb.y1, cb.x1, mb.y1-cb.y0)
+            geometry.appendPage(tuple(mb), cropbox, page.rotation)
+        return geometry
+
+    def documentSession(self, filename):
+        if self._session is not None and self._session.isValid(filename):
+            return self._session
+        return None
 
 
 # determine whether to use PopplerQt or PyMuPDF for rendering
@@ -227,7 +292,7 @@ from krop.config import PYQT6
 # for PyQt6 use PyMuPDF
 if PYQT6:
     try:
-        import fitz
+        fitz = importPyMuPdf()
         lib_render = PYMUPDF
     except ImportError:
         _msg = "Please install PyMuPDF first (PyQt6 is being used)."\
@@ -238,7 +303,7 @@ else:
     # PyQt5 was requested
     if not '--use-poppler' in sys.argv:
         try:
-            import fitz
+            fitz = importPyMuPdf()
             lib_render = PYMUPDF
         except ImportError:
             pass
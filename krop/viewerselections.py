@@ -13,65 +13,185 @@ the Free Software Foundation; either version 3 of the License, or
 (at your option) any later version.
 """
 
-from math import ceil
-
 from krop.qt import *
 
+from krop.selectionmodel import SelectionMode, SelectionIndex, SelectionRecord, scopeContains
+from krop.layouts import findLayouts
+from krop.pagetrim import PageCrops, pageGridCropValues, pageGridCount, trimPages, openRenderDocument
+from krop.textlayer import pageColumns
+from krop.splitpoints import rowProfiles
+from krop.autotrim import imageEdges
+
+
+# edges of selections being dragged snap to edges of the content within
+# this distance (in pixels on the screen)
+SNAP_DISTANCE = 8
+# while dragging, the controls showing the current selection are updated at
+# most once within this many milliseconds (a frame)
+FRAME = 16
+
 
 class ViewerSelections(object):
-    """A collection of user-created selections"""
+    """A collection of user-created selections
+
+    The selections are kept as SelectionRecord instances; graphics items
+    (ViewerSelectionItem) are only bound to the selections shown on the
+    current page and are reused when changing pages.
+
+    Grids created on every page individually (page grids, see
+    krop.pagetrim) have no graphics items at all; the viewer merely draws
+    their outlines."""
 
     # possible selection modes
-    all = 0
-    evenodd = 1
-    individual = 2
+    all = SelectionMode.all
+    evenodd = SelectionMode.evenodd
+    individual = SelectionMode.individual
 
     def __init__(self, viewer):
         self.viewer = viewer
         self._selections = []
         self._currentSelection = None
         self._distributeAspectRatio = None
+        self._snapCuts = False
+        self.snapToEdges = True # whether dragged edges snap to the content
         self._selectionMode = ViewerSelections.all
         self._selectionExceptions = [] # list of page numbers which require individual selections
+        # which selections are visible on which page
+        self._index = SelectionIndex()
+        # records of the selections shown on the current page
+        self._shown = []
+        # graphics items which are currently not in use
+        self._freeItems = []
+        self.pageGrids = []
+        self.layoutGrids = [] # page grids shared by the pages of a layout
+        self.pageCrops = None # PageCrops for pageGrids (once trimmed)
+        self.columnScopes = [] # scopes of the selections for text columns
+        self._columnDocument = None # PyMuPDF document for finding them
+        self._columns = {} # page index -> crop values of the text columns
+        self._rows = {} # page index -> RowProfile (see krop.splitpoints)
+        self._edges = {} # page index -> EdgeIndex (see raster.inkEdges)
+        # updates of the controls are coalesced (see currentSelectionUpdated)
+        self._syncTimer = QTimer()
+        self._syncTimer.setSingleShot(True)
+        self._syncTimer.setInterval(FRAME)
+        self._syncTimer.timeout.connect(self._syncCurrentSelection)
         self.lastPos = None
 
     @property
-    def items(self):
-        """Returns a list of the selections."""
-        # the list equals self.viewer.childItems() except for the ordering:
-        # we preserve the order in which the selections were created, whereas
-        # childItems() gets reordered when stackBefore (or setZValue are
-        # called)
+    def records(self):
+        """Returns a list of all selections (as SelectionRecord) in the order
+        in which they were created."""
         return self._selections
 
+    @property
+    def items(self):
+        """Returns a list of the graphics items of the selections shown on
+        the current page."""
+        return [ r.item for r in self._shown ]
+
+    def _showSelection(self, record):
+        if self._freeItems:
+            self._freeItems.pop().bind(record)
+        else:
+            ViewerSelectionItem(self.viewer, record)
+        return record.item
+
+    def _hideSelection(self, record):
+        item = record.item
+        if item is self._currentSelection:
+            self._currentSelection = None
+        item.unbind()
+        self._freeItems.append(item)
+
+    def _updateOrder(self):
+        for k, r in enumerate(self._shown):
+            r.item.orderIndex = k+1
+
     def addSelection(self, rect=None):
-        s = ViewerSelectionItem(self.viewer, rect)
-        self._selections.append(s)
+        if rect is None:
+            rect = self.viewer.irect
+        record = SelectionRecord(self.viewer.currentPageIndex,
+                (rect.x(), rect.y(), rect.width(), rect.height()))
+        self._selections.append(record)
+        self._index.add(record, record.pageIndex)
+        # a new selection is always visible on the page it is created on
+        # (a scope can be set afterwards, see setSelectionScope)
+        s = self._showSelection(record)
+        self._shown.append(record)
+        s.orderIndex = len(self._shown)
+        s.adjustBoundingRect()
         s.setAsCurrent()
         return s
 
+    def addPageSelections(self, selections):
+        """Adds selections given as list of (page index, crop values), each
+        applying only to its page."""
+        r = self.viewer.irect
+        pageRect = (r.x(), r.y(), r.width(), r.height())
+        for idx, cv in selections:
+            rect = (r.x() + cv[0]*r.width(), r.y() + cv[1]*r.height(),
+                    (1 - cv[0] - cv[2])*r.width(), (1 - cv[1] - cv[3])*r.height())
+            record = SelectionRecord(idx, rect, (idx, idx, None))
+            record.parentRect = pageRect
+            self._selections.append(record)
+            self._index.add(record, idx, record.scope)
+        self.updateSelectionVisibility()
+
     def deleteSelection(self, s):
-        self._selections.remove(s)
-        s.scene().removeItem(s)
-        if s is self.currentSelection:
+        record = s.record
+        self._selections.remove(record)
+        self._index.remove(record)
+        isCurrent = s is self.currentSelection
+        self._shown.remove(record)
+        self._hideSelection(record)
+        self._updateOrder()
+        if isCurrent:
             self.currentSelection = None
             self.autoSetCurrentSelection()
 
+    def setSelectionScope(self, s, scope):
+        """Makes the selection s apply to the pages of scope (see
+        selectionmodel.parseScope) instead of according to the selection
+        mode; scope None undoes this."""
+        record = s.record
+        record.scope = scope
+        self._index.setScope(record, scope)
+        self.updateSelectionVisibility()
+
     def deleteSelections(self):
-        for s in self.items:
-            self.deleteSelection(s)
+        for r in self._shown:
+            self._hideSelection(r)
+        self._shown = []
+        self._selections = []
+        self._index.clear()
+        self.pageGrids = []
+        self.layoutGrids = []
+        self.pageCrops = None
+        self.columnScopes = []
+        self._columns = {}
+        self._rows = {}
+        self._edges = {}
+        if self._columnDocument is not None:
+            self._columnDocument.close()
+            self._columnDocument = None
+        if self._currentSelection is not None:
+            self.currentSelection = None
 
     def getCurrentSelection(self):
         return self._currentSelection
 
     def setCurrentSelection(self, currentSelection):
+        # the current selection is stacked on top of the others; only the
+        # handles of the previous and the new one change their color
+        previous = self._currentSelection
+        if previous is not None:
+            previous.setZValue(0)
+            previous.updateHandles()
         self._currentSelection = currentSelection
         if currentSelection:
-            for s in self.items:
-                if s is not currentSelection:
-                    s.stackBefore(currentSelection)
+            currentSelection.setZValue(1)
             currentSelection.setFocus()
-        self.viewer.scene().update()
+            currentSelection.updateHandles()
         self.currentSelectionUpdated()
 
     currentSelection = property(getCurrentSelection, setCurrentSelection)
@@ -83,14 +203,17 @@ class ViewerSelections(object):
         if s and not s.selectionVisibleOnPage(idx):
             s = None
         # if currentSelection is None, we auto select if possible
-        if s is None:
-            for i in reversed(self.items):
-                if i.selectionVisibleOnPage(idx):
-                    s = i
-                    break
+        if s is None and self._shown:
+            s = self._shown[-1].item
         self.currentSelection = s
 
     def currentSelectionUpdated(self):
+        """Lets the main window show the current selection, at most once per
+        frame (while dragging, this is called for every mouse move)."""
+        if not self._syncTimer.isActive():
+            self._syncTimer.start()
+
+    def _syncCurrentSelection(self):
         self.viewer.mainwindow.currentSelectionUpdated()
 
     def getDistributeAspectRatio(self):
@@ -98,15 +221,70 @@ class ViewerSelections(object):
 
     def setDistributeAspectRatio(self, distributeAspectRatio):
         self._distributeAspectRatio = distributeAspectRatio
+        self.updateRowProfiles()
         self.viewer.update()
 
     distributeAspectRatio = property(getDistributeAspectRatio, setDistributeAspectRatio)
 
+    def getSnapCuts(self):
+        return self._snapCuts
+
+    def setSnapCuts(self, snapCuts):
+        self._snapCuts = snapCuts
+        self.updateRowProfiles()
+        self.viewer.update()
+
+    # whether distributed selections are cut at whitespace rows
+    snapCuts = property(getSnapCuts, setSnapCuts)
+
+    def loadRowProfiles(self, pages=None, workers=None):
+        """Makes sure that the row profiles of the given pages (by default,
+        of all pages) are known, computing the missing ones at once in
+        worker processes."""
+        fileName = self.viewer.mainwindow.fileName
+        if pages is None:
+            pages = range(self.viewer.numPages())
+        missing = [ idx for idx in pages if idx not in self._rows ]
+        if fileName and missing:
+            self._rows.update(rowProfiles(missing, fileName, workers=workers))
+
+    def updateRowProfiles(self):
+        """Loads the row profiles of the whole document if cuts are snapped
+        to whitespace rows. This is done when snapping is turned on or a
+        document is opened, so that painting never waits for pages to be
+        rendered."""
+        if not self.snapCuts or self.distributeAspectRatio is None:
+            return
+        QApplication.setOverrideCursor(Qt.CursorShape.WaitCursor)
+        try:
+            self.loadRowProfiles()
+        finally:
+            QApplication.restoreOverrideCursor()
+
+    def rowProfile(self, idx):
+        """Returns the RowProfile of page idx if cuts are snapped to
+        whitespace rows (and it has been loaded, see updateRowProfiles),
+        otherwise None."""
+        if not self.snapCuts or self.distributeAspectRatio is None:
+            return None
+        return self._rows.get(idx)
+
+    def edgeIndex(self, idx):
+        """Returns the EdgeIndex of the image of page idx (computed once),
+        or None if snapping to edges is turned off."""
+        if not self.snapToEdges:
+            return None
+        if idx not in self._edges:
+            img = self.viewer.getImage(idx)
+            self._edges[idx] = None if img is None else imageEdges(img)
+        return self._edges[idx]
+
     def getSelectionMode(self):
         return self._selectionMode
 
     def setSelectionMode(self, mode):
         self._selectionMode = mode
+        self._index.mode = mode
         self.updateSelectionVisibility()
 
     selectionMode = property(getSelectionMode, setSelectionMode)
@@ -116,19 +294,102 @@ class ViewerSelections(object):
 
     def setSelectionExceptions(self, exceptions):
         self._selectionExceptions = exceptions
+        self._index.exceptions = exceptions
         self.updateSelectionVisibility()
 
     selectionExceptions = property(getSelectionExceptions, setSelectionExceptions)
 
+    def visibleSelections(self, idx):
+        """Returns the selections (as SelectionRecord) visible on page idx in
+        order of creation."""
+        return self._index.visibleSelections(idx)
+
+    def selectionVisibleOnPage(self, record, idx):
+        return self._index.isVisible(record, idx)
+
     def updateSelectionVisibility(self):
         idx = self.viewer.currentPageIndex
-        for s in self.items:
-            s.setVisible(s.selectionVisibleOnPage(idx))
+        visible = self.visibleSelections(idx)
+        # only touch the selections shown before and those to be shown now
+        keep = set(visible)
+        for r in self._shown:
+            if r not in keep:
+                self._hideSelection(r)
+        for r in visible:
+            if r.item is None:
+                self._showSelection(r)
+        self._shown = visible
+        self._updateOrder()
         self.autoSetCurrentSelection()
 
+    def addPageGrid(self, grid, layout=False):
+        """Adds a grid on every page; with layout, it is shared by the pages
+        with the same layout when trimming (see krop.layouts)."""
+        (self.layoutGrids if layout else self.pageGrids).append(grid)
+        self.pageCrops = None
+        self.viewer.update()
+
+    def addColumns(self, fileName, scope=None):
+        """Adds a selection for each column of text on the pages of scope
+        (all pages for None), found in the text layer of the PDF file (see
+        krop.textlayer)."""
+        if self._columnDocument is None:
+            self._columnDocument = openRenderDocument(fileName)
+        self.columnScopes.append(scope)
+        self.viewer.update()
+
+    def columnCropValues(self, idx):
+        """Returns the crop values (as fractions of the displayed page) of
+        the text columns on page idx."""
+        if not any(scope is None or scopeContains(scope, idx) for scope in self.columnScopes):
+            return []
+        if idx not in self._columns:
+            self._columns[idx] = pageColumns(self._columnDocument[idx])
+        return self._columns[idx]
+
+    def trimPages(self, fileName, padding=(0,0,0,0), sensitivity=5.0,
+            allowedchanges=0.0, smoothing=None, speckSize=0, furniture=False,
+            useAllPages=True):
+        """Trims the page grids on each page of the document individually
+        (smoothing the results as in PageCrops.smooth if requested, and
+        excluding running headers and footers with furniture). The grids
+        shared by layout are trimmed as in HeadlessKrop.trimPages."""
+        numPages = self.viewer.numPages()
+        grids = self.pageGrids + self.layoutGrids
+        pages = range(numPages)
+        labels = None
+        if self.layoutGrids:
+            labels, leaders = findLayouts(self.viewer.geometry, fileName)
+            if not useAllPages and not self.pageGrids:
+                pages = sorted(set(leaders))
+        self.pageCrops = PageCrops(numPages, pageGridCount(grids))
+        for idx, cropValues in trimPages(pages, grids,
+                padding, sensitivity, allowedchanges, fileName,
+                dpi=self.viewer.dpi, speckSize=speckSize, furniture=furniture):
+            self.pageCrops.set(idx, cropValues)
+        if smoothing is not None:
+            self.pageCrops.smooth(*smoothing)
+        if labels is not None:
+            self.pageCrops.share(labels, pageGridCount(self.pageGrids))
+        self.pageCrops.fillBlank()
+        self.viewer.update()
+
+    def pageGridCropValues(self, idx):
+        """Returns the crop values (as fractions of the displayed page) of
+        the page grids (and text columns) on page idx."""
+        columns = self.columnCropValues(idx)
+        if not self.pageGrids and not self.layoutGrids:
+            return columns
+        if self.pageCrops is not None and idx in self.pageCrops:
+            return self.pageCrops.get(idx) + columns
+        return pageGridCropValues(self.pageGrids + self.layoutGrids,
+                self.viewer.geometry.isPortrait(idx)) + columns
+
     def cropValues(self, idx):
-        return [ c for s in self.items if s.selectionVisibleOnPage(idx)
-                for c in s.cropValues() ]
+        rows = self.rowProfile(idx)
+        return [ c for r in self.visibleSelections(idx)
+                for c in r.cropValues(self.distributeAspectRatio, rows) ] + \
+                self.pageGridCropValues(idx)
 
     def mousePressEvent(self, event):
         if event.button() == Qt.MouseButton.LeftButton:
@@ -150,21 +411,17 @@ class ViewerSelectionItem(QGraphicsItem):
 
     handleColor = QColor(0,0,128)
     handleColorCurrent = QColor(0,128,0)
+    _paintResources = None # see paintResources
 
-    """An individual user-created selection"""
-    def __init__(self, parent, rect=None):
+    """The graphics item showing a selection (given by a SelectionRecord)"""
+    def __init__(self, parent, record):
         QGraphicsItem.__init__(self, parent)
         self.setFlag(QGraphicsItem.GraphicsItemFlag.ItemIsFocusable)
 
-        if rect is None:
-            rect = self.mapRectFromParent(self.viewer.irect)
-
-        self.rect = rect
-        self._aspectRatioData = None
-        self._aspectRatio = None
+        self.record = None
+        self.orderIndex = 1
         self.minWidth = 1
         self.minHeight = 1
-        self.pageIndex = self.viewer.currentPageIndex
         self.lastPos = None
         SelectionHandleItem(self, SelectionHandleItem.LeftHandle)
         SelectionHandleItem(self, SelectionHandleItem.RightHandle)
@@ -174,10 +431,33 @@ class ViewerSelectionItem(QGraphicsItem):
         SelectionCornerHandleItem(self, 0, 1)
         SelectionCornerHandleItem(self, 1, 0)
         SelectionCornerHandleItem(self, 1, 1)
-        self.adjustBoundingRect()
+        self.bind(record)
 
         self.setCursor(Qt.CursorShape.OpenHandCursor)
 
+    def bind(self, record):
+        """Shows the selection given by record using this item."""
+        self.prepareGeometryChange()
+        self.record = record
+        record.item = self
+        self.lastPos = None
+        self.setZValue(0)
+        self.updateHandles()
+        self.setVisible(True)
+
+    def unbind(self):
+        self.prepareGeometryChange()
+        self.record.item = None
+        self.record = None
+        self.lastPos = None
+        self.setVisible(False)
+
+    def updateHandles(self):
+        for c in self.childItems():
+            if isinstance(c, SelectionHandleItem):
+                c.setVisible(self.aspectRatio is None)
+            c.update()
+
 
     @property
     def selection(self):
@@ -201,35 +481,48 @@ class ViewerSelectionItem(QGraphicsItem):
 
 
     @property
-    def orderIndex(self):
-        nr = 1
-        for c in self.selections.items:
-            if c is self:
-                return nr
-            if c.isVisible():
-                nr += 1
+    def pageIndex(self):
+        return self.record.pageIndex
+
+    @property
+    def scope(self):
+        return self.record.scope
+
+    def getRect(self):
+        return QRectF(*self.record.rect)
+
+    def setRect(self, rect):
+        self.record.rect = (rect.x(), rect.y(), rect.width(), rect.height())
+
+    rect = property(getRect, setRect)
+
+    def getParentRect(self):
+        return QRectF(*self.record.parentRect)
+
+    def setParentRect(self, rect):
+        self.record.parentRect = (rect.x(), rect.y(), rect.width(), rect.height())
+
+    parentrect = property(getParentRect, setParentRect)
 
 
     @property
     def aspectRatio(self):
-        return self._aspectRatio
+        return self.record.aspectRatio
 
     def getAspectRatioData(self):
-        return self._aspectRatioData or [0, ""]
+        return self.record.aspectRatioData or [0, ""]
 
     def setAspectRatioData(self, data):
         index, s = data
         # index=0: flexible
         if index == 0:
-            self._aspectRatio = None
+            self.record.aspectRatio = None
             data[1] = ""
         else:
-            self._aspectRatio = aspectRatioFromStr(s)
-        self._aspectRatioData = data
+            self.record.aspectRatio = aspectRatioFromStr(s)
+        self.record.aspectRatioData = data
         self.adjustBoundingRect()
-        for c in self.childItems():
-            if isinstance(c, SelectionHandleItem):
-                c.setVisible(self._aspectRatio is None)
+        self.updateHandles()
 
     aspectRatioData= property(getAspectRatioData, setAspectRatioData)
 
@@ -241,17 +534,15 @@ class ViewerSelectionItem(QGraphicsItem):
 
     def selectionVisibleOnPage(self, pageIndex):
         """Determines if this selection is visible on a given page."""
-        mode = self.selections.selectionMode
-        exceptions = self.selections.selectionExceptions
-        if pageIndex in exceptions or self.pageIndex in exceptions or mode == ViewerSelections.individual:
-            return pageIndex == self.pageIndex
-        if mode == ViewerSelections.all:
-            return True
-        if mode == ViewerSelections.evenodd:
-            return (pageIndex - self.pageIndex) % 2 == 0
+        if self.record is None:
+            return False
+        return self.selections.selectionVisibleOnPage(self.record, pageIndex)
 
 
     def boundingRect(self):
+        if self.record is None:
+            # not in use
+            return QRectF()
         return self.rect
 
     def setBoundingRect(self, pt1, pt2):
@@ -327,8 +618,10 @@ class ViewerSelectionItem(QGraphicsItem):
         # store parent rect for comparison (when cropping later)
         self.parentrect = self.mapRectFromParent(self.viewer.irect)
 
-        # change size of boundingRect
+        # change size of boundingRect (the handles move along)
         self.prepareGeometryChange()
+        for c in self.childItems():
+            c.geometryChanged()
         self.rect = self.mapRectFromParent(nrect)
         self.selections.currentSelectionUpdated()
 
@@ -336,6 +629,26 @@ class ViewerSelectionItem(QGraphicsItem):
                 nrect.right()-orect.right(), nrect.bottom()-orect.bottom() ]
 
 
+    def snapEdges(self, dx1=0, dy1=0, dx2=0, dy2=0):
+        """Given how the edges of the selection are about to move (as for
+        adjustBoundingRect), returns these moves changed so that moving
+        edges end up on an edge of the content nearby (if any)."""
+        index = self.selections.edgeIndex(self.viewer.currentPageIndex)
+        if index is None:
+            return [dx1, dy1, dx2, dy2]
+        views = self.scene().views() if self.scene() else []
+        scale = views[0].transform().m11() if views else 1.0
+        reach = SNAP_DISTANCE / scale
+        # the image of the page is drawn at irect
+        r = self.mapRectToImage(self.rect)
+        def snap(d, value, nearest):
+            if d == 0:
+                return d
+            edge = nearest(value + d, reach)
+            return d if edge is None else edge - value
+        return [ snap(dx1, r.left(), index.snapX), snap(dy1, r.top(), index.snapY),
+                snap(dx2, r.right(), index.snapX), snap(dy2, r.bottom(), index.snapY) ]
+
     def moveBoundingRect(self, dx, dy):
         """moves boundingRect but never changes its size"""
         orect = self.mapRectToParent(self.rect)
@@ -352,26 +665,13 @@ class ViewerSelectionItem(QGraphicsItem):
 
 
     def distributeRect(self):
-        r = self.distributeAspectRatio
-        if r is None:
-            return [ self.rect ]
-        x0,y0,x1,y1 = self.rect.getCoords()
-        h = (x1-x0) / r # height of each piece
-        # how many pieces?
-        nr = int(ceil((y1-y0) / h))
-        if nr == 1:
-            return [ self.rect ]
-        o = (nr*h - (y1-y0)) / float(nr-1) # overlap
-        return [ QRectF(x0, y0+i*(h-o), x1-x0, h) for i in range(nr) ]
+        rows = self.selections.rowProfile(self.viewer.currentPageIndex)
+        r = self.viewer.irect
+        return [ QRectF(*p) for p in self.record.pieces(self.distributeAspectRatio,
+                rows, (r.x(), r.y(), r.width(), r.height())) ]
 
     def cropValues(self):
-        p = self.parentrect
-        def cV(r):
-            return ((r.left()-p.left())/p.width(),
-                    (r.top()-p.top())/p.height(),
-                    (p.right()-r.right())/p.width(),
-                    (p.bottom()-r.bottom())/p.height())
-        return [ cV(r) for r in self.distributeRect() ]
+        return self.record.cropValues(self.distributeAspectRatio)
 
     def mapRectToImage(self, r):
         m = self.mapRectToParent(r)
@@ -381,30 +681,45 @@ class ViewerSelectionItem(QGraphicsItem):
         m = self.viewer.mapRectFromImage(r)
         return self.mapRectFromParent(m)
 
+    @classmethod
+    def paintResources(cls):
+        """Returns the pens, brushes and font for painting selections, which
+        are created once."""
+        if cls._paintResources is None:
+            outerPen = QPen()
+            outerPen.setStyle(Qt.PenStyle.DashLine)
+            brushes = []
+            for style in (Qt.BrushStyle.BDiagPattern, Qt.BrushStyle.FDiagPattern):
+                brush = QBrush(QColor(0,0,0,50))
+                brush.setStyle(style)
+                brushes.append(brush)
+            font = QFont()
+            font.setPointSize(20)
+            font.setWeight(700)
+            cls._paintResources = (QPen(QColorConstants.White), outerPen, brushes,
+                    font, QPen(QColor(0,0,0,155)))
+        return cls._paintResources
+
     def paint(self, painter, option, widget):
         rect = self.boundingRect()
+        whitePen, outerPen, brushes, font, textPen = self.paintResources()
 
         # outer dashed rectangle
-        outerPen = QPen()
-        outerPen.setStyle(Qt.PenStyle.DashLine)
-        painter.setPen(QColorConstants.White)
+        painter.setPen(whitePen)
         painter.drawRect(rect)
         painter.setPen(outerPen)
         painter.drawRect(rect)
 
         def drawLine(pt1, pt2):
-            painter.setPen(QColorConstants.White)
+            painter.setPen(whitePen)
             painter.drawLine(pt1, pt2)
             painter.setPen(outerPen)
             painter.drawLine(pt1, pt2)
 
         # distributed rectangles
         even = True
-        brush = QBrush()
-        brush.setColor(QColor(0,0,0,50))
         for r in self.distributeRect():
-            brush.setStyle(even and Qt.BrushStyle.BDiagPattern or Qt.BrushStyle.FDiagPattern)
-            painter.setBrush(brush)
+            painter.setBrush(brushes[0 if even else 1])
             painter.setPen(Qt.PenStyle.NoPen)
             painter.drawRect(r)
             if r.top() > self.rect.top():
@@ -414,10 +729,7 @@ class ViewerSelectionItem(QGraphicsItem):
             even = not even
 
         # inner number
-        font = QFont()
-        font.setPointSize(20)
-        font.setWeight(700)
-        painter.setPen(QColor(0,0,0,155))
+        painter.setPen(textPen)
         painter.setFont(font)
         painter.drawText(rect, Qt.AlignmentFlag.AlignCenter, str(self.orderIndex))
 
@@ -503,6 +815,11 @@ class SelectionHandleItem(QGraphicsItem):
     def selection(self):
         return self.parentItem()
 
+    def geometryChanged(self):
+        """Called before the selection changes its size (which moves this
+        handle)."""
+        self.prepareGeometryChange()
+
     @property
     def handleColor(self):
         if self.selection.isCurrent():
@@ -558,17 +875,18 @@ class SelectionHandleItem(QGraphicsItem):
         if self.lastPos:
             pos2 = event.pos()
             mov = pos2 - self.lastPos
+            sel = self.selection
             if self.role==SelectionHandleItem.LeftHandle:
-                d = self.selection.adjustBoundingRect(mov.x(),0,0,0)[0]
+                d = sel.adjustBoundingRect(*sel.snapEdges(mov.x(),0,0,0))[0]
                 pos2.setX(self.lastPos.x() + d)
             if self.role==SelectionHandleItem.RightHandle:
-                d = self.selection.adjustBoundingRect(0,0,mov.x(),0)[2]
+                d = sel.adjustBoundingRect(*sel.snapEdges(0,0,mov.x(),0))[2]
                 pos2.setX(self.lastPos.x() + d)
             if self.role==SelectionHandleItem.TopHandle:
-                d = self.selection.adjustBoundingRect(0,mov.y(),0,0)[1]
+                d = sel.adjustBoundingRect(*sel.snapEdges(0,mov.y(),0,0))[1]
                 pos2.setY(self.lastPos.y() + d)
             if self.role==SelectionHandleItem.BottomHandle:
-                d = self.selection.adjustBoundingRect(0,0,0,mov.y())[3]
+                d = sel.adjustBoundingRect(*sel.snapEdges(0,0,0,mov.y()))[3]
                 pos2.setY(self.lastPos.y() + d)
             self.lastPos = pos2
 
@@ -592,6 +910,11 @@ class SelectionCornerHandleItem(QGraphicsItem):
     def selection(self):
         return self.parentItem()
 
+    def geometryChanged(self):
+        """Called before the selection changes its size (which moves this
+        handle)."""
+        self.prepareGeometryChange()
+
     @property
     def handleColor(self):
         if self.selection.isCurrent():
@@ -629,7 +952,8 @@ class SelectionCornerHandleItem(QGraphicsItem):
     def mouseMoveEvent(self, event):
         if self.lastPos:
             mov = event.pos() - self.lastPos
-            d = self.selection.adjustBoundingRect(*self.direction(mov))
+            sel = self.selection
+            d = sel.adjustBoundingRect(*sel.snapEdges(*self.direction(mov)))
             self.lastPos = self.lastPos + self.corner(QRectF().adjusted(*d))
 
     def mouseReleaseEvent(self, event):
@@ -0,0 +1,16 @@
+import pytest
+
+
+@pytest.fixture
+def samplePdf():
+    """Returns the data of a PDF with three pages of text in two columns."""
+    pymupdf = pytest.importorskip('pymupdf')
+    doc = pymupdf.open()
+    for n in range(3):
+        page = doc.new_page(width=595, height=842)
+        for x in (72, 310):
+            page.insert_textbox(pymupdf.Rect(x, 100, x+210, 700),
+                    "Page {0}. ".format(n+1) + "Some words of text. "*60)
+    data = doc.tobytes()
+    doc.close()
+    return data
@@ -0,0 +1,80 @@
+import json
+import os
+
+import krop.batch
+from krop.batch import (checkOutputs, collectFiles, failedResult, kropBatch,
+        kropWorker, outputFileName)
+from krop.options import KropOptions
+
+
+def writeFiles(tmp_path, names, data=b''):
+    for name in names:
+        path = tmp_path / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+
+
+def test_collectFiles(tmp_path):
+    writeFiles(tmp_path, ['a.pdf', 'a-cropped.pdf', 'b.txt', 'sub/c.PDF'])
+    listed = tmp_path / 'list.txt'
+    listed.write_text('/x/a.pdf\n\n/y/d.pdf\n')
+    assert collectFiles([str(tmp_path)], str(listed)) == [
+            (str(tmp_path / 'a.pdf'), 'a.pdf'),
+            (str(tmp_path / 'sub' / 'c.PDF'), os.path.join('sub', 'c.PDF')),
+            ('/x/a.pdf', 'a.pdf'), ('/y/d.pdf', 'd.pdf')]
+    # without a suffix, every PDF is an input
+    assert len(collectFiles([str(tmp_path)], suffix='')) == 3
+
+def test_outputFileName():
+    assert outputFileName('in/a.pdf', 'a.pdf') == 'in/a-cropped.pdf'
+    assert outputFileName('in/sub/a.pdf', 'sub/a.pdf', 'out') == 'out/sub/a-cropped.pdf'
+    assert outputFileName('in/a.pdf', 'a.pdf', 'out', '') == 'out/a.pdf'
+
+def test_checkOutputs(tmp_path):
+    writeFiles(tmp_path, ['a.pdf', 'x/b.pdf', 'y/b.pdf'])
+    a, xb, yb = [ str(tmp_path / name) for name in ('a.pdf', 'x/b.pdf', 'y/b.pdf') ]
+    # "-o ." with an empty suffix would overwrite a.pdf
+    out = str(tmp_path / 'out' / 'b.pdf')
+    jobs = [(a, os.path.join(str(tmp_path), '.', 'a.pdf')), (xb, out), (yb, out),
+            (a, str(tmp_path / 'a-cropped.pdf'))]
+    errors = checkOutputs(jobs)
+    assert sorted(errors) == [0, 1, 2]
+    assert 'overwrite' in errors[0]
+    assert yb in errors[1] and xb in errors[2]
+
+
+def crashingWorker(inputFileName, outputFileName, options):
+    if os.path.basename(inputFileName) == 'crash.pdf':
+        os._exit(1)
+    return failedResult(inputFileName, outputFileName, None) | { 'status': 'ok' }
+
+def test_kropBatch_isolates_crashes(tmp_path, monkeypatch):
+    # workers are forked, so they see the replaced worker function
+    monkeypatch.setattr(krop.batch, 'kropWorker', crashingWorker)
+    names = [ 'crash.pdf' if k == 3 else '{0}.pdf'.format(k) for k in range(10) ]
+    jobs = [ (name, 'out-' + name) for name in names ]
+    summary = tmp_path / 'summary.json'
+    assert kropBatch(jobs, KropOptions(), 3, str(summary)) == 1
+    results = json.loads(summary.read_text())['files']
+    assert [ r['input'] for r in results ] == names
+    assert [ r['status'] for r in results ] == [ 'failed' if k == 3 else 'ok' for k in range(10) ]
+
+def test_kropBatch(samplePdf, tmp_path):
+    writeFiles(tmp_path, ['in/a.pdf', 'in/sub/b.pdf'], samplePdf)
+    writeFiles(tmp_path, ['in/bad.pdf'], b'no PDF')
+    options = KropOptions()
+    options.grid = '2x1'
+    jobs = [ (i, outputFileName(i, r, str(tmp_path / 'out')))
+            for i, r in collectFiles([str(tmp_path / 'in')]) ]
+    summary = tmp_path / 'summary.json'
+    for workers in (1, 2):
+        assert kropBatch(jobs, options, workers, str(summary)) == 1
+        results = json.loads(summary.read_text())['files']
+        assert [ r['status'] for r in results ] == ['ok', 'failed', 'ok']
+        assert results[2]['output'] == str(tmp_path / 'out' / 'sub' / 'b-cropped.pdf')
+        assert results[2]['outputSize'] == os.path.getsize(results[2]['output'])
+
+def test_kropWorker_reports_errors(tmp_path):
+    result = kropWorker(str(tmp_path / 'missing.pdf'), str(tmp_path / 'out.pdf'), KropOptions())
+    assert result['status'] == 'failed'
+    assert result['error'].startswith('FileNotFoundError')
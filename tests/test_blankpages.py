@@ -0,0 +1,43 @@
+import pytest
+
+from krop.blankpages import inkCoverage, removeBlank
+from krop.raster import GrayRaster
+
+
+@pytest.fixture
+def blankPdf():
+    """Returns the data of a PDF whose second page is blank and whose third
+    page only has text in its left half."""
+    pymupdf = pytest.importorskip('pymupdf')
+    doc = pymupdf.open()
+    for n in range(3):
+        page = doc.new_page(width=595, height=842)
+        if n != 1:
+            page.insert_textbox(pymupdf.Rect(72, 100, 270, 700), "Some words of text. "*60)
+        if n == 0:
+            page.insert_textbox(pymupdf.Rect(310, 100, 520, 700), "Some words of text. "*60)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def test_inkCoverage():
+    r = GrayRaster(4, 2, 4, b'\x00\xff\xff\xff' + b'\x00\x00\xff\xc0')
+    assert inkCoverage(r) == 3/8
+    assert inkCoverage(r, (1, 0, 4, 2)) == 1/6
+    assert inkCoverage(r, (1, 0, 4, 2), threshold=193) == 2/6
+    assert inkCoverage(r, (2, 0, 2, 2)) == 0.0
+
+def test_removeBlank_pages(blankPdf):
+    pages = [ (idx, [(0, 0, 0, 0)]) for idx in range(3) ]
+    assert removeBlank(pages, data=blankPdf, workers=1) == [pages[0], pages[2]]
+    # pages without crop values are checked as a whole
+    assert removeBlank([(1, []), (2, [])], data=blankPdf, workers=1) == [(2, [])]
+
+def test_removeBlank_subpages(blankPdf):
+    halves = [(0, 0, 0.5, 0), (0.5, 0, 0, 0)]
+    pages = [ (idx, halves) for idx in range(3) ]
+    assert removeBlank(pages, 'subpages', data=blankPdf, workers=1) == [
+            (0, halves), (2, halves[:1])]
+    with pytest.raises(ValueError):
+        removeBlank(pages, 'parts', data=blankPdf)
@@ -0,0 +1,49 @@
+import os
+
+from krop.buildcache import (buildRecord, cacheFileName, isUpToDate,
+        kropFileCached, optionsDigest)
+from krop.options import KropOptions
+
+
+def test_optionsDigest():
+    options = KropOptions()
+    digest = optionsDigest(options)
+    # options which do not change the output are left out
+    options.force = True
+    options.trimWorkers = 4
+    assert optionsDigest(options) == digest
+    options.grid = '2x1'
+    assert optionsDigest(options) != digest
+
+def test_kropFileCached(samplePdf, tmp_path):
+    inputFileName, outputFileName = str(tmp_path / 'in.pdf'), str(tmp_path / 'out.pdf')
+    with open(inputFileName, 'wb') as f:
+        f.write(samplePdf)
+    options = KropOptions()
+    options.grid = '2x1'
+    assert not kropFileCached(inputFileName, outputFileName, options)
+    assert os.path.exists(cacheFileName(outputFileName))
+    assert isUpToDate(outputFileName, buildRecord(inputFileName, options))
+    assert kropFileCached(inputFileName, outputFileName, options)
+    # other options, a changed output or force crop again
+    options.grid = '1x1'
+    assert not kropFileCached(inputFileName, outputFileName, options)
+    with open(outputFileName, 'ab') as f:
+        f.write(b'\n')
+    assert not kropFileCached(inputFileName, outputFileName, options)
+    options.force = True
+    assert not kropFileCached(inputFileName, outputFileName, options)
+
+def test_changed_input(samplePdf, tmp_path):
+    inputFileName, outputFileName = str(tmp_path / 'in.pdf'), str(tmp_path / 'out.pdf')
+    with open(inputFileName, 'wb') as f:
+        f.write(samplePdf)
+    options = KropOptions()
+    options.grid = '1x1'
+    kropFileCached(inputFileName, outputFileName, options)
+    # the digest of the contents counts, not the time of modification
+    os.utime(inputFileName, (0, 0))
+    assert kropFileCached(inputFileName, outputFileName, options)
+    with open(inputFileName, 'ab') as f:
+        f.write(b'\n')
+    assert not kropFileCached(inputFileName, outputFileName, options)
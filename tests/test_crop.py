@@ -0,0 +1,64 @@
+import io
+import os
+import subprocess
+import sys
+
+import pytest
+
+import krop
+
+
+def pageCount(data):
+    pymupdf = pytest.importorskip('pymupdf')
+    with pymupdf.open(stream=bytes(data), filetype="pdf") as doc:
+        return doc.page_count
+
+
+def test_crop_returns_bytes(samplePdf):
+    cropped = krop.crop(samplePdf, grid='2x1')
+    assert cropped.startswith(b'%PDF')
+    assert pageCount(cropped) == 6
+
+def test_crop_to_bytesio(samplePdf):
+    output = io.BytesIO()
+    output.write(b'head')
+    assert krop.crop(samplePdf, output, grid='2x1') is None
+    data = output.getvalue()
+    assert data.startswith(b'head%PDF')
+    assert pageCount(data[4:]) == 6
+
+def test_crop_to_file_object(samplePdf, tmp_path):
+    fileName = tmp_path / 'out.pdf'
+    with open(fileName, 'wb') as f:
+        f.write(b'existing content\n')
+        krop.crop(samplePdf, f, grid='2x1')
+        f.write(b'trailer\n')
+    data = fileName.read_bytes()
+    # the PDF is written at the position of the stream, which is not
+    # reopened by its name
+    assert data.startswith(b'existing content\n%PDF')
+    assert data.endswith(b'%%EOF\ntrailer\n')
+    assert pageCount(data[len(b'existing content\n'):-len(b'trailer\n')]) == 6
+
+def test_crop_to_stream_without_name(samplePdf):
+    class Sink:
+        def __init__(self):
+            self.chunks = []
+        def write(self, data):
+            self.chunks.append(bytes(data))
+    sink = Sink()
+    krop.crop(samplePdf, sink, grid='1x1')
+    assert pageCount(b''.join(sink.chunks)) == 3
+
+def test_crop_to_standard_output(samplePdf, tmp_path):
+    (tmp_path / 'in.pdf').write_bytes(samplePdf)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+        [root] + os.environ.get('PYTHONPATH', '').split(os.pathsep)))
+    with open(tmp_path / 'out.pdf', 'wb') as f:
+        subprocess.run([sys.executable, '-m', 'krop', '--go', 'in.pdf',
+            '--grid=2x1', '-o', '-'], cwd=tmp_path, env=env, stdout=f, check=True)
+    assert sorted(os.listdir(tmp_path)) == ['in.pdf', 'out.pdf']
+    data = (tmp_path / 'out.pdf').read_bytes()
+    assert data.startswith(b'%PDF')
+    assert pageCount(data) == 6
@@ -0,0 +1,90 @@
+import json
+
+import pytest
+
+from krop.cropplan import CropPlan, CropPlanError, cropPlan
+from krop.selectionmodel import SelectionMode
+
+
+LEFT = (0.0, 0.0, 0.5, 0.0)
+RIGHT = (0.5, 0.0, 0.0, 0.0)
+
+
+def evenOddPlan(numPages=4, **kwargs):
+    # odd pages (counted from 1) are split in two, even pages are not cropped
+    return cropPlan(numPages, lambda idx: [LEFT, RIGHT] if idx % 2 == 0 else [],
+            SelectionMode.evenodd, **kwargs)
+
+
+def test_checkDocument_allows_other_page_counts():
+    plan = evenOddPlan()
+    plan.checkDocument(4)
+    plan.checkDocument(9)
+    plan.checkDocument(2)
+    with pytest.raises(CropPlanError):
+        plan.checkDocument(9, strict=True)
+
+def test_checkDocument_checks_referenced_pages():
+    plan = evenOddPlan(6, selectionExceptions=[4])
+    plan.checkDocument(5)
+    with pytest.raises(CropPlanError):
+        plan.checkDocument(4)
+    plan = evenOddPlan(6, selectionScopes=[(1, 2, None), (3, 5, 'odd')])
+    # "4-6" reaches the end of the plan, so only its first page is needed
+    plan.checkDocument(4)
+    plan.checkDocument(20)
+    with pytest.raises(CropPlanError):
+        plan.checkDocument(3)
+
+def test_checkDocument_individual_selections():
+    plan = cropPlan(3, lambda idx: [LEFT], SelectionMode.individual)
+    plan.checkDocument(3)
+    with pytest.raises(CropPlanError):
+        plan.checkDocument(4)
+
+def test_cropValues_beyond_plan_follow_parity():
+    plan = evenOddPlan(4, selectionExceptions=[2])
+    plan.setCropValues(2, [RIGHT])
+    assert plan.cropValues(6) == [LEFT, RIGHT]
+    assert plan.cropValues(7) == []
+    assert plan.cropValues(2) == [RIGHT]
+
+
+def scopedPlan():
+    plan = evenOddPlan(6, selectionExceptions=[4], initialPageIndex=2, rotation=90,
+            selectionScopes=[(1, 2, None), None, (3, 5, 'odd')])
+    plan.setCropValues(4, [(0.125, 0.25, 0.0, 1/3)])
+    return plan
+
+def assertSamePlan(plan, other):
+    assert other.toJson() == plan.toJson()
+    assert [ other.cropValues(idx) for idx in range(other.numPages) ] == \
+            [ plan.cropValues(idx) for idx in range(plan.numPages) ]
+
+def test_round_trips():
+    plan = scopedPlan()
+    assert plan.selectionScopes == [(1, 2, None), (3, 5, 'odd')]
+    assertSamePlan(plan, CropPlan.fromBytes(plan.toBytes()))
+    assertSamePlan(plan, CropPlan.fromJson(json.loads(json.dumps(plan.toJson()))))
+
+def test_save_and_load(tmp_path):
+    plan = scopedPlan()
+    for name in ('plan.krop', 'plan.json'):
+        fileName = str(tmp_path / name)
+        plan.save(fileName)
+        assertSamePlan(plan, CropPlan.load(fileName))
+    assert CropPlan.load(str(tmp_path / 'plan.json')).toBytes() == plan.toBytes()
+
+def test_bad_plans(tmp_path):
+    data = scopedPlan().toBytes()
+    for bad in (b'', b'%PDF-1.7', data[:20], data[:-4]):
+        with pytest.raises(CropPlanError):
+            CropPlan.fromBytes(bad)
+    d = scopedPlan().toJson()
+    d['pages'] = d['pages'][:-1]
+    with pytest.raises(CropPlanError):
+        CropPlan.fromJson(d)
+    fileName = tmp_path / 'plan.json'
+    fileName.write_text('[1, 2]')
+    with pytest.raises(CropPlanError):
+        CropPlan.load(str(fileName))
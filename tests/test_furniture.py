@@ -0,0 +1,53 @@
+from krop.furniture import FurnitureDetector, candidateBands
+from krop.raster import GrayRaster
+
+
+def page(width, height, blocks):
+    """Returns a GrayRaster with black blocks (x0, y0, x1, y1)."""
+    samples = bytearray(b'\xff'*(width*height))
+    for x0, y0, x1, y1 in blocks:
+        for y in range(y0, y1):
+            samples[y*width+x0:y*width+x1] = bytes(x1-x0)
+    return GrayRaster(width, height, width, bytes(samples))
+
+def bookPage(n, body):
+    """A page with a running head, the page number n drawn as n narrow
+    strokes at the bottom, and body text at rows body[0] to body[1]."""
+    head = [(20, 5, 180, 9)]
+    number = [ (96 + 3*k, 290, 97 + 3*k, 295) for k in range(n) ]
+    text = [ (20, y, 180, y+2) for y in range(body[0], body[1], 4) ]
+    return page(200, 300, head + number + text)
+
+
+def test_candidateBands():
+    # the zone is 36 rows high, so that the first line of text is the
+    # second band at the top
+    top, bottom = candidateBands(bookPage(1, (30, 260)))
+    assert [ (y0, y1) for y0, y1, cut, signature in top ] == [(5, 9), (30, 32)]
+    # the cut lies in the middle of the blank rows below the head
+    assert top[0][2] == (9 + 30) // 2
+    assert [ (y0, y1) for y0, y1, cut, signature in bottom ] == [(290, 295)]
+    # a band reaching beyond the zone is no candidate
+    top, bottom = candidateBands(page(200, 300, [(20, 5, 180, 100)]))
+    assert top == []
+
+def test_signatures_ignore_page_numbers():
+    bands = [ candidateBands(bookPage(n, (40, 260))) for n in (1, 2, 3) ]
+    signatures = [ [ b[3] for b in top + bottom ] for top, bottom in bands ]
+    assert signatures[0] == signatures[1] == signatures[2]
+    # but a different running head differs
+    other = page(200, 300, [(20, 5, 120, 9)])
+    assert candidateBands(other)[0][0][3] != signatures[0][0]
+
+def test_FurnitureDetector():
+    detector = FurnitureDetector(minRepeats=3)
+    pages = [ candidateBands(bookPage(n, (40, 260))) for n in (1, 2, 3) ]
+    for top, bottom in pages:
+        detector.add([ b[3] for b in top + bottom ])
+    top, bottom = pages[0]
+    assert detector.excluded([ b[3] for b in top ]) == 1
+    # a band repeated on fewer pages is kept, and so are the bands after it
+    detector = FurnitureDetector(minRepeats=3)
+    for top, bottom in pages[:2]:
+        detector.add([ b[3] for b in top ] * 2)
+    assert detector.excluded([ b[3] for b in top ]) == 0
@@ -0,0 +1,43 @@
+import pytest
+
+from krop.options import parseGridScopes, parseScopedGrid, str2pages
+from krop.pagegeometry import PageGeometry
+
+
+def mixedGeometry():
+    # a landscape page followed by two portrait pages
+    geometry = PageGeometry()
+    geometry.appendPage((0, 0, 842, 595), (0, 0, 842, 595), 0)
+    geometry.appendPage((0, 0, 595, 842), (0, 0, 595, 842), 0)
+    geometry.appendPage((0, 0, 842, 595), (0, 0, 842, 595), 90)
+    return geometry
+
+
+def test_parseScopedGrid_uses_first_page_of_scope():
+    geometry = mixedGeometry()
+    assert parseScopedGrid('2', (1, 2, None), geometry, 0) == (1, 2)
+    assert parseScopedGrid('2', (0, 2, None), geometry, 1) == (2, 1)
+    # the page is portrait as displayed
+    assert parseScopedGrid('2', (2, 2, None), geometry, 0) == (1, 2)
+
+def test_parseScopedGrid_without_pages_uses_initial_page():
+    geometry = mixedGeometry()
+    assert parseScopedGrid('2', None, geometry, 0) == (2, 1)
+    assert parseScopedGrid('2', None, geometry, 1) == (1, 2)
+    assert parseScopedGrid('3x2', 'all', geometry, 1) == (3, 2)
+
+
+def test_str2pages():
+    assert str2pages('1-3', 10) == [0, 1, 2]
+    assert str2pages('2, 5-', 7) == [1, 4, 5, 6]
+    assert str2pages('4', 10) == [3]
+    assert str2pages('', 10) == []
+
+def test_parseGridScopes():
+    assert parseGridScopes('2x1', 10) == [('2x1', None)]
+    assert parseGridScopes('1@1-3; 2x1@4-:odd', 10) == [('1', (0, 2, None)),
+            ('2x1', (3, 9, 'odd'))]
+    assert parseGridScopes('1@all;auto@layout', 10) == [('1', 'all'), ('auto', 'layout')]
+    for grid in ('', ';', '2@0', '2@5-3'):
+        with pytest.raises(ValueError):
+            parseGridScopes(grid, 10)
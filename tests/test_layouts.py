@@ -0,0 +1,61 @@
+from krop.layouts import (clusterLayouts, contentBox, evenSplit,
+        findGutters, pageFeatures, proposeGrid)
+from krop.raster import GrayRaster
+
+
+def page(width, height, blocks):
+    """Returns a GrayRaster with black blocks (x0, y0, x1, y1)."""
+    samples = bytearray(b'\xff'*(width*height))
+    for x0, y0, x1, y1 in blocks:
+        for y in range(y0, y1):
+            samples[y*width+x0:y*width+x1] = bytes(x1-x0)
+    return GrayRaster(width, height, width, bytes(samples))
+
+def lines(x0, y0, x1, y1, step=4):
+    """Returns blocks looking like lines of text."""
+    return [ (x0, y, x1, y+2) for y in range(y0, y1, step) ]
+
+
+def test_contentBox_and_gutters():
+    twoColumns = page(200, 300, lines(20, 30, 95, 270) + lines(105, 30, 180, 270))
+    assert contentBox(twoColumns) == (20, 30, 180, 268)
+    assert findGutters(twoColumns) == [(95, 105)]
+    # a heading across both columns does not hide the gutter
+    headed = page(200, 300, [(20, 20, 180, 22)] + lines(20, 30, 95, 270)
+            + lines(105, 30, 180, 270))
+    assert findGutters(headed) == [(95, 105)]
+    assert contentBox(page(10, 10, [])) is None
+    assert pageFeatures(page(10, 10, [])) == (None, ())
+
+def test_clusterLayouts():
+    full = page(200, 300, lines(20, 30, 95, 270) + lines(105, 30, 180, 270))
+    short = page(200, 300, lines(20, 30, 95, 150) + lines(105, 30, 180, 150))
+    single = page(200, 300, lines(20, 30, 180, 270))
+    features = [ pageFeatures(r) for r in (short, full, single, full, page(200, 300, [])) ]
+    labels, leaders = clusterLayouts([(595, 842, 0)]*5, features)
+    # the short page joins the full ones, and the blank page (without
+    # gutters) joins the single column
+    assert list(labels) == [0, 0, 1, 0, 1]
+    assert leaders == [1, 2]
+    # pages of another size never share a layout
+    labels, leaders = clusterLayouts([(595, 842, 0), (612, 792, 0)], [features[1]]*2)
+    assert list(labels) == [0, 1]
+
+def test_evenSplit():
+    part = [0]*5 + [3, 3, 0, 3, 3, 3, 0, 0, 3, 3] + [0]*5
+    assert evenSplit(part*2, 0, 3) == 2
+    assert evenSplit(part*3, 0, 3) == 3
+    # one part with a lot more content does not look alike
+    assert evenSplit(part + [0]*5 + [3]*10 + [0]*5, 0, 3) == 2
+    assert evenSplit(part + [0]*5 + [3]*2 + [0]*13, 0, 3) == 1
+    # neither do parts not split by a gap
+    assert evenSplit([3]*40, 0, 3) == 1
+
+def test_proposeGrid():
+    # two slides side by side, each with the same lines, and a single
+    # column of text
+    slides = page(200, 100, lines(10, 20, 90, 80) + lines(110, 20, 190, 80))
+    text = page(200, 100, lines(20, 10, 180, 90))
+    assert proposeGrid([slides, slides, text]) == (2, 1)
+    assert proposeGrid([text]) == (1, 1)
+    assert proposeGrid([page(20, 20, [])]) is None
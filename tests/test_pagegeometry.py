@@ -0,0 +1,31 @@
+import random
+
+import pytest
+
+from krop.pagegeometry import PageGeometry
+
+
+def test_pixelSize_agrees_with_MuPDF():
+    pymupdf = pytest.importorskip('pymupdf')
+    rng = random.Random(1)
+    doc = pymupdf.open()
+    cases = []
+    for k in range(100):
+        page = doc.new_page(width=1500, height=1500)
+        dpi = rng.choice([72, 96, 150, 300])
+        z = dpi / 72
+        # CropBoxes off the pixel grid, with sizes just above a whole number
+        # of pixels
+        x0, y0 = rng.uniform(0, 100), rng.uniform(0, 100)
+        w, h = [ (rng.randint(300, 700) + rng.choice([0.0009, 0.0011, 0.5])) / z
+                for i in range(2) ]
+        page.set_cropbox(pymupdf.Rect(x0, y0, x0+w, y0+h))
+        page.set_rotation(rng.choice([0, 90, 180, 270]))
+        cases.append((k, dpi))
+    for k, dpi in cases:
+        page = doc[k]
+        geometry = PageGeometry(dpi)
+        mb, cb = page.mediabox, page.cropbox
+        geometry.appendPage(tuple(mb), (cb.x0, mb.y1-cb.y1, cb.x1, mb.y1-cb.y0), page.rotation)
+        pix = page.get_pixmap(dpi=dpi)
+        assert geometry.pixelSize(0) == (pix.width, pix.height)
@@ -0,0 +1,56 @@
+import random
+
+from krop.pagetrim import PageCrops, _rollingMedian, _rollingMin, isBlank
+
+
+# crop values of a page trimmed to its text, and of a blank page
+TEXT = (0.1, 0.1, 0.1, 0.2)
+BLANK_PAGE = (0.5, 0.5, 0.5, 0.5)
+
+
+def test_isBlank():
+    assert isBlank(BLANK_PAGE)
+    assert isBlank((0.498, 0.5, 0.498, 0.5))
+    assert not isBlank(TEXT)
+    # a thin rule across the page is not blank
+    assert not isBlank((0.1, 0.5, 0.1, 0.5))
+
+def test_smooth_leaves_out_blank_pages():
+    crops = PageCrops(8, 1)
+    for idx in range(8):
+        crops.set(idx, [BLANK_PAGE if idx == 3 else TEXT])
+    crops.smooth(5, 'max', True)
+    for idx in range(8):
+        if idx != 3:
+            assert crops.get(idx) == [TEXT]
+    assert crops.blank(3, 0)
+
+def test_fillBlank_uses_nearest_page_of_same_parity():
+    crops = PageCrops(6, 2)
+    for idx in range(6):
+        crops.set(idx, [(0.1*idx, 0.1, 0.1, 0.1), BLANK_PAGE if idx in (2, 3) else TEXT])
+    crops.set(4, [BLANK_PAGE, TEXT])
+    crops.fillBlank()
+    assert crops.get(4)[0] == crops.get(2)[0] == (0.2, 0.1, 0.1, 0.1)
+    assert crops.get(2)[1] == crops.get(3)[1] == TEXT
+
+def test_fillBlank_keeps_selections_blank_everywhere():
+    crops = PageCrops(3, 1)
+    for idx in range(3):
+        crops.set(idx, [BLANK_PAGE])
+    crops.fillBlank()
+    assert all(crops.blank(idx, 0) for idx in range(3))
+
+
+def windows(values, window):
+    h = window // 2
+    return [ values[max(0, i-h):i+h+1] for i in range(len(values)) ]
+
+def test_rolling_functions_agree_with_windows():
+    rng = random.Random(3)
+    for n in (0, 1, 2, 7, 40):
+        values = [ rng.randrange(10) / 10 for i in range(n) ]
+        for window in (1, 3, 5, 9):
+            expected = windows(values, window)
+            assert _rollingMin(values, window) == [ min(w) for w in expected ]
+            assert _rollingMedian(values, window) == [ sorted(w)[len(w)//2] for w in expected ]
@@ -0,0 +1,93 @@
+import random
+
+import pytest
+
+import krop.raster
+from krop.raster import GrayRaster, despeckle
+
+
+@pytest.fixture(autouse=True, params=['numpy', 'python'])
+def implementation(request, monkeypatch):
+    """Runs every test with NumPy (if installed) and without it."""
+    if request.param == 'numpy':
+        pytest.importorskip('numpy')
+    else:
+        monkeypatch.setattr(krop.raster, 'numpy', None)
+
+
+def raster(rows):
+    """Returns a GrayRaster drawn with '#' for ink and '.' for paper."""
+    width = len(rows[0])
+    samples = b''.join(row.replace('#', '\x00').replace('.', '\xff').encode('latin-1')
+            for row in rows)
+    return GrayRaster(width, len(rows), width, samples)
+
+def drawing(r):
+    return [ ''.join('#' if v == 0 else '.' for v in r.row(y)) for y in range(r.height) ]
+
+def components(r, threshold=128):
+    """Returns the connected areas of ink (diagonally, too) as sets of
+    pixels, found pixel by pixel."""
+    ink = { (x, y) for y in range(r.height) for x in range(r.width)
+            if r.row(y)[x] < threshold }
+    areas = []
+    while ink:
+        todo = [ink.pop()]
+        area = set(todo)
+        while todo:
+            x, y = todo.pop()
+            for p in [ (x+dx, y+dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1) ]:
+                if p in ink:
+                    ink.remove(p)
+                    area.add(p)
+                    todo.append(p)
+        areas.append(area)
+    return areas
+
+
+def test_despeckle_drops_specks_and_keeps_strokes():
+    r = raster([
+        '#..........#####....',
+        '.......##......#....',
+        '.......##......#..#.',
+        '..#............#....',
+        '.###......#....#....',
+        '..#......#.#........',
+        '........#...#.......',
+        '#.#.#..#.....#...###',
+        ])
+    assert drawing(despeckle(r, 3)) == [
+        '...........#####....',
+        '...............#....',
+        '...............#....',
+        '...............#....',
+        '..........#....#....',
+        '.........#.#........',
+        '........#...#.......',
+        '.......#.....#......',
+        ]
+
+def test_despeckle_keeps_specks_larger_than_size():
+    r = raster([
+        '.....',
+        '.###.',
+        '.#.#.',
+        '.###.',
+        ])
+    assert drawing(despeckle(r, 2)) == drawing(r)
+    assert drawing(despeckle(r, 3)) == [ '.....' ] * 4
+
+def test_despeckle_matches_labelling_pixel_by_pixel():
+    rnd = random.Random(1)
+    for k in range(30):
+        width, height, size = rnd.randint(1, 60), rnd.randint(1, 60), rnd.randint(1, 5)
+        samples = bytes(rnd.choice([0, 100, 200, 255, 255, 255]) for i in range(width*height))
+        r = GrayRaster(width, height, width, samples)
+        expected = bytearray(b'\xff'*(width*height))
+        for area in components(r):
+            xs = [ x for x, y in area ]
+            ys = [ y for x, y in area ]
+            if max(xs) - min(xs) + 1 > size or max(ys) - min(ys) + 1 > size:
+                for x, y in area:
+                    expected[y*width + x] = 0
+        assert despeckle(r, size).samples == bytes(expected)
@@ -0,0 +1,122 @@
+import random
+
+import pytest
+
+from krop.selectionmodel import (IntervalTree, SelectionIndex, SelectionMode,
+        parseScope, scopeContains, scopeToStr, selectionVisibleOnPage)
+
+
+def test_parseScope():
+    assert parseScope('5-20', 30) == (4, 19, None)
+    assert parseScope(' 5- ', 30) == (4, 29, None)
+    assert parseScope('7', 30) == (6, 6, None)
+    assert parseScope('2-8:odd', 30) == (1, 7, 'odd')
+    # ranges may extend beyond the last page
+    assert parseScope('5-40:even', 30) == (4, 29, 'even')
+    for s in ('0', '31', '5-3', 'x', '1-2:all'):
+        with pytest.raises(ValueError):
+            parseScope(s, 30)
+
+def test_scopeToStr():
+    for s in ('5-20', '7', '2-8:odd'):
+        assert scopeToStr(parseScope(s, 30)) == s
+
+def test_scopeContains():
+    assert scopeContains((1, 3, None), 1)
+    assert not scopeContains((1, 3, None), 4)
+    # odd and even refer to page numbers, counted from 1
+    assert scopeContains((0, 9, 'odd'), 2)
+    assert not scopeContains((0, 9, 'odd'), 3)
+    assert scopeContains((0, 9, 'even'), 3)
+
+
+def test_IntervalTree_stab():
+    tree = IntervalTree()
+    tree.add('a', 0, 4)
+    tree.add('b', 3, 3)
+    tree.add('c', 5, 9)
+    assert sorted(tree.stab(3)) == ['a', 'b']
+    assert tree.stab(5) == ['c']
+    assert tree.stab(10) == []
+    tree.remove('a')
+    assert tree.stab(3) == ['b']
+    assert len(tree) == 2
+    tree.clear()
+    assert tree.stab(3) == []
+
+def test_IntervalTree_agrees_with_scanning():
+    rng = random.Random(1)
+    tree = IntervalTree()
+    intervals = {}
+    for value in range(200):
+        first = rng.randrange(100)
+        intervals[value] = (first, first + rng.randrange(20))
+        tree.add(value, *intervals[value])
+    for value in range(0, 200, 3):
+        tree.remove(value)
+        del intervals[value]
+    for point in range(-1, 122):
+        assert sorted(tree.stab(point)) == sorted(value
+                for value, (first, last) in intervals.items() if first <= point <= last)
+
+
+def visible(index, pages):
+    return [ index.visibleSelections(idx) for idx in pages ]
+
+def test_SelectionIndex_modes():
+    index = SelectionIndex()
+    index.add('a', 0)
+    index.add('b', 1)
+    assert visible(index, range(3)) == [['a', 'b']]*3
+    index.mode = SelectionMode.evenodd
+    assert visible(index, range(3)) == [['a'], ['b'], ['a']]
+    index.mode = SelectionMode.individual
+    assert visible(index, range(3)) == [['a'], ['b'], []]
+    index.remove('a')
+    assert visible(index, range(3)) == [[], ['b'], []]
+
+def test_SelectionIndex_exceptions():
+    index = SelectionIndex()
+    index.add('a', 0)
+    index.add('b', 2)
+    index.exceptions = [2]
+    assert visible(index, range(3)) == [['a'], ['a'], ['b']]
+    index.exceptions = []
+    assert visible(index, range(3)) == [['a', 'b']]*3
+
+def test_SelectionIndex_scopes():
+    index = SelectionIndex()
+    index.add('a', 0)
+    index.add('b', 0, (1, 3, 'even'))
+    index.add('c', 0)
+    assert visible(index, range(5)) == [['a', 'c'], ['a', 'b', 'c'],
+            ['a', 'c'], ['a', 'b', 'c'], ['a', 'c']]
+    # scoped selections are not shown on exceptions, unless their scope is
+    # just that page
+    index.add('d', 0, (3, 3, None))
+    index.exceptions = [3]
+    assert index.visibleSelections(3) == ['d']
+    assert not index.isVisible('b', 3)
+    assert index.isVisible('b', 1)
+    assert index.isVisible('d', 3)
+    index.remove('d')
+    index.setScope('b', None)
+    assert index.scope('b') is None
+    assert index.visibleSelections(2) == ['a', 'b', 'c']
+
+def test_SelectionIndex_agrees_with_selectionVisibleOnPage():
+    rng = random.Random(2)
+    index = SelectionIndex()
+    created = {}
+    for s in range(30):
+        created[s] = rng.randrange(10)
+        index.add(s, created[s])
+    for mode in (SelectionMode.all, SelectionMode.evenodd, SelectionMode.individual):
+        index.mode = mode
+        for exceptions in ([], [1, 4], [0, 5, 9]):
+            index.exceptions = exceptions
+            for idx in range(10):
+                expected = [ s for s in range(30)
+                        if selectionVisibleOnPage(idx, created[s], mode, set(exceptions)) ]
+                assert index.visibleSelections(idx) == expected
+                assert [ s for s in range(30) if index.isVisible(s, idx) ] == expected
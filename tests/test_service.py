@@ -0,0 +1,96 @@
+import os
+import stat
+import subprocess
+import sys
+import time
+
+import pytest
+
+import krop.service
+from krop.options import KropOptions
+from krop.service import KropService, serviceStats, serviceWorker, submitJob
+
+
+@pytest.fixture
+def service():
+    service = KropService(KropOptions(), workers=2)
+    yield service
+    service.executor.shutdown()
+
+
+def test_jobOptions(service):
+    service.defaults.grid = '2x1'
+    options = service.jobOptions({ 'trim': True })
+    assert (options.grid, options.trim) == ('2x1', True)
+    assert not service.defaults.trim
+    for name in ('savePlan', 'plan', 'trimWorkers', 'buildCache', '_index', 'nonsense'):
+        with pytest.raises(ValueError):
+            service.jobOptions({ name: 'x' })
+
+def test_progress_and_stats(service, samplePdf, tmp_path):
+    (tmp_path / 'in.pdf').write_bytes(samplePdf)
+    messages = []
+    for k in range(2):
+        job, future, queueDepth = service.submit(str(tmp_path / 'in.pdf'),
+                str(tmp_path / 'out.pdf'), { 'grid': '2x1' }, messages.append)
+        assert future.result(timeout=60)['status'] == 'ok'
+    deadline = time.time() + 10
+    while len(messages) < 10 and time.time() < deadline:
+        time.sleep(0.01)
+    assert [ (m['job'], m['event'], m.get('stage')) for m in messages[:5] ] == [
+            (1, 'stage', 'open'), (1, 'stage', 'load'), (1, 'stage', 'select'),
+            (1, 'stage', 'crop'), (1, 'done', None)]
+    assert messages[4]['outputSize'] == os.path.getsize(tmp_path / 'out.pdf')
+    stats = service.stats()
+    assert (stats['jobs'], stats['completed'], stats['failed'], stats['queueDepth']) == (2, 2, 0, 0)
+    assert set(stats['averageStageSeconds']) == {'open', 'load', 'select', 'crop'}
+
+
+def crashingWorker(inputFileName, *args):
+    if os.path.basename(inputFileName) == 'crash.pdf':
+        os._exit(1)
+    return serviceWorker(inputFileName, *args)
+
+def test_crashing_worker(service, samplePdf, tmp_path, monkeypatch):
+    # workers are forked, so they see the replaced worker function
+    monkeypatch.setattr(krop.service, 'serviceWorker', crashingWorker)
+    (tmp_path / 'in.pdf').write_bytes(samplePdf)
+    names = [ 'crash.pdf' if k == 1 else 'in.pdf' for k in range(6) ]
+    futures = [ service.submit(str(tmp_path / name), str(tmp_path / 'out{0}.pdf'.format(k)),
+            { 'grid': '1x1' })[1]
+            for k, name in enumerate(names) ]
+    results = [ future.result(timeout=60) for future in futures ]
+    assert [ r['status'] for r in results ] == [ 'failed' if k == 1 else 'ok' for k in range(6) ]
+    assert 'died' in results[1]['error']
+    # the service keeps working
+    future = service.submit(str(tmp_path / 'in.pdf'), str(tmp_path / 'out.pdf'), { 'grid': '1x1' })[1]
+    assert future.result(timeout=60)['status'] == 'ok'
+    assert service.stats()['failed'] == 1
+
+
+def test_serve(samplePdf, tmp_path):
+    (tmp_path / 'in.pdf').write_bytes(samplePdf)
+    socketPath = str(tmp_path / 'krop.socket')
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+        [root] + os.environ.get('PYTHONPATH', '').split(os.pathsep)))
+    process = subprocess.Popen([sys.executable, '-m', 'krop', '--serve', socketPath,
+        '--jobs', '1', '--grid', '2x1'], env=env, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.time() + 30
+        while not os.path.exists(socketPath) and time.time() < deadline:
+            time.sleep(0.05)
+        assert stat.S_IMODE(os.stat(socketPath).st_mode) == 0o600
+        messages = list(submitJob(socketPath, str(tmp_path / 'in.pdf'),
+            str(tmp_path / 'out.pdf'), trim=False))
+        assert [ m['event'] for m in messages ] == ['queued'] + ['stage']*4 + ['done']
+        assert messages[-1]['status'] == 'ok'
+        messages = list(submitJob(socketPath, str(tmp_path / 'in.pdf'),
+            str(tmp_path / 'out.pdf'), savePlan=str(tmp_path / 'plan')))
+        assert messages[0]['event'] == 'error'
+        assert not os.path.exists(tmp_path / 'plan')
+        assert serviceStats(socketPath)['completed'] == 1
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+    assert not os.path.exists(socketPath)
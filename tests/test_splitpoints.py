@@ -0,0 +1,43 @@
+from krop.raster import GrayRaster
+from krop.selectionmodel import distributeRect
+from krop.splitpoints import BANDS, RowProfile, rowMasks, rowProfiles
+
+
+def test_rowMasks():
+    # 32 pixels wide, that is, 2 pixels per band; ink in the left half of
+    # row 1 and in the last band of row 3 (but just a speck in row 2)
+    rows = [ b'\xff'*32, b'\x00'*16 + b'\xff'*16, b'\xff'*31 + b'\x00',
+            b'\xff'*30 + b'\x00'*2 ]
+    raster = GrayRaster(32, 4, 32, b''.join(rows))
+    assert list(rowMasks(raster)) == [0, (1 << BANDS//2) - 1, 0, 1 << (BANDS-1)]
+
+def test_snap():
+    # lines of text in rows 2-3 and 6-8 of 10
+    profile = RowProfile([0, 0, 3, 3, 0, 0, 1, 1, 1, 0])
+    # the cut moves up to the middle of rows 4 and 5
+    assert profile.snap(0.75, 0.3) == 0.5
+    # but not beyond the limit
+    assert profile.snap(0.75, 0.55) is None
+    # ink outside of x0 to x1 does not matter
+    assert profile.snap(0.35, 0.0, 0.5, 1.0) == 0.15
+    assert profile.snap(0.35, 0.0) == 0.1
+
+def test_distributeRect_with_snap():
+    profile = RowProfile([0, 0, 1, 1, 0, 0, 1, 1, 0, 0])
+    def snap(y, limit):
+        return profile.snap(y, limit)
+    # pieces are at most 0.5 high; the first cut moves up to the whitespace
+    # in row 4, the second one cannot move far enough
+    assert [ round(p[3], 6) for p in distributeRect((0, 0, 0.5, 1), 1, snap) ] == [0.45, 0.5, 0.15]
+
+def test_rowProfiles(samplePdf):
+    profiles = rowProfiles([0, 2], data=samplePdf, workers=1)
+    assert sorted(profiles) == [0, 2]
+    masks = profiles[0].masks
+    # text between 100 and 700 points (the page is 842 points high) and
+    # away from the left and right edges
+    text = [ k for k, mask in enumerate(masks) if mask ]
+    assert 95 <= text[0] and text[-1] <= 705
+    assert all(mask & (1 | 1 << (BANDS-1)) == 0 for mask in masks)
+    # the profiles are cached
+    assert rowProfiles([0], data=samplePdf)[0] is profiles[0]
@@ -0,0 +1,47 @@
+import pytest
+
+from krop.textlayer import detectColumns, mergeIntervals, pageColumns, textIndex
+
+
+def test_mergeIntervals():
+    assert mergeIntervals([(6, 8), (0, 2), (3, 4), (9, 12)], gap=1) == [(0, 4), (6, 12)]
+    assert mergeIntervals([(0, 10), (2, 3)]) == [(0, 10)]
+
+def test_detectColumns():
+    title = (50, 50, 550, 80, 2)
+    left = [ (50, y, 290, y+100, 5) for y in (100, 220) ]
+    right = [ (310, y, 550, y+100, 5) for y in (100, 220) ]
+    figure = (50, 340, 550, 500, 0)
+    below = [ (50, 520, 290, 700, 8), (310, 520, 550, 600, 4) ]
+    # a page number in the gutter belongs to no column
+    number = (295, 720, 305, 730, 1)
+    blocks = [title] + left + right + [figure] + below + [number]
+    assert detectColumns(blocks) == [ title[:4], (50, 100, 290, 320),
+            (310, 100, 550, 320), figure[:4], below[0][:4], below[1][:4] ]
+    # a single column is kept as a whole
+    assert detectColumns(left + [title]) == [(50, 50, 550, 320)]
+    assert detectColumns([]) == []
+
+def test_pageColumns(samplePdf):
+    pymupdf = pytest.importorskip('pymupdf')
+    with pymupdf.open(stream=samplePdf, filetype="pdf") as doc:
+        columns = pageColumns(doc[0])
+        assert len(columns) == 2
+        (l0, t0, r0, b0), (l1, t1, r1, b1) = columns
+        # the left column starts at 72 points, the right one at 310 points
+        assert abs(l0 - 69/595) < 0.01 and abs(l1 - 307/595) < 0.01
+        assert r0 > 0.5 and r1 < 0.2
+        assert pageColumns(doc[0]) == columns
+
+def test_textIndex(samplePdf):
+    index = textIndex(3, data=samplePdf, workers=1)
+    assert textIndex(3, data=samplePdf) is index
+    # both columns of page n start with "Page n."
+    hits = index.search(r'page\s+2\.')
+    assert [ idx for idx, cv in hits ] == [1, 1]
+    l, t, r, b = hits[0][1]
+    assert l < 0.5 < r
+    # padding (top, right, bottom, left in points) enlarges the selection
+    idx, (pl, pt, pr, pb) = index.search(r'page\s+2\.', (10, 0, 0, 20))[0]
+    assert abs(l - pl - 20/595) < 1e-9 and abs(t - pt - 10/842) < 1e-9 and pr == r
+    assert index.search('no such words') == []